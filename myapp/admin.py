@@ -1,7 +1,25 @@
 from django.contrib import admin
-from django.utils.html import format_html
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 from django.utils import timezone
-from .models import UserProfile, ScamReport, ReportComment, ReportVote, Donation, ReportEvidence, ScamEvidence
+from . import counters, reputation
+from .image_index import similar_to_evidence
+from .models import UserProfile, ScamReport, ReportComment, ReportVote, Donation, ReportEvidence, ScamEvidence, AnalysisJob, EvidenceBlob
+
+def similar_evidence_links(obj):
+    """
+    Links to the reports holding evidence that looks like obj's image
+    """
+    if not obj or not obj.pk or not obj.file:
+        return '-'
+    matches = similar_to_evidence(obj, limit=10)
+    if not matches:
+        return 'None found'
+    return format_html_join(
+        format_html('<br>'), '<a href="{}">{}</a> ({} bits apart)',
+        ((reverse('admin:myapp_scamreport_change', args=[row.report_id]), row.report.title, distance)
+         for distance, row in matches),
+    )
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -26,14 +44,14 @@ class ScamReportAdmin(admin.ModelAdmin):
     list_display = ('title', 'reporter', 'report_type', 'status', 'submission_date', 'is_public', 'view_count')
     list_filter = ('status', 'report_type', 'is_public', 'submission_date')
     search_fields = ('title', 'description', 'scam_url')
-    readonly_fields = ('submission_date', 'view_count')
+    readonly_fields = ('submission_date', 'view_count', 'analyzed_at')
     date_hierarchy = 'submission_date'
     fieldsets = (
         ('Report Details', {
             'fields': ('title', 'reporter', 'report_type', 'description', 'scam_url')
         }),
         ('Domain Information', {
-            'fields': ('domain_age', 'domain_registrar', 'domain_country', 'is_blacklisted', 'blacklist_details')
+            'fields': ('domain_age', 'domain_registrar', 'domain_country', 'is_blacklisted', 'blacklist_details', 'analyzed_at')
         }),
         ('Status', {
             'fields': ('status', 'is_public')
@@ -48,23 +66,26 @@ class ScamReportAdmin(admin.ModelAdmin):
     actions = ['approve_reports', 'flag_reports', 'unflag_reports']
 
     def approve_reports(self, request, queryset):
-        queryset.update(
-            status='verified',
+        reputation.update_status(
+            queryset,
+            'verified',
             verified_by=request.user,
             verification_date=timezone.now()
         )
     approve_reports.short_description = "Mark selected reports as verified"
 
     def flag_reports(self, request, queryset):
-        queryset.update(
-            is_flagged=True,
+        counters.update_flag(
+            queryset,
+            True,
             flagged_by=request.user
         )
     flag_reports.short_description = "Flag selected reports as suspicious"
 
     def unflag_reports(self, request, queryset):
-        queryset.update(
-            is_flagged=False,
+        counters.update_flag(
+            queryset,
+            False,
             flagged_by=None
         )
     unflag_reports.short_description = "Remove flag from selected reports"
@@ -115,11 +136,11 @@ class ReportEvidenceAdmin(admin.ModelAdmin):
     list_display = ('title', 'report', 'user_email', 'uploaded_at', 'is_verified', 'verification_status')
     list_filter = ('is_verified', 'uploaded_at')
     search_fields = ('title', 'description', 'report__title', 'user__email')
-    readonly_fields = ('uploaded_at', 'verification_date')
+    readonly_fields = ('uploaded_at', 'verification_date', 'similar_evidence')
     date_hierarchy = 'uploaded_at'
     fieldsets = (
         ('Evidence Details', {
-            'fields': ('report', 'user', 'title', 'description', 'file')
+            'fields': ('report', 'user', 'title', 'description', 'file', 'similar_evidence')
         }),
         ('Verification', {
             'fields': ('is_verified', 'verified_by', 'verification_date')
@@ -134,6 +155,10 @@ class ReportEvidenceAdmin(admin.ModelAdmin):
         return obj.user.email if obj.user else 'Anonymous'
     user_email.short_description = 'Uploaded By'
 
+    def similar_evidence(self, obj):
+        return similar_evidence_links(obj)
+    similar_evidence.short_description = 'Similar evidence'
+
     def verification_status(self, obj):
         if obj.is_verified:
             return format_html('<span style="color: green;">✓ Verified by {}</span>', obj.verified_by.email if obj.verified_by else 'Unknown')
@@ -161,11 +186,11 @@ class ScamEvidenceAdmin(admin.ModelAdmin):
     list_display = ('report', 'user_email', 'file_type', 'uploaded_at')
     list_filter = ('file_type', 'uploaded_at')
     search_fields = ('report__title', 'description')
-    readonly_fields = ('uploaded_at', 'file_type', 'metadata')
+    readonly_fields = ('uploaded_at', 'file_type', 'metadata', 'similar_evidence')
     date_hierarchy = 'uploaded_at'
     fieldsets = (
         ('Evidence Details', {
-            'fields': ('report', 'file', 'description')
+            'fields': ('report', 'file', 'description', 'similar_evidence')
         }),
         ('File Information', {
             'fields': ('file_type', 'metadata')
@@ -179,6 +204,10 @@ class ScamEvidenceAdmin(admin.ModelAdmin):
         return obj.report.reporter.email if obj.report.reporter else 'Anonymous'
     user_email.short_description = 'Uploaded By'
 
+    def similar_evidence(self, obj):
+        return similar_evidence_links(obj)
+    similar_evidence.short_description = 'Similar evidence'
+
 @admin.register(ReportVote)
 class ReportVoteAdmin(admin.ModelAdmin):
     list_display = ('report', 'user', 'vote_type', 'vote_date')
@@ -216,6 +245,30 @@ class DonationAdmin(admin.ModelAdmin):
         return f"{obj.amount} {obj.currency}"
     amount_display.short_description = 'Amount'
 
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('report', 'status', 'attempts', 'run_after', 'locked_by', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('report__title', 'report__scam_url')
+    readonly_fields = ('created_at', 'finished_at', 'locked_by', 'locked_at', 'last_error')
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        queryset.update(
+            status='queued',
+            run_after=timezone.now(),
+            locked_by='',
+            locked_at=None
+        )
+    retry_jobs.short_description = "Queue selected jobs again"
+
+@admin.register(EvidenceBlob)
+class EvidenceBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'ref_count', 'created_at')
+    search_fields = ('sha256', 'name')
+    # Maintained by the evidence storage, see reconcile_evidence_blobs
+    readonly_fields = ('sha256', 'name', 'size', 'ref_count', 'dhash', 'thumbnails_at', 'created_at')
+
 # Custom admin site configuration
 admin.site.site_header = 'Scam Report Administration'
 admin.site.site_title = 'Scam Report Admin Portal'
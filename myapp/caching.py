@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Thread-safe in-process LRU cache with a per-entry TTL.
+
+    Used in front of slower shared stores (the database, external services)
+    so hot keys are served without any I/O.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+_MISSING = object()
+
+
+class RefreshingIndex:
+    """
+    Base of the in-memory indexes of database rows (domain index, domain
+    filter, image index).
+
+    An index is loaded on first use, re-reads the rows whose timestamp_field
+    moved every <setting>_REFRESH_INTERVAL seconds and rebuilds from every
+    row every <setting>_REBUILD_INTERVAL seconds. Changed rows are read back
+    to REFRESH_OVERLAP before the newest timestamp seen, which covers
+    transactions that commit out of order, so _apply() must be idempotent.
+    Subclasses provide _rows() and _apply().
+    """
+
+    setting = None
+    description = 'index'
+    fields = ()
+    timestamp_field = 'last_updated'
+    default_rebuild_interval = 60 * 60
+    chunk_size = 5000
+    REFRESH_OVERLAP = timedelta(seconds=60)
+
+    def __init__(self, refresh_interval=None, rebuild_interval=None):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self._watermark = None
+        self._loaded = False
+        self._last_refresh = 0
+        self._last_rebuild = 0
+        self._lock = threading.Lock()
+
+    def _refresh_interval(self):
+        if self.refresh_interval is not None:
+            return self.refresh_interval
+        return getattr(settings, f'{self.setting}_REFRESH_INTERVAL', 30)
+
+    def _rebuild_interval(self):
+        if self.rebuild_interval is not None:
+            return self.rebuild_interval
+        return getattr(settings, f'{self.setting}_REBUILD_INTERVAL', self.default_rebuild_interval)
+
+    def _rows(self, full):
+        """
+        Queryset of the rows the index is built from
+        """
+        raise NotImplementedError
+
+    def _apply(self, rows, full):
+        """
+        Apply an iterable of `fields` tuples, replacing the contents with
+        full=True; returns the count refresh() reports
+        """
+        raise NotImplementedError
+
+    def refresh(self, full=False):
+        """
+        Apply rows changed since the last refresh, or reload everything
+        with full=True
+        """
+        with self._lock:
+            full = full or not self._loaded
+            rows = self._rows(full)
+            watermark = None if full else self._watermark
+            if watermark is not None:
+                rows = rows.filter(**{f'{self.timestamp_field}__gte': watermark - self.REFRESH_OVERLAP})
+
+            def changed():
+                nonlocal watermark
+                for *fields, stamp in rows.values_list(*self.fields, self.timestamp_field).iterator(
+                    chunk_size=self.chunk_size
+                ):
+                    if watermark is None or stamp > watermark:
+                        watermark = stamp
+                    yield fields
+
+            count = self._apply(changed(), full)
+            self._watermark = watermark
+            self._loaded = True
+            self._last_refresh = time.monotonic()
+            if full:
+                self._last_rebuild = self._last_refresh
+            return count
+
+    def ensure_fresh(self):
+        """
+        Load the index if needed and refresh it once it is due. A refresh
+        already running in another thread is not waited for.
+        """
+        if not self._loaded:
+            self.refresh()
+            return
+        now = time.monotonic()
+        if now - self._last_refresh < self._refresh_interval() or self._lock.locked():
+            return
+        try:
+            self.refresh(full=now - self._last_rebuild >= self._rebuild_interval())
+        except Exception:
+            logger.exception('Refreshing the %s failed, serving the previous state', self.description)
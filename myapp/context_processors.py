@@ -1,14 +1,22 @@
-from .models import ScamReport
+from django.core.exceptions import ObjectDoesNotExist
+
+
+def get_profile(user):
+    """
+    The user's profile or None; ProfileModelBackend already loaded it
+    with the session user
+    """
+    if not user.is_authenticated:
+        return None
+    try:
+        return user.userprofile
+    except ObjectDoesNotExist:
+        return None
+
 
 def user_profile_info(request):
-    if request.user.is_authenticated:
-        verified_reports_count = ScamReport.objects.filter(
-            user=request.user,
-            status='verified'
-        ).count()
-    else:
-        verified_reports_count = 0
-    
+    profile = get_profile(request.user)
     return {
-        'verified_reports_count': verified_reports_count
-    } 
\ No newline at end of file
+        'user_profile': profile,
+        'verified_reports_count': profile.verified_reports if profile else 0,
+    }
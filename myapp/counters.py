@@ -0,0 +1,132 @@
+"""
+Denormalized per-user report counters.
+
+UserProfile.total_reports, verified_reports and flagged_reports count a
+user's reports, their verified reports and their flagged reports. Report
+saves and deletes adjust them through signals with F() expressions, in
+the transaction that changes the report; reputation.update_status() and
+update_flag() do the same for the QuerySet.update() based admin actions.
+compute_counters() rebuilds them with a single GROUP BY and reconcile()
+writes back any drift.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from .models import ScamReport, UserProfile
+from .reputation import compute_scores
+
+COUNTERS = ('total_reports', 'verified_reports', 'flagged_reports')
+
+
+def _contribution(state):
+    """
+    Counter values one report adds to its reporter, from its
+    (reporter_id, status, is_flagged) state
+    """
+    _, status, is_flagged = state
+    return {'total_reports': 1, 'verified_reports': int(status == 'verified'), 'flagged_reports': int(bool(is_flagged))}
+
+
+def adjust(user_id, deltas):
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not user_id or not deltas:
+        return
+    updates = {name: F(name) + delta for name, delta in deltas.items()}
+    if UserProfile.objects.filter(user_id=user_id).update(**updates):
+        return
+    profile, created = UserProfile.objects.get_or_create(user_id=user_id)
+    if created:
+        # A new profile starts from the full counts, which already include this change
+        UserProfile.objects.filter(id=profile.id).update(**compute_counters(reporter=user_id).get(user_id, {}))
+    else:
+        UserProfile.objects.filter(user_id=user_id).update(**updates)
+
+
+def record_change(old_state, new_state):
+    """
+    Apply a report being created (old_state None), changed, or deleted
+    (new_state None); states are ScamReport.tracked_state() tuples
+    """
+    if old_state == new_state:
+        return
+    deltas = {}
+    for state, sign in ((old_state, -1), (new_state, 1)):
+        if state is None or not state[0]:
+            continue
+        user_deltas = deltas.setdefault(state[0], Counter())
+        for name, value in _contribution(state).items():
+            user_deltas[name] += sign * value
+    for user_id, user_deltas in deltas.items():
+        adjust(user_id, user_deltas)
+
+
+def update_flag(queryset, is_flagged, **fields):
+    """
+    QuerySet.update() of is_flagged keeping flagged_reports in step, used
+    by admin bulk actions. Returns the number of reports updated.
+    """
+    sign = 1 if is_flagged else -1
+    with transaction.atomic():
+        per_reporter = list(
+            queryset.exclude(is_flagged=is_flagged).filter(reporter__isnull=False)
+            .values('reporter').annotate(reports=Count('id')).order_by()
+        )
+        updated = queryset.update(is_flagged=is_flagged, **fields)
+        for row in per_reporter:
+            adjust(row['reporter'], {'flagged_reports': sign * row['reports']})
+    return updated
+
+
+def compute_counters(reporter=None):
+    """
+    Return {user_id: {counter: value}} from the reports table in one GROUP BY query
+    """
+    reports = ScamReport.objects.filter(reporter__isnull=False)
+    if reporter is not None:
+        reports = reports.filter(reporter=reporter)
+    rows = reports.values('reporter').annotate(
+        total_reports=Count('id'),
+        verified_reports=Count('id', filter=Q(status='verified')),
+        flagged_reports=Count('id', filter=Q(is_flagged=True)),
+    ).order_by()
+    return {row.pop('reporter'): row for row in rows}
+
+
+def reconcile(batch_size=1000, dry_run=False):
+    """
+    Rewrite the counters of every profile that drifted from the reports
+    table and create missing profiles of reporters. Returns the
+    [(user_id, stored, actual)] found, dicts of the counters that differ.
+    """
+    counts = compute_counters()
+    zero = dict.fromkeys(COUNTERS, 0)
+    drift = []
+    changed = []
+    with transaction.atomic():
+        for profile in UserProfile.objects.only('id', 'user_id', *COUNTERS).iterator(chunk_size=batch_size):
+            actual = counts.pop(profile.user_id, zero)
+            stored = {name: getattr(profile, name) for name in COUNTERS}
+            if stored != actual:
+                differing = [name for name in COUNTERS if stored[name] != actual[name]]
+                drift.append((
+                    profile.user_id, {name: stored[name] for name in differing}, {name: actual[name] for name in differing}
+                ))
+                for name in COUNTERS:
+                    setattr(profile, name, actual[name])
+                changed.append(profile)
+            if len(changed) >= batch_size:
+                if not dry_run:
+                    UserProfile.objects.bulk_update(changed, COUNTERS)
+                changed = []
+        if not dry_run:
+            UserProfile.objects.bulk_update(changed, COUNTERS)
+        # Reporters without a profile, rare since any report change creates one
+        for user_id, actual in counts.items():
+            drift.append((user_id, None, actual))
+            if not dry_run:
+                UserProfile.objects.create(
+                    user_id=user_id, reputation_score=compute_scores(reporter=user_id).get(user_id, 0), **actual
+                )
+    return drift
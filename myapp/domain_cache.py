@@ -0,0 +1,114 @@
+"""
+Shared cache for the WHOIS, DNS and IP lookups done by analyze_url.
+
+Results are stored per normalized domain in the DomainIntel table so every
+worker process shares them, with an in-process LRU in front so repeated
+lookups for a hot domain never leave the process.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from . import urlcanon
+from .caching import LRUCache
+from .models import DomainIntel
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTLS = {
+    'whois': 24 * 60 * 60,
+    'dns': 60 * 60,
+    'ip': 60 * 60,
+    'negative': 5 * 60,
+}
+
+_local = LRUCache(maxsize=getattr(settings, 'DOMAIN_INTEL_LRU_SIZE', 2048))
+
+
+def get_ttl(kind, negative=False):
+    ttls = {**DEFAULT_TTLS, **getattr(settings, 'DOMAIN_INTEL_TTLS', {})}
+    if negative:
+        return min(ttls['negative'], ttls[kind])
+    return ttls[kind]
+
+
+def normalize_domain(value):
+    """
+    Reduce a URL or host name to the canonical host used as the cache key
+    """
+    return urlcanon.canonicalize_host(value)
+
+
+def get_cached(domain, kind):
+    """
+    Return the cached payload for (domain, kind) or None on a miss.
+    Payloads are shared between callers and must be treated as read-only.
+    """
+    key = (domain, kind)
+    payload = _local.get(key)
+    if payload is not None:
+        return payload
+
+    now = timezone.now()
+    try:
+        row = DomainIntel.objects.filter(
+            domain=domain, kind=kind, expires_at__gt=now
+        ).values_list('payload', 'expires_at').first()
+    except DatabaseError as e:
+        logger.warning('Domain intel cache read failed: %s', e)
+        return None
+
+    if row is None:
+        return None
+    payload, expires_at = row
+    _local.set(key, payload, ttl=(expires_at - now).total_seconds())
+    return payload
+
+
+def store(domain, kind, payload, negative=False):
+    ttl = get_ttl(kind, negative)
+    _local.set((domain, kind), payload, ttl=ttl)
+
+    now = timezone.now()
+    try:
+        DomainIntel.objects.update_or_create(
+            domain=domain,
+            kind=kind,
+            defaults={
+                'payload': payload,
+                'is_negative': negative,
+                'fetched_at': now,
+                'expires_at': now + timedelta(seconds=ttl),
+            }
+        )
+    except DatabaseError as e:
+        logger.warning('Domain intel cache write failed: %s', e)
+
+
+def get_or_fetch(domain, kind, fetch, is_negative):
+    """
+    Serve (domain, kind) from the cache, calling fetch(domain) on a miss.
+
+    is_negative(payload) decides whether a fresh result is a failure that
+    should only be cached for the shorter negative TTL.
+    """
+    payload = get_cached(domain, kind)
+    if payload is None:
+        payload = fetch(domain)
+        store(domain, kind, payload, negative=is_negative(payload))
+    return payload
+
+
+def purge_expired():
+    """
+    Delete expired rows, returns the number removed
+    """
+    deleted, _ = DomainIntel.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
+
+
+def clear_local():
+    _local.clear()
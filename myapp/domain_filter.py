@@ -0,0 +1,200 @@
+"""
+Compact in-process set of reported domains.
+
+Each reported host is reduced to a 64-bit fingerprint. A Bloom filter
+answers most lookups, which are for domains nobody reported, without
+touching anything else. Positives are confirmed against a sorted array of
+the fingerprints, so a Bloom false positive never reaches the caller (a
+64-bit fingerprint collision is possible but vanishingly rare).
+
+The filter is loaded at worker startup (see myapp.warmup) and refreshed
+from ScamReport.last_updated deltas every DOMAIN_FILTER_REFRESH_INTERVAL
+seconds, see caching.RefreshingIndex. Hosts added by a delta go into a small set that is merged into
+the sorted array once it grows; hosts whose last report was rejected or
+removed are masked until the next full rebuild, which also drops their
+stale Bloom bits.
+"""
+import bisect
+import hashlib
+import math
+from array import array
+
+from django.conf import settings
+
+from . import urlcanon
+from .caching import RefreshingIndex
+from .models import ScamReport
+
+
+def fingerprint(host):
+    return int.from_bytes(hashlib.blake2b(host.encode(), digest_size=8).digest(), 'little')
+
+
+class BloomFilter:
+    """
+    Bloom filter over 64-bit fingerprints using double hashing
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1024)
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, fp):
+        h1 = fp & 0xFFFFFFFF
+        h2 = (fp >> 32) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, fp):
+        bits = self.bits
+        for position in self._positions(fp):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, fp):
+        bits = self.bits
+        for position in self._positions(fp):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+class DomainFilter(RefreshingIndex):
+    setting = 'DOMAIN_FILTER'
+    description = 'domain filter'
+    fields = ('scam_url', 'domain', 'status', 'is_public')
+    default_rebuild_interval = 6 * 60 * 60
+
+    def __init__(self, error_rate=None, refresh_interval=None, rebuild_interval=None):
+        super().__init__(refresh_interval, rebuild_interval)
+        self.error_rate = error_rate or getattr(settings, 'DOMAIN_FILTER_ERROR_RATE', 0.01)
+        self._bloom = BloomFilter(0, self.error_rate)
+        self._sorted = array('Q')
+        self._added = set()
+        self._removed = set()
+
+    def __len__(self):
+        return len(self._sorted) + len(self._added) - len(self._removed)
+
+    def build(self, hosts, capacity=None):
+        """
+        Replace the contents with the given hosts
+        """
+        fingerprints = array('Q')
+        previous = None
+        # Sorting a list and skipping repeats needs far less memory than a set
+        for fp in sorted(map(fingerprint, hosts)):
+            if fp != previous:
+                fingerprints.append(fp)
+                previous = fp
+        bloom = BloomFilter(capacity or int(len(fingerprints) * 1.25), self.error_rate)
+        for fp in fingerprints:
+            bloom.add(fp)
+        self._bloom, self._sorted = bloom, fingerprints
+        self._added, self._removed = set(), set()
+
+    def add(self, host):
+        fp = fingerprint(host)
+        self._removed.discard(fp)
+        if not self._in_sorted(fp):
+            self._bloom.add(fp)
+            self._added.add(fp)
+        if len(self._added) > max(1024, len(self._sorted) // 64):
+            self._merge()
+
+    def discard(self, host):
+        fp = fingerprint(host)
+        self._added.discard(fp)
+        if self._in_sorted(fp):
+            self._removed.add(fp)
+
+    def _merge(self):
+        merged = self._sorted.tolist() + list(self._added)
+        merged.sort()
+        self._sorted = array('Q', merged)
+        self._added = set()
+
+    def _in_sorted(self, fp):
+        values = self._sorted
+        i = bisect.bisect_left(values, fp)
+        return i < len(values) and values[i] == fp
+
+    def __contains__(self, host):
+        fp = fingerprint(host)
+        if fp not in self._bloom or fp in self._removed:
+            return False
+        return fp in self._added or self._in_sorted(fp)
+
+    def match(self, host):
+        """
+        Return the host or the closest parent domain that has been reported, or None
+        """
+        for domain in urlcanon.parent_domains(host):
+            if domain in self:
+                return domain
+        return None
+
+    def nbytes(self):
+        """
+        Approximate memory used by the filter and the fingerprint arrays
+        """
+        sets = len(self._added) + len(self._removed)
+        return self._bloom.nbytes + self._sorted.itemsize * len(self._sorted) + sets * 64
+
+    @staticmethod
+    def _active(queryset):
+        return queryset.filter(is_public=True).exclude(status='rejected')
+
+    def _forget(self, host):
+        # A host stays in the filter while any other report still covers it
+        if not self._active(ScamReport.objects.filter(domain_key=urlcanon.domain_key(host))).exists():
+            self.discard(host)
+
+    def forget(self, host):
+        """
+        Drop a host whose report was deleted, unless other reports cover it
+        """
+        if host and self._loaded:
+            with self._lock:
+                self._forget(host)
+
+    def _rows(self, full):
+        rows = ScamReport.objects.order_by()
+        return self._active(rows) if full else rows
+
+    def _apply(self, rows, full):
+        if full:
+            hosts = [domain or urlcanon.canonicalize_host(scam_url) for scam_url, domain, _, _ in rows]
+            self.build(host for host in hosts if host)
+            return len(hosts)
+        count = 0
+        gone = set()
+        for scam_url, domain, status, is_public in rows:
+            host = domain or urlcanon.canonicalize_host(scam_url)
+            if host:
+                if is_public and status != 'rejected':
+                    self.add(host)
+                else:
+                    gone.add(host)
+            count += 1
+        for host in gone:
+            self._forget(host)
+        return count
+
+    def is_reported(self, url):
+        """
+        Return the reported domain covering a URL, or None
+        """
+        host = urlcanon.canonicalize_host(url)
+        if not host:
+            return None
+        self.ensure_fresh()
+        return self.match(host)
+
+
+domain_filter = DomainFilter()
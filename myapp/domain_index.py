@@ -0,0 +1,152 @@
+"""
+In-memory index of reported domains for bulk URL checks.
+
+Every public, non-rejected report contributes to the stats of its
+canonical host. A URL is checked by looking up its host and each parent
+domain in a dict, so a report on example.com also covers shop.example.com;
+reports on a bare public suffix (github.io) only match exactly.
+
+The index is loaded on first use and then refreshed incrementally from
+ScamReport.last_updated every DOMAIN_INDEX_REFRESH_INTERVAL seconds, see
+caching.RefreshingIndex. Deletions reach other processes at the periodic
+full rebuild.
+"""
+from . import urlcanon
+from .caching import RefreshingIndex
+from .models import ScamReport
+
+VERDICT_SCAM = 'scam'
+VERDICT_SUSPICIOUS = 'suspicious'
+VERDICT_UNKNOWN = 'unknown'
+VERDICT_INVALID = 'invalid'
+
+_UNKNOWN = {'verdict': VERDICT_UNKNOWN}
+_INVALID = {'verdict': VERDICT_INVALID}
+
+REPORT_TYPES = [value for value, _ in ScamReport.REPORT_TYPES]
+_TYPE_INDEX = {value: i for i, value in enumerate(REPORT_TYPES)}
+
+
+class DomainIndex(RefreshingIndex):
+    setting = 'DOMAIN_INDEX'
+    description = 'domain index'
+    fields = ('id', 'scam_url', 'domain', 'status', 'report_type', 'is_public')
+
+    def __init__(self, refresh_interval=None, rebuild_interval=None):
+        super().__init__(refresh_interval, rebuild_interval)
+        # host -> (reports, verified, per-type counts, is public suffix); flat
+        # tuples of ints let the garbage collector untrack them, a large index
+        # of mutable objects would make every collection slow
+        self._domains = {}
+        # report id -> (host, verified, report_type) as last applied
+        self._reports = {}
+
+    def __len__(self):
+        return len(self._domains)
+
+    def _add(self, host, verified, report_type, sign=1):
+        stats = self._domains.get(host)
+        if stats is None:
+            stats = (0, 0, (0,) * len(REPORT_TYPES), urlcanon.is_public_suffix(host))
+        reports, verified_count, type_counts, public_suffix = stats
+        i = _TYPE_INDEX.get(report_type, len(REPORT_TYPES) - 1)
+        type_counts = type_counts[:i] + (type_counts[i] + sign,) + type_counts[i + 1:]
+        if reports + sign:
+            self._domains[host] = (reports + sign, verified_count + sign * verified, type_counts, public_suffix)
+        else:
+            del self._domains[host]
+
+    def _remove(self, host, verified, report_type):
+        self._add(host, verified, report_type, sign=-1)
+
+    def apply(self, report_id, scam_url, domain, status, report_type, is_public):
+        """
+        Bring one report's contribution up to date; safe to repeat
+        """
+        entry = None
+        if is_public and status != 'rejected':
+            host = domain or urlcanon.canonicalize_host(scam_url)
+            if host:
+                entry = (host, status == 'verified', report_type)
+        old = self._reports.get(report_id)
+        if old == entry:
+            return
+        if old is not None:
+            self._remove(*old)
+            del self._reports[report_id]
+        if entry is not None:
+            self._add(*entry)
+            self._reports[report_id] = entry
+
+    def discard(self, report_id):
+        with self._lock:
+            old = self._reports.pop(report_id, None)
+            if old is not None:
+                self._remove(*old)
+
+    def _rows(self, full):
+        return ScamReport.objects.order_by()
+
+    def _apply(self, rows, full):
+        # A full rebuild fills a fresh index and swaps it in at the end,
+        # so lookups keep seeing the previous state meanwhile
+        target = DomainIndex() if full else self
+        count = 0
+        for fields in rows:
+            target.apply(*fields)
+            count += 1
+        if full:
+            self._domains, self._reports = target._domains, target._reports
+        return count
+
+    def lookup(self, host):
+        """
+        Return (matched host, stats) for the host or its closest reported
+        parent, verified reports taking precedence, or None
+        """
+        domains = self._domains
+        stats = domains.get(host)
+        if stats is not None and stats[1]:
+            return host, stats
+        best = (host, stats) if stats is not None else None
+        dot = host.find('.')
+        while dot >= 0:
+            host = host[dot + 1:]
+            parent = domains.get(host)
+            if parent is not None and not parent[3]:
+                if parent[1]:
+                    return host, parent
+                if best is None:
+                    best = (host, parent)
+            dot = host.find('.')
+        return best
+
+    def check(self, url):
+        """
+        Verdict for one URL. Misses share one dict each, so callers must
+        not modify the results.
+        """
+        host = urlcanon.canonicalize_host(url)
+        if not host:
+            return _INVALID
+        match = self.lookup(host)
+        if match is None:
+            return _UNKNOWN
+        domain, (reports, verified, type_counts, _) = match
+        return {
+            'verdict': VERDICT_SCAM if verified else VERDICT_SUSPICIOUS,
+            'domain': domain,
+            'reports': reports,
+            'verified': verified,
+            'report_types': [value for value, count in zip(REPORT_TYPES, type_counts) if count],
+        }
+
+    def check_urls(self, urls):
+        """
+        Verdicts for a list of URLs, in the same order
+        """
+        self.ensure_fresh()
+        check = self.check
+        return [check(url) for url in urls]
+
+domain_index = DomainIndex()
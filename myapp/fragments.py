@@ -0,0 +1,95 @@
+"""
+Cached HTML fragments of the report page.
+
+The parts of view_report that look the same to every visitor (the report
+body with its URL analysis and evidence, the comments, the recent
+donations and the similar evidence of other reports) are rendered without
+the request and kept in the REPORT_FRAGMENT_CACHE cache under the report
+id and its fragment_version.
+Saving the report stamps a new version, and signals do the same when one
+of its comments, evidence items or donations changes, so an outdated
+fragment is never looked up again and just ages out of the cache. The
+similar evidence also changes with other reports, so it expires after
+SIMILAR_EVIDENCE_TIMEOUT seconds. A warm page costs the one query that
+loads the report.
+
+Forms, CSRF tokens and the staff moderation buttons are rendered per
+request; staff get the comments rendered live with their buttons.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .image_index import similar_to_report
+from .models import ScamReport, detail_prefetches, new_fragment_version
+
+# name -> (template, relations it renders)
+FRAGMENTS = {
+    'body': ('report_body.html', ('evidence',)),
+    'comments': ('report_comments.html', ('comments',)),
+    'donations': ('report_donations.html', ('donations',)),
+    'similar': ('report_similar.html', ()),
+}
+
+# name -> function of the report returning more template context
+FRAGMENT_CONTEXT = {
+    'similar': lambda report: {'similar': similar_to_report(report)},
+}
+
+
+def _cache():
+    return caches[getattr(settings, 'REPORT_FRAGMENT_CACHE', 'default')]
+
+
+def _timeout(name):
+    if name == 'similar':
+        return getattr(settings, 'SIMILAR_EVIDENCE_TIMEOUT', 5 * 60)
+    return getattr(settings, 'REPORT_FRAGMENT_TIMEOUT', 60 * 60)
+
+
+def fragment_key(report, name):
+    return f'report-fragment:{report.id}:{report.fragment_version}:{name}'
+
+
+def invalidate(report_id):
+    """
+    Stamp a new fragment version on a report
+    """
+    if report_id is not None:
+        ScamReport.objects.filter(pk=report_id).update(fragment_version=new_fragment_version())
+
+
+def render_fragments(report, request=None, moderate=False):
+    """
+    {name: HTML} of every fragment of a report, rendering and caching the
+    ones missing from the cache. With moderate=True the comments are
+    rendered for the request with moderation buttons and not cached.
+    """
+    cache = _cache()
+    names = [name for name in FRAGMENTS if not (moderate and name == 'comments')]
+    keys = {name: fragment_key(report, name) for name in names}
+    cached = cache.get_many(keys.values())
+    fragments = {name: cached[key] for name, key in keys.items() if key in cached}
+
+    missing = [name for name in names if name not in fragments]
+    if moderate:
+        missing.append('comments')
+    relations = [relation for name in missing for relation in FRAGMENTS[name][1]]
+    if relations:
+        prefetch_related_objects([report], *detail_prefetches(*relations))
+    rendered = {}
+    for name in missing:
+        template = FRAGMENTS[name][0]
+        if name == 'comments' and moderate:
+            fragments[name] = render_to_string(template, {'report': report, 'moderate': True}, request)
+            continue
+        context = {'report': report}
+        if name in FRAGMENT_CONTEXT:
+            context.update(FRAGMENT_CONTEXT[name](report))
+        fragments[name] = render_to_string(template, context)
+        rendered.setdefault(_timeout(name), {})[keys[name]] = fragments[name]
+    for timeout, values in rendered.items():
+        cache.set_many(values, timeout)
+    return {name: mark_safe(html) for name, html in fragments.items()}
@@ -0,0 +1,226 @@
+"""
+IP geolocation for UserTrackingMiddleware.
+
+Locations come from a pluggable resolver backend configured with the
+GEOIP_RESOLVER setting, in the same shape as CACHES:
+
+    GEOIP_RESOLVER = {
+        'BACKEND': 'myapp.geolocation.CSVRangeResolver',
+        'OPTIONS': {'path': BASE_DIR / 'geoip' / 'ip_ranges.csv'},
+    }
+
+Results are kept in an in-process LRU. A lookup that misses the cache is
+resolved on a background thread and returns None straight away, so the
+request never waits for geolocation.
+"""
+import bisect
+import csv
+import ipaddress
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .caching import LRUCache
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_LOCATION = "Konum bilgisi alınamadı"
+
+
+def format_location(city=None, country=None, isp=None):
+    if not city and not country:
+        return None
+    location = ', '.join(part for part in (city, country) if part)
+    if isp:
+        location += f' ({isp})'
+    return location
+
+
+class GeoResolver:
+    """
+    Base class for resolver backends, lookup() returns a location string or None
+    """
+
+    def lookup(self, ip):
+        raise NotImplementedError
+
+
+class CSVRangeResolver(GeoResolver):
+    """
+    Offline lookups from a CSV range table with the columns
+    start_ip,end_ip,city,country[,isp]. Ranges are loaded once into sorted
+    arrays per IP version and searched with bisect.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tables = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        tables = {4: ([], [], []), 6: ([], [], [])}
+        if not self.path:
+            logger.warning('No GeoIP range table configured, locations will be unknown')
+            return tables
+        try:
+            with open(self.path, newline='', encoding='utf-8') as f:
+                rows = []
+                for row in csv.reader(f):
+                    if not row or row[0].startswith('#') or row[0] == 'start_ip':
+                        continue
+                    start = ipaddress.ip_address(row[0].strip())
+                    end = ipaddress.ip_address(row[1].strip())
+                    fields = [value.strip() for value in row[2:5]]
+                    rows.append((start.version, int(start), int(end),
+                                 format_location(*fields)))
+        except (OSError, ValueError) as e:
+            logger.warning('Could not load GeoIP range table %s: %s', self.path, e)
+            return tables
+
+        rows.sort()
+        for version, start, end, location in rows:
+            starts, ends, locations = tables[version]
+            starts.append(start)
+            ends.append(end)
+            locations.append(location)
+        return tables
+
+    def lookup(self, ip):
+        if self._tables is None:
+            with self._lock:
+                if self._tables is None:
+                    self._tables = self._load()
+        address = ipaddress.ip_address(ip)
+        starts, ends, locations = self._tables[address.version]
+        value = int(address)
+        i = bisect.bisect_right(starts, value) - 1
+        if i >= 0 and value <= ends[i]:
+            return locations[i]
+        return None
+
+
+class MMDBResolver(GeoResolver):
+    """
+    Offline lookups from a MaxMind-style .mmdb file, needs the maxminddb package
+    """
+
+    def __init__(self, path=None):
+        try:
+            import maxminddb
+        except ImportError:
+            raise ImproperlyConfigured('MMDBResolver requires the maxminddb package')
+        self._reader = maxminddb.open_database(str(path))
+
+    def lookup(self, ip):
+        record = self._reader.get(ip)
+        if not record:
+            return None
+        city = record.get('city', {}).get('names', {}).get('en')
+        country = record.get('country', {}).get('names', {}).get('en')
+        return format_location(city, country, record.get('isp'))
+
+
+class IPAPIResolver(GeoResolver):
+    """
+    Online lookups against ip-api.com (or a compatible server)
+    """
+
+    def __init__(self, base_url='http://ip-api.com/json/', timeout=3):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def lookup(self, ip):
+        response = requests.get(f'{self.base_url}{ip}', timeout=self.timeout)
+        data = response.json()
+        if data.get('status') == 'success':
+            return format_location(data.get('city'), data.get('country'), data.get('isp'))
+        return None
+
+
+def get_resolver():
+    config = getattr(settings, 'GEOIP_RESOLVER', {})
+    backend = import_string(config.get('BACKEND', 'myapp.geolocation.CSVRangeResolver'))
+    options = dict(config.get('OPTIONS', {}))
+    if backend is CSVRangeResolver:
+        options.setdefault('path', getattr(settings, 'GEOIP_DATABASE', None))
+    return backend(**options)
+
+
+def _is_public(ip):
+    try:
+        return ipaddress.ip_address(ip).is_global
+    except ValueError:
+        return False
+
+
+class Geolocator:
+    """
+    Cache in front of a resolver; misses are resolved in the background
+    """
+
+    def __init__(self, resolver=None, maxsize=None, ttl=None, workers=None):
+        self._resolver = resolver
+        self.cache = LRUCache(
+            maxsize=maxsize or getattr(settings, 'GEOIP_CACHE_SIZE', 10000),
+            ttl=ttl or getattr(settings, 'GEOIP_CACHE_TTL', 24 * 60 * 60)
+        )
+        self._workers = workers or getattr(settings, 'GEOIP_WORKERS', 2)
+        self._executor = None
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    @property
+    def resolver(self):
+        if self._resolver is None:
+            self._resolver = get_resolver()
+        return self._resolver
+
+    def resolve(self, ip):
+        """
+        Resolve and cache an IP synchronously
+        """
+        if not _is_public(ip):
+            return UNKNOWN_LOCATION
+        try:
+            location = self.resolver.lookup(ip) or UNKNOWN_LOCATION
+        except Exception as e:
+            logger.warning('Geolocation of %s failed: %s', ip, e)
+            location = UNKNOWN_LOCATION
+        self.cache.set(ip, location)
+        return location
+
+    def locate(self, ip):
+        """
+        Return the cached location for an IP, or None while it is being resolved
+        """
+        if not ip:
+            return None
+        if not _is_public(ip):
+            return UNKNOWN_LOCATION
+        location = self.cache.get(ip)
+        if location is not None:
+            return location
+        self._schedule(ip)
+        return None
+
+    def _schedule(self, ip):
+        with self._lock:
+            if ip in self._pending or len(self._pending) >= getattr(settings, 'GEOIP_MAX_PENDING', 1000):
+                return
+            self._pending.add(ip)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='geoip')
+        future = self._executor.submit(self.resolve, ip)
+        future.add_done_callback(lambda _: self._done(ip))
+
+    def _done(self, ip):
+        with self._lock:
+            self._pending.discard(ip)
+
+
+geolocator = Geolocator()
@@ -0,0 +1,256 @@
+"""
+In-memory multi-index of evidence image hashes for near-duplicate lookups.
+
+The dHash of every hashed EvidenceBlob is split into BANDS 16-bit bands,
+each kept sorted in a NumPy array. Two hashes at most `radius` bits apart
+agree within radius // BANDS bits on at least one band, so a lookup only
+probes the band values that close to the query's with searchsorted and
+checks the few candidates with a popcount of their XOR. Blobs added since
+the last rebuild sit in a small unsorted tail that is scanned directly.
+
+Like the domain index, it is loaded on first use, refreshed from
+EvidenceBlob.created_at every IMAGE_INDEX_REFRESH_INTERVAL seconds and
+rebuilt every IMAGE_INDEX_REBUILD_INTERVAL seconds (see
+caching.RefreshingIndex), which also picks up backfilled hashes of older
+blobs and drops deleted ones.
+"""
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from .caching import RefreshingIndex
+from .models import EvidenceBlob, ReportEvidence, ScamEvidence
+from .perceptual import HASH_BITS, dhash_file, is_image, to_signed, to_unsigned
+from .storage import evidence_storage
+
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Tail size at which an incremental refresh sorts it into the bands
+MAX_TAIL = 50_000
+
+
+def _flip_masks(bits, radius):
+    """
+    Every `bits`-wide value with at most `radius` bits set
+    """
+    masks = [0]
+    for count in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), count):
+            masks.append(sum(1 << p for p in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+def _band(hashes, band):
+    return (hashes >> np.uint64(band * BAND_BITS)) & np.uint64(BAND_MASK)
+
+
+class ImageIndex(RefreshingIndex):
+    setting = 'IMAGE_INDEX'
+    description = 'image index'
+    fields = ('id', 'dhash')
+    timestamp_field = 'created_at'
+    chunk_size = 10000
+
+    def __init__(self, refresh_interval=None, rebuild_interval=None):
+        super().__init__(refresh_interval, rebuild_interval)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._hashes = np.empty(0, dtype=np.uint64)
+        # Per band: (positions sorted by band value, sorted band values)
+        self._bands = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64))] * BANDS
+        self._tail_ids = []
+        self._tail_hashes = []
+        self._tail_set = set()
+        self._masks = {}
+
+    def __len__(self):
+        return len(self._ids) + len(self._tail_ids)
+
+    def _build(self, ids, hashes):
+        order = np.argsort(ids, kind='stable')
+        ids, hashes = ids[order], hashes[order]
+        bands = []
+        for band in range(BANDS):
+            values = _band(hashes, band)
+            positions = np.argsort(values, kind='stable')
+            bands.append((positions, values[positions]))
+        # Swapped in together, lookups see the old or the new arrays
+        self._ids, self._hashes, self._bands = ids, hashes, bands
+        self._tail_ids, self._tail_hashes, self._tail_set = [], [], set()
+
+    def _contains(self, blob_id):
+        i = np.searchsorted(self._ids, blob_id)
+        return (i < len(self._ids) and self._ids[i] == blob_id) or blob_id in self._tail_set
+
+    def _rows(self, full):
+        return EvidenceBlob.objects.filter(dhash__isnull=False).order_by()
+
+    def _apply(self, rows, full):
+        """
+        Returns the number of blobs added
+        """
+        ids, hashes = [], []
+        for blob_id, value in rows:
+            if full or not self._contains(blob_id):
+                ids.append(blob_id)
+                hashes.append(to_unsigned(value))
+        if full:
+            self._build(np.array(ids, dtype=np.int64), np.array(hashes, dtype=np.uint64))
+        else:
+            self._tail_ids = self._tail_ids + ids
+            self._tail_hashes = self._tail_hashes + hashes
+            self._tail_set = self._tail_set | set(ids)
+            if len(self._tail_ids) > MAX_TAIL:
+                self._build(
+                    np.concatenate([self._ids, np.array(self._tail_ids, dtype=np.int64)]),
+                    np.concatenate([self._hashes, np.array(self._tail_hashes, dtype=np.uint64)]),
+                )
+        return len(ids)
+
+    def _band_masks(self, radius):
+        masks = self._masks.get(radius)
+        if masks is None:
+            masks = self._masks[radius] = _flip_masks(BAND_BITS, radius)
+        return masks
+
+    def lookup(self, value, radius):
+        """
+        [(blob id, distance)] of every hash at most `radius` bits from
+        `value` (an unsigned 64-bit int), nearest first
+        """
+        ids, hashes, bands = self._ids, self._hashes, self._bands
+        tail_ids, tail_hashes = self._tail_ids, self._tail_hashes
+        query = np.uint64(value)
+        masks = self._band_masks(radius // BANDS)
+
+        candidates = []
+        for band, (positions, values) in enumerate(bands):
+            probes = np.unique(_band(query, band) ^ masks)
+            starts = np.searchsorted(values, probes, side='left')
+            ends = np.searchsorted(values, probes, side='right')
+            candidates.extend(positions[start:end] for start, end in zip(starts, ends) if end > start)
+        found_ids, found_distances = [], []
+        if candidates:
+            candidates = np.unique(np.concatenate(candidates))
+            distances = np.bitwise_count(hashes[candidates] ^ query)
+            close = distances <= radius
+            found_ids.append(ids[candidates[close]])
+            found_distances.append(distances[close])
+        if tail_ids:
+            distances = np.bitwise_count(np.array(tail_hashes, dtype=np.uint64) ^ query)
+            close = distances <= radius
+            found_ids.append(np.array(tail_ids, dtype=np.int64)[close])
+            found_distances.append(distances[close])
+        if not found_ids:
+            return []
+        found_ids = np.concatenate(found_ids)
+        found_distances = np.concatenate(found_distances)
+        order = np.argsort(found_distances, kind='stable')
+        return [(int(i), int(d)) for i, d in zip(found_ids[order], found_distances[order])]
+
+
+image_index = ImageIndex()
+
+
+def max_distance():
+    return getattr(settings, 'SIMILAR_EVIDENCE_DISTANCE', 10)
+
+
+def similar_evidence(blobs, exclude_report=None, radius=None, limit=20):
+    """
+    Evidence rows whose image is within `radius` bits of one of `blobs`
+    (an EvidenceBlob queryset), as [(distance, evidence)] nearest first;
+    exact copies are at distance 0
+    """
+    radius = max_distance() if radius is None else radius
+    queries = list(blobs.filter(dhash__isnull=False).values_list('dhash', flat=True))
+    if not queries:
+        return []
+    image_index.ensure_fresh()
+    matches = {}
+    for value in queries:
+        for blob_id, distance in image_index.lookup(to_unsigned(value), radius):
+            if distance < matches.get(blob_id, radius + 1):
+                matches[blob_id] = distance
+    distances = {
+        name: matches[blob_id]
+        for blob_id, name in EvidenceBlob.objects.filter(id__in=matches).values_list('id', 'name')
+    }
+    # Every candidate is ranked before the nearest `limit` rows are loaded,
+    # newest first among equally distant ones
+    candidates = []
+    for model in (ReportEvidence, ScamEvidence):
+        rows = model.objects.filter(file__in=distances)
+        if exclude_report is not None:
+            rows = rows.exclude(report=exclude_report)
+        candidates.extend((distances[name], -pk, model, pk) for pk, name in rows.values_list('id', 'file'))
+    candidates.sort(key=lambda candidate: candidate[:2])
+    candidates = candidates[:limit]
+    loaded = {
+        model: model.objects.select_related('report').in_bulk([pk for _, _, m, pk in candidates if m is model])
+        for model in (ReportEvidence, ScamEvidence)
+    }
+    return [(distance, loaded[model][pk]) for distance, _, model, pk in candidates if pk in loaded[model]]
+
+
+def similar_to_report(report, radius=None, limit=20):
+    """
+    Evidence of other reports resembling an image of this report's evidence
+    """
+    blobs = EvidenceBlob.objects.filter(
+        Q(name__in=ReportEvidence.objects.filter(report=report).values('file')) |
+        Q(name__in=ScamEvidence.objects.filter(report=report).values('file'))
+    )
+    return similar_evidence(blobs, exclude_report=report, radius=radius, limit=limit)
+
+
+def similar_to_evidence(evidence, radius=None, limit=20):
+    """
+    Other evidence rows resembling one evidence image
+    """
+    matches = similar_evidence(
+        EvidenceBlob.objects.filter(name=evidence.file.name), radius=radius, limit=limit + 1
+    )
+    return [
+        (distance, row) for distance, row in matches
+        if not (type(row) is type(evidence) and row.pk == evidence.pk)
+    ][:limit]
+
+
+def _hash_blob(name):
+    return dhash_file(evidence_storage().path(name))
+
+
+def backfill(batch_size=500, workers=None, progress=None):
+    """
+    Hash the image blobs stored before they got a dHash, batch_size at a
+    time on `workers` threads. Returns (hashed, unreadable);
+    progress(hashed, unreadable) is called after each batch.
+    """
+    hashed = unreadable = 0
+    after = 0
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        while True:
+            batch = list(
+                EvidenceBlob.objects.filter(dhash__isnull=True, id__gt=after)
+                .order_by('id').values_list('id', 'name')[:batch_size]
+            )
+            if not batch:
+                break
+            after = batch[-1][0]
+            images = [(blob_id, name) for blob_id, name in batch if is_image(name)]
+            values = pool.map(_hash_blob, [name for _, name in images])
+            for (blob_id, _), value in zip(images, values):
+                if value is None:
+                    unreadable += 1
+                    continue
+                EvidenceBlob.objects.filter(pk=blob_id).update(dhash=to_signed(value))
+                hashed += 1
+            if progress:
+                progress(hashed, unreadable)
+    return hashed, unreadable
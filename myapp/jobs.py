@@ -0,0 +1,161 @@
+"""
+Database-backed queue for the URL analysis of submitted reports.
+
+submit_report enqueues an AnalysisJob; the run_analysis_worker command
+claims jobs, runs analyze_url and check_blacklist off the request path and
+stores the results on the report so view_report never does network I/O.
+Both lookups report failures in their results instead of raising, a timed
+out analysis or an unreachable blacklist is retried like an exception.
+"""
+import logging
+import os
+import socket
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import AnalysisJob, ScamReport
+from .utils import BLACKLIST_SERVICES, analyze_url, check_blacklist
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class LookupFailed(Exception):
+    pass
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_report_analysis(report):
+    """
+    Queue a report for analysis, returns the job or None if there is nothing to analyze
+    """
+    if not report.scam_url:
+        return None
+    return AnalysisJob.objects.create(report=report)
+
+
+def enqueue_missing():
+    """
+    Queue every report with a URL that was never analyzed and has no open job
+    """
+    open_jobs = AnalysisJob.objects.filter(status__in=['queued', 'running']).values('report_id')
+    reports = ScamReport.objects.filter(
+        analyzed_at__isnull=True, scam_url__isnull=False
+    ).exclude(scam_url='').exclude(id__in=open_jobs).values_list('id', flat=True)
+    jobs = [AnalysisJob(report_id=report_id) for report_id in reports.iterator()]
+    AnalysisJob.objects.bulk_create(jobs, batch_size=500)
+    return len(jobs)
+
+
+def _claimable(now):
+    stale = now - timedelta(seconds=_setting('ANALYSIS_LOCK_TIMEOUT', 300))
+    return (
+        Q(status='queued', run_after__lte=now) |
+        Q(status='running', locked_at__lt=stale)
+    )
+
+
+def claim_job(worker):
+    """
+    Atomically take the next runnable job for this worker.
+
+    Claiming is a conditional UPDATE, so when several workers race for the
+    same row only one of them sees it updated. Jobs locked by a worker that
+    died are picked up again once ANALYSIS_LOCK_TIMEOUT has passed.
+    """
+    now = timezone.now()
+    candidates = AnalysisJob.objects.filter(_claimable(now)).order_by('run_after').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        claimed = AnalysisJob.objects.filter(_claimable(now), id=job_id).update(
+            status='running',
+            locked_by=worker,
+            locked_at=now,
+            attempts=F('attempts') + 1
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related('report').get(id=job_id)
+    return None
+
+
+def retry_delay(attempts):
+    base = _setting('ANALYSIS_RETRY_BASE_DELAY', 30)
+    return min(base * 2 ** (attempts - 1), _setting('ANALYSIS_RETRY_MAX_DELAY', 3600))
+
+
+def lookup_error(analysis, blacklist):
+    """
+    Why the lookups of a job are worth retrying, None when they are complete
+    """
+    if analysis.get('partial'):
+        return 'URL analysis incomplete: ' + '; '.join(analysis['warnings'])
+    if blacklist.get('errors') and len(blacklist['errors']) == len(BLACKLIST_SERVICES):
+        return 'Blacklist lookup failed: ' + '; '.join(blacklist['errors'])
+    return None
+
+
+def apply_analysis(report, analysis, blacklist):
+    """
+    Persist analysis results to the report's domain columns
+    """
+    whois_info = analysis.get('whois_info') or {}
+
+    report.url_analysis = analysis
+    report.analyzed_at = timezone.now()
+    report.domain_age = f"{analysis['domain_age']} days" if analysis.get('domain_age') is not None else None
+    report.domain_registrar = whois_info.get('registrar')
+    report.domain_country = whois_info.get('country')
+    report.is_blacklisted = blacklist['is_blacklisted']
+    report.blacklist_details = '\n'.join(blacklist['details']) or None
+    report.save(update_fields=[
+        'url_analysis', 'analyzed_at', 'domain_age', 'domain_registrar',
+        'domain_country', 'is_blacklisted', 'blacklist_details'
+    ])
+
+
+def run_job(job):
+    """
+    Run a claimed job, on failure reschedule it with exponential backoff
+    until ANALYSIS_MAX_ATTEMPTS is reached. The last attempt stores whatever
+    the lookups returned before the job is marked failed.
+    """
+    last_attempt = job.attempts >= _setting('ANALYSIS_MAX_ATTEMPTS', 5)
+    try:
+        report = job.report
+        analysis = analyze_url(report.scam_url)
+        blacklist = check_blacklist(report.scam_url)
+        error = lookup_error(analysis, blacklist)
+        if error is None or last_attempt:
+            apply_analysis(report, analysis, blacklist)
+        if error is not None:
+            raise LookupFailed(error)
+    except Exception as e:
+        if isinstance(e, LookupFailed):
+            logger.warning('Analysis job %s failed: %s', job.id, e)
+        else:
+            logger.exception('Analysis job %s failed', job.id)
+        job.last_error = str(e)
+        job.locked_by = ''
+        job.locked_at = None
+        if last_attempt:
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        else:
+            job.status = 'queued'
+            job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+        job.save(update_fields=['status', 'last_error', 'locked_by', 'locked_at', 'run_after', 'finished_at'])
+        return False
+
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.last_error = None
+    job.save(update_fields=['status', 'finished_at', 'last_error'])
+    return True
@@ -0,0 +1,422 @@
+"""
+Async HTTP load generator for the run_load_test command.
+
+Virtual users run scripted journeys (browsing, searching, logging in,
+submitting reports, uploading evidence, voting) against a running server,
+each over its own keep-alive connection with a cookie jar and Django's
+CSRF handling. Every request is timed under its route name; a response
+with an unexpected status or a transport failure counts as an error and
+ends the journey.
+"""
+import asyncio
+import ipaddress
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from http.cookies import SimpleCookie
+from io import BytesIO
+from urllib.parse import urlencode, urlsplit
+
+from django.urls import reverse
+
+from .benchmarks import summarize
+
+REPORT_LINK = re.compile(r'/view-report/(\d+)/')
+
+TLDS = ['com', 'net', 'com.tr', 'shop', 'online']
+
+SEARCH_TERMS = ['kargo', 'iade', 'kripto', 'yatirim', 'paypal', 'destek', 'banka', 'odeme', 'indirim', 'takip']
+
+# Public addresses for X-Forwarded-For, so requests go through geolocation
+PUBLIC_RANGE = (int(ipaddress.IPv4Address('81.0.0.0')), int(ipaddress.IPv4Address('94.255.255.255')))
+
+
+class RequestFailed(Exception):
+    pass
+
+
+class Response:
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Stats:
+    """
+    Latencies, status codes and errors per route
+    """
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.journeys = Counter()
+        self.started = self.finished = None
+
+    def record(self, route, elapsed=None, status=None, error=None):
+        if elapsed is not None:
+            self.latencies.setdefault(route, []).append(elapsed)
+        if status is not None:
+            self.statuses.setdefault(route, Counter())[status] += 1
+        if error is not None:
+            self.errors.setdefault(route, Counter())[error] += 1
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self):
+        """
+        {route: {requests, errors, error_rate, rps, statuses, p50_ms, ...}}
+        with the totals under 'all'
+        """
+        routes = sorted(set(self.latencies) | set(self.errors))
+        everything = []
+        results = {}
+        for route in routes + ['all']:
+            if route == 'all':
+                latencies = everything
+                errors = Counter()
+                for counter in self.errors.values():
+                    errors.update(counter)
+                statuses = Counter()
+                for counter in self.statuses.values():
+                    statuses.update(counter)
+            else:
+                latencies = self.latencies.get(route, [])
+                everything.extend(latencies)
+                errors = self.errors.get(route, Counter())
+                statuses = self.statuses.get(route, Counter())
+            # Transport failures have no response and no latency
+            requests = len(latencies) + sum(count for error, count in errors.items() if not error.startswith('HTTP'))
+            results[route] = {
+                **(summarize(latencies) if latencies else {'samples': 0}),
+                'requests': requests,
+                'errors': sum(errors.values()),
+                'error_rate': sum(errors.values()) / requests if requests else 0,
+                'rps': requests / self.elapsed,
+                'statuses': {str(status): count for status, count in sorted(statuses.items())},
+                'error_kinds': dict(errors),
+            }
+        return results
+
+
+class Session:
+    """
+    One virtual user's HTTP/1.1 client over a keep-alive connection, with
+    a cookie jar and the CSRF token Django's forms and AJAX views expect
+    """
+
+    def __init__(self, base_url, stats, timeout=30, headers=None):
+        parts = urlsplit(base_url)
+        if parts.scheme != 'http':
+            raise ValueError('Only http:// targets are supported')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.netloc = parts.netloc
+        self.origin = f'http://{parts.netloc}'
+        self.stats = stats
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.cookies = {}
+        self._reader = self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    def _encode(self, method, path, params, data, files, json_body, headers):
+        headers = {**self.headers, **(headers or {})}
+        if params:
+            path = f'{path}?{urlencode(params)}'
+        body = b''
+        token = self.cookies.get('csrftoken')
+        if method != 'GET':
+            headers['Origin'] = self.origin
+            headers['Referer'] = self.origin + path
+            if token:
+                headers['X-CSRFToken'] = token
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers['Content-Type'] = 'application/json'
+        elif data is not None or files:
+            fields = {**({'csrfmiddlewaretoken': token} if token else {}), **(data or {})}
+            if files:
+                body, headers['Content-Type'] = encode_multipart(fields, files)
+            else:
+                body = urlencode(fields).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in self.cookies.items())
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.netloc}', f'Content-Length: {len(body)}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+    async def _exchange(self, request):
+        if self._writer is not None:
+            try:
+                return await self._round_trip(request)
+            except ConnectionError:
+                # The server closed the idle connection, try once on a new one
+                await self.close()
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return await self._round_trip(request)
+
+    async def _round_trip(self, request):
+        self._writer.write(request)
+        await self._writer.drain()
+        status_line = await self._reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed before a response')
+        status = int(status_line.split()[1])
+        headers = []
+        while (line := await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers.append((name.strip().lower(), value.strip()))
+        fields = dict(headers)
+        if fields.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while size := int((await self._reader.readline()).split(b';')[0], 16):
+                chunks.append(await self._reader.readexactly(size))
+                await self._reader.readline()
+            await self._reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in fields:
+            body = await self._reader.readexactly(int(fields['content-length']))
+        else:
+            body = await self._reader.read()
+            fields['connection'] = 'close'
+        if fields.get('connection', '').lower() == 'close':
+            await self.close()
+        for name, value in headers:
+            if name == 'set-cookie':
+                self._store_cookie(value)
+        return Response(status, fields, body)
+
+    def _store_cookie(self, header):
+        cookie = SimpleCookie()
+        cookie.load(header)
+        for name, morsel in cookie.items():
+            if morsel['max-age'] == '0' or not morsel.value:
+                self.cookies.pop(name, None)
+            else:
+                self.cookies[name] = morsel.value
+
+    async def request(self, route, method, path, params=None, data=None, files=None, json_body=None,
+                      headers=None, expect=(200,)):
+        request = self._encode(method, path, params, data, files, json_body, headers)
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._exchange(request), self.timeout)
+        except (OSError, EOFError, ValueError, IndexError, asyncio.TimeoutError) as e:
+            await self.close()
+            self.stats.record(route, error=type(e).__name__)
+            raise RequestFailed(f'{method} {path}: {type(e).__name__}') from e
+        elapsed = time.perf_counter() - start
+        error = None if response.status in expect else f'HTTP {response.status}'
+        self.stats.record(route, elapsed, response.status, error)
+        if error:
+            raise RequestFailed(f'{method} {path}: {error}')
+        return response
+
+
+def encode_multipart(fields, files):
+    """
+    multipart/form-data body and content type; files maps field names to
+    (filename, content type, bytes)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, content_type, content) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def sample_image(width=800, height=600):
+    """
+    A JPEG screenshot stand-in of realistic size for evidence uploads
+    """
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.effect_noise((width, height), 40).convert('RGB').save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+class VirtualUser:
+
+    def __init__(self, session, account, rng, report_ids, upload):
+        self.session = session
+        self.username, self.password = account
+        self.rng = rng
+        self.report_ids = report_ids
+        self.upload = upload
+        self.logged_in = False
+
+    def get(self, route, path, params=None, expect=(200,)):
+        return self.session.request(route, 'GET', path, params=params, expect=expect)
+
+    def post(self, route, path, expect=(302,), **kwargs):
+        return self.session.request(route, 'POST', path, expect=expect, **kwargs)
+
+    def remember(self, html):
+        for report_id in REPORT_LINK.findall(html):
+            self.report_ids.add(int(report_id))
+
+    async def report_id(self):
+        if not self.report_ids:
+            self.remember((await self.get('public_reports', reverse('public_reports'))).text)
+        if not self.report_ids:
+            raise RequestFailed('No public reports to work with')
+        return self.rng.choice(tuple(self.report_ids))
+
+    async def log_in(self):
+        await self.get('login', reverse('login'))
+        await self.post('login', reverse('login'), data={'username': self.username, 'password': self.password})
+        if 'sessionid' not in self.session.cookies:
+            self.session.stats.record('login', error='rejected')
+            raise RequestFailed(f'Logging in as {self.username} failed')
+        self.logged_in = True
+
+    async def ensure_logged_in(self):
+        if not self.logged_in:
+            await self.log_in()
+
+
+async def browse(user):
+    listing = await user.get('public_reports', reverse('public_reports'))
+    user.remember(listing.text)
+    await user.get('view_report', reverse('view_report', args=[await user.report_id()]))
+
+
+async def search(user):
+    await user.get('search', reverse('public_reports'), params={'q': user.rng.choice(SEARCH_TERMS)})
+
+
+async def login(user):
+    if user.logged_in:
+        await user.get('logout', reverse('logout'), expect=(302,))
+        user.logged_in = False
+    await user.log_in()
+
+
+async def submit_report(user):
+    await user.ensure_logged_in()
+    await user.get('submit_report', reverse('submit_report'))
+    term = user.rng.choice(SEARCH_TERMS)
+    await user.post('submit_report', reverse('submit_report'), data={
+        'title': f'{term.title()} scam #{user.rng.randrange(10**6)}',
+        'description': f'Load test report: a fake {term} site asked for card details and never delivered.',
+        # A new registrable domain each time, so the analysis does fresh WHOIS lookups
+        'scam_url': f'https://{term}-{user.rng.randrange(10**6)}.{user.rng.choice(TLDS)}/odeme',
+        'report_type': user.rng.choice(['investment', 'shopping', 'banking', 'social']),
+        'is_public': 'on',
+    })
+
+
+async def upload_evidence(user):
+    await user.ensure_logged_in()
+    path = reverse('upload_evidence', args=[await user.report_id()])
+    await user.get('upload_evidence', path)
+    await user.post('upload_evidence', path, data={
+        'title': 'Screenshot', 'description': 'Checkout page of the site',
+    }, files={'file': ('screenshot.jpg', 'image/jpeg', user.upload)})
+
+
+async def vote(user):
+    await user.ensure_logged_in()
+    report_id = await user.report_id()
+    await user.post(
+        'vote_report', reverse('vote_report', args=[report_id]),
+        json_body={'vote_type': user.rng.choice(['upvote', 'upvote', 'downvote'])}, expect=(200,)
+    )
+
+
+# name -> (journey, default weight)
+JOURNEYS = {
+    'browse': (browse, 40),
+    'search': (search, 20),
+    'login': (login, 5),
+    'submit_report': (submit_report, 10),
+    'upload_evidence': (upload_evidence, 5),
+    'vote': (vote, 20),
+}
+
+
+def parse_mix(value):
+    """
+    'browse=60,vote=40' -> {'browse': 60, 'vote': 40}
+    """
+    mix = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in JOURNEYS:
+            raise ValueError(f'Unknown journey {name!r}, choose from {", ".join(JOURNEYS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run_load(base_url, accounts, users=10, duration=60, mix=None, ramp_up=0, think_time=0.5,
+                   timeout=30, seed=0):
+    """
+    Run `users` virtual users against base_url for `duration` seconds,
+    picking journeys by the weights in mix; returns the Stats
+    """
+    mix = mix or {name: weight for name, (_, weight) in JOURNEYS.items()}
+    names, weights = list(mix), list(mix.values())
+    stats = Stats()
+    report_ids = set()
+    upload = sample_image()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+
+    async def virtual_user(i):
+        rng = random.Random(seed * 100003 + i)
+        await asyncio.sleep(ramp_up * i / users)
+        ip = str(ipaddress.IPv4Address(rng.randint(*PUBLIC_RANGE)))
+        session = Session(base_url, stats, timeout, headers={
+            'User-Agent': f'scam-report-loadtest/{i}', 'X-Forwarded-For': ip,
+        })
+        user = VirtualUser(session, accounts[i % len(accounts)], rng, report_ids, upload)
+        try:
+            while loop.time() < deadline:
+                name = rng.choices(names, weights)[0]
+                try:
+                    await JOURNEYS[name][0](user)
+                    stats.journeys[name] += 1
+                except RequestFailed:
+                    stats.journeys[f'{name} (failed)'] += 1
+                if think_time:
+                    await asyncio.sleep(min(rng.expovariate(1 / think_time), max(deadline - loop.time(), 0)))
+        finally:
+            await session.close()
+
+    stats.started = time.monotonic()
+    await asyncio.gather(*(virtual_user(i) for i in range(users)))
+    stats.finished = time.monotonic()
+    return stats
@@ -0,0 +1,38 @@
+"""
+Entry points for the processes started by the run_load_test command.
+
+They connect the app to the network stand-ins described by the
+LOAD_TEST_STAND_INS environment variable before serving:
+
+    gunicorn myapp.loadtest_server:application
+    gunicorn -k uvicorn.workers.UvicornWorker myapp.loadtest_server:asgi_application
+    python -m myapp.loadtest_server run_analysis_worker
+"""
+import json
+import os
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+from myapp.stubs import STAND_INS_ENV, connect_stand_ins  # noqa: E402
+from myapp.warmup import warm_up  # noqa: E402
+
+if os.environ.get(STAND_INS_ENV):
+    connect_stand_ins(json.loads(os.environ[STAND_INS_ENV]))
+
+application = get_wsgi_application()
+asgi_application = get_asgi_application()
+
+if __name__ == '__main__':
+    from django.core.management import execute_from_command_line
+
+    execute_from_command_line([sys.argv[0], *sys.argv[1:]])
+else:
+    warm_up()
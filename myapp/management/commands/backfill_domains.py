@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from myapp import urlcanon
+from myapp.models import ScamReport
+
+
+class Command(BaseCommand):
+    help = 'Fill in the canonical domain and registrable domain of scam report URLs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Recompute every report, not just those without a domain (e.g. after updating the suffix list)'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        reports = ScamReport.objects.exclude(scam_url__isnull=True).exclude(scam_url='')
+        if not options['all']:
+            reports = reports.filter(domain='')
+
+        start = time.monotonic()
+        last_id = 0
+        updated = 0
+        # Walk by primary key so an interrupted run can simply be started again
+        while True:
+            batch = list(
+                reports.filter(id__gt=last_id).order_by('id')
+                .only('id', 'scam_url', 'domain', 'domain_key', 'registrable_domain')[:batch_size]
+            )
+            if not batch:
+                break
+            rows = []
+            for report in batch:
+                domain, registrable = urlcanon.split_url(report.scam_url)
+                key = urlcanon.domain_key(domain)
+                if (domain, key, registrable) != (report.domain, report.domain_key, report.registrable_domain):
+                    rows.append((domain, key, registrable, report.id))
+            # A prepared UPDATE per row is far cheaper than bulk_update's CASE
+            # expressions; last_updated moves so the in-memory domain index
+            # and filter pick the rows up on their next refresh
+            now = connection.ops.adapt_datetimefield_value(timezone.now())
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(
+                    f'UPDATE {ScamReport._meta.db_table} '
+                    f'SET domain = %s, domain_key = %s, registrable_domain = %s, last_updated = %s WHERE id = %s',
+                    [(*row[:3], now, row[3]) for row in rows]
+                )
+            updated += len(rows)
+            last_id = batch[-1].id
+            self.stdout.write(f'{updated} reports updated, up to id {last_id}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled domains in {time.monotonic() - start:.2f}s, {updated} reports updated'
+        ))
@@ -0,0 +1,62 @@
+import statistics
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from myapp import utils
+from myapp.stubs import StubDNSServer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark sequential vs concurrent DNS resolution in analyze_url against a local stub DNS server'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=200, help='Injected latency per DNS query in ms')
+        parser.add_argument('--iterations', type=int, default=5)
+        parser.add_argument('--domain', default='example.com')
+        parser.add_argument('--deadline', type=float, default=None,
+                            help='ANALYZE_URL_DEADLINE in seconds for the deadline run (default: half the latency)')
+
+    def handle(self, *args, **options):
+        latency = options['latency'] / 1000
+        deadline = options['deadline'] if options['deadline'] is not None else latency / 2
+
+        with StubDNSServer(latency=latency) as server:
+            host, port = server.address
+            dns_settings = {'DNS_NAMESERVERS': [host], 'DNS_PORT': port}
+
+            def gethostbyname(name):
+                # Stands in for the system resolver so the duplicate A lookup
+                # done by the sequential path also pays the injected latency.
+                return str(utils._make_resolver().resolve(name, 'A')[0])
+
+            # WHOIS is disabled so get_domain_info takes its NS/SOA fallback path.
+            with mock.patch.object(utils.whois, 'whois', side_effect=Exception('disabled for benchmark')), \
+                    mock.patch.object(utils.socket, 'gethostbyname', gethostbyname):
+                runs = [
+                    ('sequential', {'DNS_CONCURRENT_RESOLUTION': False}),
+                    ('concurrent', {'DNS_CONCURRENT_RESOLUTION': True, 'ANALYZE_URL_DEADLINE': 30}),
+                    (f'concurrent, {deadline:.2f}s deadline',
+                     {'DNS_CONCURRENT_RESOLUTION': True, 'ANALYZE_URL_DEADLINE': deadline}),
+                ]
+                for label, mode_settings in runs:
+                    with override_settings(**dns_settings, **mode_settings):
+                        self.run_mode(label, server, options)
+
+    def run_mode(self, label, server, options):
+        timings = []
+        queries_before = server.queries
+        for _ in range(options['iterations']):
+            start = time.perf_counter()
+            result = utils.analyze_url(f"https://{options['domain']}/", use_cache=False)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        partial = any('partial' in warning for warning in result['warnings'])
+        self.stdout.write(
+            f"{label:<32} mean {statistics.mean(timings):8.1f} ms  "
+            f"min {min(timings):8.1f} ms  max {max(timings):8.1f} ms  "
+            f"queries/run {(server.queries - queries_before) / options['iterations']:.0f}  "
+            f"ip {result['ip_address']}  partial {'yes' if partial else 'no'}"
+        )
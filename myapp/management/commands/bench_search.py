@@ -0,0 +1,81 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from myapp.models import ScamReport
+from myapp.search import LikeSearchBackend, get_backend
+
+WORDS = [
+    'kargo', 'ödeme', 'yatırım', 'kripto', 'banka', 'sahte', 'dolandırıcılık', 'İstanbul',
+    'İzmir', 'ıslak', 'imza', 'kredi', 'kartı', 'iade', 'indirim', 'telefon', 'iPhone',
+    'shipping', 'refund', 'crypto', 'wallet', 'bitcoin', 'investment', 'giveaway', 'phishing',
+    'password', 'account', 'store', 'delivery', 'instagram', 'whatsapp', 'loan', 'ticket',
+]
+QUERIES = ['kargo', 'ISTANBUL', 'yatirim kripto', 'iade', 'bitco', 'sahte store', 'ıslak imza']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the full-text search backend against the icontains search path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reports', type=int, default=1_000_000,
+                            help='Synthetic reports to fill the throwaway test database with')
+        parser.add_argument('--existing-db', action='store_true',
+                            help='Search the configured database as it is instead of a throwaway test database')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['existing_db']:
+            self.benchmark(options)
+            return
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.populate(options['reports'], options['seed'])
+            self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def benchmark(self, options):
+        reports = ScamReport.objects.filter(is_public=True).order_by('-submission_date')
+        backends = [('icontains', LikeSearchBackend()), (type(get_backend()).__name__, get_backend())]
+        self.stdout.write(f'{ScamReport.objects.count()} reports')
+        for query in QUERIES:
+            line = [f'{query!r:<20}']
+            for label, backend in backends:
+                timings = []
+                for _ in range(options['repeat']):
+                    start = time.perf_counter()
+                    page = list(backend.search(reports, query)[:options['page_size']])
+                    timings.append((time.perf_counter() - start) * 1000)
+                line.append(f'{label} {statistics.median(timings):9.1f} ms ({len(page)} hits)')
+            self.stdout.write('  '.join(line))
+
+    def populate(self, count, seed):
+        rng = random.Random(seed)
+        self.stdout.write(f'Creating {count} synthetic reports...')
+        batch_size = 5000
+        types = [value for value, _ in ScamReport.REPORT_TYPES]
+        for offset in range(0, count, batch_size):
+            batch = []
+            for _ in range(min(batch_size, count - offset)):
+                words = rng.choices(WORDS, k=rng.randint(30, 80))
+                batch.append(ScamReport(
+                    report_type=rng.choice(types),
+                    title=' '.join(rng.sample(WORDS, 4)).capitalize(),
+                    description=' '.join(words),
+                    scam_url=f'https://{rng.choice(WORDS).lower()}-{rng.randint(1, 99999)}.example.com/',
+                ))
+            with transaction.atomic():
+                ScamReport.objects.bulk_create(batch)
+        self.stdout.write('Rebuilding the search index...')
+        backend = get_backend()
+        backend.setup()
+        backend.rebuild(
+            ScamReport.objects.values_list('id', 'report_type', 'title', 'description', 'scam_url').iterator(chunk_size=5000),
+            batch_size=5000
+        )
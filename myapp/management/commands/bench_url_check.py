@@ -0,0 +1,77 @@
+import json
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from myapp import views
+from myapp.domain_index import domain_index
+from myapp.models import ScamReport
+
+WORDS = ['kargo', 'odeme', 'yatirim', 'kripto', 'banka', 'kredi', 'iade', 'indirim', 'store', 'delivery', 'wallet']
+SUFFIXES = ['com', 'com.tr', 'net', 'org', 'co.uk', 'shop', 'github.io']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the bulk URL-check endpoint against the in-memory domain index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--domains', type=int, default=100_000,
+                            help='Number of synthetic reported domains (ignored with --from-db)')
+        parser.add_argument('--from-db', action='store_true', help='Load the index from the reports table')
+        parser.add_argument('--urls', type=int, default=10_000, help='URLs per request')
+        parser.add_argument('--hit-rate', type=float, default=0.1)
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        start = time.perf_counter()
+        if options['from_db']:
+            domain_index.refresh(full=True)
+        else:
+            self.populate(rng, options['domains'])
+        self.stdout.write(f'Loaded {len(domain_index)} domains in {time.perf_counter() - start:.2f}s')
+        reported = list(domain_index._domains)
+
+        urls = []
+        for i in range(options['urls']):
+            if reported and rng.random() < options['hit_rate']:
+                host = rng.choice(reported)
+                if rng.random() < 0.5:
+                    host = f'www.{host}'
+            else:
+                host = f'{rng.choice(WORDS)}-{rng.randint(1, 10**9)}.{rng.choice(SUFFIXES)}'
+            urls.append(f'https://{host}/path/{i}?ref=mail')
+        body = json.dumps({'urls': urls})
+
+        factory = RequestFactory()
+        timings = []
+        for _ in range(options['repeat']):
+            request = factory.post('/api/check-urls/', body, content_type='application/json')
+            start = time.perf_counter()
+            response = views.check_urls(request)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        results = json.loads(response.content)['results']
+        verdicts = {}
+        for result in results:
+            verdicts[result['verdict']] = verdicts.get(result['verdict'], 0) + 1
+        timings.sort()
+        self.stdout.write(
+            f"{options['urls']} URLs/request: p50 {statistics.median(timings):.1f} ms  "
+            f"p99 {timings[min(len(timings) - 1, int(len(timings) * 0.99))]:.1f} ms  "
+            f"max {timings[-1]:.1f} ms  verdicts {verdicts}"
+        )
+
+    def populate(self, rng, count):
+        types = [value for value, _ in ScamReport.REPORT_TYPES]
+        statuses = ['pending', 'verified']
+        for report_id in range(count):
+            host = f'{rng.choice(WORDS)}-{report_id}.{rng.choice(SUFFIXES)}'
+            domain_index.apply(report_id, None, host, rng.choice(statuses), rng.choice(types), True)
+        # Keep the synthetic index from being replaced by the database
+        domain_index._loaded = True
+        domain_index.refresh_interval = float('inf')
@@ -0,0 +1,58 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.domain_filter import DomainFilter, domain_filter, fingerprint
+
+
+class Command(BaseCommand):
+    help = 'Report memory footprint, false-positive rate and lookup cost of the in-process domain filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000],
+                            help='Numbers of synthetic domains to measure')
+        parser.add_argument('--error-rate', type=float, default=None, help='Bloom filter target error rate')
+        parser.add_argument('--probes', type=int, default=200_000, help='Unreported domains looked up per size')
+        parser.add_argument('--live', action='store_true', help='Also load and report the filter built from the database')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if options['live']:
+            start = time.perf_counter()
+            rows = domain_filter.refresh(full=True)
+            self.stdout.write(
+                f'live: {len(domain_filter)} domains from {rows} reports, '
+                f'{domain_filter.nbytes() / 2**20:.1f} MiB, loaded in {time.perf_counter() - start:.2f}s'
+            )
+        for size in options['sizes']:
+            self.measure(size, options)
+
+    def measure(self, size, options):
+        rng = random.Random(options['seed'])
+        synthetic = DomainFilter(error_rate=options['error_rate'])
+
+        start = time.perf_counter()
+        synthetic.build(f'site-{i}.example{i % 97}.com' for i in range(size))
+        build_time = time.perf_counter() - start
+
+        probes = [f'other-{rng.getrandbits(48)}.example.net' for _ in range(options['probes'])]
+        bloom = synthetic._bloom
+        bloom_hits = sum(1 for host in probes if fingerprint(host) in bloom)
+        start = time.perf_counter()
+        false_positives = sum(1 for host in probes if host in synthetic)
+        lookup_us = (time.perf_counter() - start) / len(probes) * 1e6
+        members = [f'site-{i}.example{i % 97}.com' for i in (rng.randrange(size) for _ in range(10_000))]
+        member_start = time.perf_counter()
+        for host in members:
+            host in synthetic
+        member_us = (time.perf_counter() - member_start) / len(members) * 1e6
+
+        self.stdout.write(
+            f'{size:>11,} domains: bloom {bloom.nbytes / 2**20:6.1f} MiB ({bloom.hashes} hashes), '
+            f'sorted array {len(synthetic._sorted) * 8 / 2**20:6.1f} MiB, '
+            f'{synthetic.nbytes() * 8 / size:5.1f} bits/domain, build {build_time:5.1f}s\n'
+            f'{"":>20} bloom false positives {bloom_hits / len(probes):.4%}, '
+            f'after the exact check {false_positives / len(probes):.4%}; '
+            f'lookup {lookup_us:.2f} us miss, {member_us:.2f} us hit'
+        )
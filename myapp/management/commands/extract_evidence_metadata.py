@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import metadata
+
+BAR_WIDTH = 30
+
+
+class Command(BaseCommand):
+    help = 'Read the EXIF and PDF header metadata of scam evidence files stored without it, in parallel processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows read and updated per batch')
+        parser.add_argument('--workers', type=int, help='Processes reading files')
+        parser.add_argument('--all', action='store_true', help='Extract again for rows that have metadata')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        # Rewrite the bar in place on a terminal, one line per batch otherwise
+        interactive = self.stdout.isatty()
+
+        def progress(extracted, failed, total):
+            done = extracted + failed
+            filled = BAR_WIDTH * done // total if total else BAR_WIDTH
+            rate = done / (time.monotonic() - start)
+            line = (
+                f'[{"#" * filled}{"." * (BAR_WIDTH - filled)}] {done}/{total} rows, '
+                f'{rate:.0f} rows/s, {failed} failed'
+            )
+            self.stdout.write(f'\r{line}' if interactive else line, ending='' if interactive else '\n')
+            self.stdout.flush()
+
+        extracted, failed = metadata.backfill(
+            batch_size=options['batch_size'], workers=options['workers'], redo=options['all'], progress=progress
+        )
+        if interactive and extracted + failed:
+            self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(
+            f'Extracted metadata of {extracted} rows in {time.monotonic() - start:.2f}s, {failed} failed'
+        ))
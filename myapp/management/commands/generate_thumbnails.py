@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Render the thumbnails of evidence images stored without them, in parallel processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Blobs read per query')
+        parser.add_argument('--workers', type=int, help='Processes resizing images')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+
+        def progress(rendered, failed):
+            elapsed = time.monotonic() - start
+            self.stdout.write(f'{rendered} images rendered, {len(failed)} failed, {rendered / elapsed:.1f} images/s')
+
+        rendered, failed = thumbnails.backfill(
+            batch_size=options['batch_size'], workers=options['workers'], progress=progress
+        )
+        for name, error in failed:
+            self.stderr.write(self.style.WARNING(f'{name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Rendered thumbnails of {rendered} images in {time.monotonic() - start:.2f}s, {len(failed)} failed'
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import image_index
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hash of evidence images stored before near-duplicate detection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Blobs read per query')
+        parser.add_argument('--workers', type=int, help='Threads decoding images')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+
+        def progress(hashed, unreadable):
+            elapsed = time.monotonic() - start
+            self.stdout.write(f'{hashed} images hashed, {unreadable} unreadable, {hashed / elapsed:.0f} images/s')
+
+        hashed, unreadable = image_index.backfill(
+            batch_size=options['batch_size'], workers=options['workers'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Hashed {hashed} images in {time.monotonic() - start:.2f}s, {unreadable} unreadable'
+        ))
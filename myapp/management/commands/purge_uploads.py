@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from myapp import uploads
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked evidence uploads that were abandoned, with their partial files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=float,
+                            help='Hours since the last chunk, EVIDENCE_UPLOAD_EXPIRY by default')
+
+    def handle(self, *args, **options):
+        max_age = None if options['max_age'] is None else timedelta(hours=options['max_age'])
+        count = uploads.purge_stale(max_age)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} abandoned uploads'))
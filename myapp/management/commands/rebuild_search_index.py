@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp.models import ScamReport
+from myapp.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for scam reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        start = time.monotonic()
+        backend.setup()
+        backend.rebuild(
+            ScamReport.objects.values_list('id', 'report_type', 'title', 'description', 'scam_url')
+            .iterator(chunk_size=options['batch_size']),
+            batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {type(backend).__name__} index in {time.monotonic() - start:.2f}s'
+        ))
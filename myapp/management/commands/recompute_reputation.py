@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import reputation
+
+
+class Command(BaseCommand):
+    help = 'Rebuild report vote counters and every user reputation score from the votes table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        changed = reputation.recompute_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Recomputed reputation in {time.monotonic() - start:.2f}s, {changed} scores changed'
+        ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from myapp import storage
+
+
+class Command(BaseCommand):
+    help = 'Recount the references to content-addressed evidence files and delete the unreferenced ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the blobs that drifted')
+
+    def handle(self, *args, **options):
+        drift = storage.reconcile(dry_run=options['dry_run'])
+        for name, stored, actual in drift[:50]:
+            self.stdout.write(f'{name}: {"no blob" if stored is None else stored} -> {actual} references')
+        if len(drift) > 50:
+            self.stdout.write(f'... and {len(drift) - 50} more')
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drift)} drifted blobs'))
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import counters
+
+
+class Command(BaseCommand):
+    help = 'Fix drift of the per-user report counters (total, verified, flagged) against the reports table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only list the profiles that drifted')
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        drift = counters.reconcile(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        for user_id, stored, actual in drift[:50]:
+            self.stdout.write(f'user {user_id}: {stored or "no profile"} -> {actual}')
+        if len(drift) > 50:
+            self.stdout.write(f'... and {len(drift) - 50} more')
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {len(drift)} drifted profiles in {time.monotonic() - start:.2f}s'
+        ))
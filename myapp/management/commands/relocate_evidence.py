@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from myapp import storage
+
+
+class Command(BaseCommand):
+    help = (
+        'Move evidence files saved under evidence/, scam_evidence/ or the flat cas/ layout to their '
+        'hash-sharded cas/ab/cd/ names, merging identical files, and rewrite the file fields in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Distinct file names per transaction')
+        parser.add_argument('--workers', type=int, help='Threads hashing and linking files')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the files to move')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            for model, field in storage.file_fields():
+                count = len(storage.names_to_relocate(model, field))
+                self.stdout.write(f'{model.__name__}.{field}: {count} files to relocate')
+            return
+
+        start = time.monotonic()
+        totals = {'files': 0, 'bytes': 0}
+
+        def progress(moved, failed):
+            totals['files'] += len(moved)
+            totals['bytes'] += sum(size for _, _, _, size in moved)
+            elapsed = time.monotonic() - start
+            self.stdout.write(
+                f"{totals['files']} files, {totals['bytes'] / 2**20:.1f} MiB relocated, "
+                f"{totals['files'] / elapsed:.0f} files/s, {len(failed)} failed"
+            )
+
+        relocated, failed = storage.relocate(
+            batch_size=options['batch_size'], workers=options['workers'], progress=progress
+        )
+        for name, error in failed:
+            self.stderr.write(self.style.WARNING(f'{name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Relocated {relocated} files in {time.monotonic() - start:.2f}s, {len(failed)} failed'
+        ))
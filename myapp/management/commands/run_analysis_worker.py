@@ -0,0 +1,65 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from myapp import domain_cache, jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued URL analysis jobs for submitted reports'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Number of jobs run at the same time')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+        parser.add_argument('--enqueue-missing', action='store_true',
+                            help='First queue every report with a URL that was never analyzed')
+
+    def handle(self, *args, **options):
+        worker = jobs.worker_id()
+        concurrency = max(options['concurrency'], 1)
+
+        if options['enqueue_missing']:
+            self.stdout.write(f'Queued {jobs.enqueue_missing()} reports for analysis')
+
+        self.stdout.write(f'Analysis worker {worker} started with concurrency {concurrency}')
+        in_flight = set()
+        last_purge = 0
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='analysis') as executor:
+            try:
+                while True:
+                    in_flight = {future for future in in_flight if not future.done()}
+                    claimed = False
+                    while len(in_flight) < concurrency:
+                        close_old_connections()
+                        job = jobs.claim_job(worker)
+                        if job is None:
+                            break
+                        claimed = True
+                        in_flight.add(executor.submit(self.run_job, job))
+
+                    if time.monotonic() - last_purge > 3600:
+                        domain_cache.purge_expired()
+                        last_purge = time.monotonic()
+
+                    if not claimed:
+                        if options['once'] and not in_flight:
+                            break
+                        if in_flight:
+                            wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                        else:
+                            time.sleep(options['poll_interval'])
+            except KeyboardInterrupt:
+                self.stdout.write('Stopping, waiting for running jobs to finish...')
+        self.stdout.write('Analysis worker stopped')
+
+    def run_job(self, job):
+        try:
+            if jobs.run_job(job):
+                self.stdout.write(f'Analyzed report {job.report_id}')
+            else:
+                self.stderr.write(f'Analysis of report {job.report_id} failed (attempt {job.attempts})')
+        finally:
+            connections.close_all()
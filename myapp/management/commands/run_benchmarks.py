@@ -0,0 +1,109 @@
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapp import benchmarks
+from myapp.stubs import stub_network
+from myapp.view_counter import view_counter
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the utils, model and view hot paths offline against stubbed DNS/WHOIS/HTTP services, '
+        'write the results to JSON and compare them with a baseline'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Benchmarks to run, default: all')
+        parser.add_argument('--list', action='store_true', help='List the benchmarks and exit')
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--dns-latency', type=float, default=0, help='Injected DNS latency in ms')
+        parser.add_argument('--whois-latency', type=float, default=0, help='Injected WHOIS latency in ms')
+        parser.add_argument('--http-latency', type=float, default=0, help='Injected HTTP latency in ms')
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--baseline', default=self.default_baseline(),
+                            help='Baseline JSON to compare against (default: %(default)s)')
+        parser.add_argument('--save-baseline', action='store_true', help='Store this run as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Relative slowdown of p50/p90 reported as a regression')
+        parser.add_argument('--existing-db', action='store_true',
+                            help='Run against the configured database instead of a seeded throwaway test database')
+        parser.add_argument('--reports', type=int, default=5000, help='Reports to seed the test database with')
+
+    @staticmethod
+    def default_baseline():
+        return getattr(settings, 'BENCHMARK_BASELINE', os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'))
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, (_, number) in benchmarks.BENCHMARKS.items():
+                self.stdout.write(f'{name}  ({number} calls per sample)' if number > 1 else name)
+            return
+
+        old_name = None
+        setup_test_environment()
+        try:
+            if not options['existing_db']:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                reports = options['reports']
+                call_command(
+                    'seed_scale', users=max(10, reports // 10), reports=reports, votes=reports * 10,
+                    stdout=open(os.devnull, 'w')
+                )
+            with stub_network(
+                options['dns_latency'] / 1000, options['whois_latency'] / 1000, options['http_latency'] / 1000
+            ):
+                try:
+                    results = benchmarks.run(
+                        options['names'], options['iterations'], options['warmup'], progress=self.report
+                    )
+                except KeyError as e:
+                    raise CommandError(e.args[0])
+            meta = benchmarks.metadata(
+                iterations=options['iterations'],
+                latency_ms={key: options[f'{key}_latency'] for key in ('dns', 'whois', 'http')},
+            )
+        finally:
+            if old_name is not None:
+                view_counter.reset()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            benchmarks.dump(options['output'], results, meta)
+            self.stdout.write(f"Results written to {options['output']}")
+        baseline_path = options['baseline']
+        if options['save_baseline']:
+            os.makedirs(os.path.dirname(baseline_path) or '.', exist_ok=True)
+            benchmarks.dump(baseline_path, results, meta)
+            self.stdout.write(self.style.SUCCESS(f'Saved the baseline to {baseline_path}'))
+        elif os.path.exists(baseline_path):
+            self.check_baseline(results, meta, baseline_path, options['tolerance'])
+
+    def report(self, name, summary):
+        self.stdout.write(
+            f"{name:<34} p50 {summary['p50_ms']:9.3f} ms  p90 {summary['p90_ms']:9.3f} ms  "
+            f"p99 {summary['p99_ms']:9.3f} ms  max {summary['max_ms']:9.3f} ms"
+        )
+
+    def check_baseline(self, results, meta, path, tolerance):
+        baseline = benchmarks.load(path)
+        if baseline['meta'].get('latency_ms') != meta['latency_ms']:
+            self.stderr.write(self.style.WARNING(
+                f"The baseline was recorded with latencies {baseline['meta'].get('latency_ms')}, "
+                f"this run used {meta['latency_ms']}"
+            ))
+        regressions = benchmarks.compare(results, baseline, tolerance)
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS(f'No regressions against {path}'))
+            return
+        for name, metric, before, after in regressions:
+            self.stderr.write(self.style.ERROR(
+                f'{name} {metric}: {before:.3f} ms -> {after:.3f} ms (+{(after / before - 1) * 100:.0f}%)'
+            ))
+        raise CommandError(f'{len(regressions)} regression(s) against {path}')
@@ -0,0 +1,196 @@
+import asyncio
+import importlib.util
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import loadtest
+from myapp.models import ScamReport
+from myapp.stubs import STAND_INS_ENV, NetworkStandIns
+
+ACCOUNT_PREFIX = 'loadtest-'
+
+
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive a local gunicorn server (sync or ASGI workers) through scripted user journeys with local '
+        'DNS/WHOIS/ip-api stand-ins, and report throughput, latency percentiles and error rates per route. '
+        'Runs against the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Load an already running server instead of starting one')
+        parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi',
+                            help='gunicorn sync workers, or uvicorn workers under gunicorn')
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--threads', type=int, default=1, help='Threads per sync worker')
+        parser.add_argument('--analysis-workers', type=int, default=1,
+                            help='run_analysis_worker processes analyzing submitted reports, 0 for none')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run')
+        parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which the users start')
+        parser.add_argument('--think-time', type=float, default=0.5,
+                            help='Mean pause between journeys in seconds (exponentially distributed)')
+        parser.add_argument('--mix', default='',
+                            help='Journey weights, e.g. browse=60,vote=40; journeys: ' + ', '.join(loadtest.JOURNEYS))
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds')
+        parser.add_argument('--accounts', type=int, default=50, help=f'{ACCOUNT_PREFIX}N accounts to log in with')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--dns-latency', type=float, default=0, help='Injected DNS latency in ms')
+        parser.add_argument('--whois-latency', type=float, default=0, help='Injected WHOIS latency in ms')
+        parser.add_argument('--http-latency', type=float, default=0,
+                            help='Injected ip-api/blacklist latency in ms')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the results to this JSON file')
+        parser.add_argument('--cleanup', action='store_true',
+                            help=f'Delete the {ACCOUNT_PREFIX} accounts and their reports afterwards')
+
+    def handle(self, *args, **options):
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(e)
+        if options['server'] == 'asgi' and not options['url'] and importlib.util.find_spec('uvicorn') is None:
+            raise CommandError('ASGI runs need uvicorn installed')
+
+        accounts = self.ensure_accounts(options['accounts'], options['password'])
+        processes = []
+        url = options['url']
+        stand_ins = None
+        with ExitStack() as stack:
+            stack.callback(self.stop, processes)
+            if not url:
+                stand_ins = stack.enter_context(NetworkStandIns(
+                    options['dns_latency'] / 1000, options['whois_latency'] / 1000, options['http_latency'] / 1000
+                ))
+                env = {**os.environ, STAND_INS_ENV: json.dumps(stand_ins.config())}
+                url, server = self.start_server(options, env)
+                processes.append(server)
+                for _ in range(options['analysis_workers']):
+                    processes.append(subprocess.Popen(
+                        [sys.executable, '-m', 'myapp.loadtest_server', 'run_analysis_worker', '--poll-interval', '0.5'],
+                        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL,
+                    ))
+                self.wait_for_server(url, server)
+            self.stdout.write(f"{options['users']} users against {url} for {options['duration']:.0f}s")
+            stats = asyncio.run(loadtest.run_load(
+                url, accounts, users=options['users'], duration=options['duration'], mix=mix,
+                ramp_up=options['ramp_up'], think_time=options['think_time'], timeout=options['timeout'],
+                seed=options['seed'],
+            ))
+
+        summary = stats.summary()
+        self.report(summary, stats, stand_ins)
+        if options['output']:
+            meta = {
+                'url': url,
+                'server': None if options['url'] else options['server'],
+                'workers': options['workers'],
+                'threads': options['threads'],
+                'users': options['users'],
+                'duration': stats.elapsed,
+                'mix': mix or {name: weight for name, (_, weight) in loadtest.JOURNEYS.items()},
+                'latency_ms': {key: options[f'{key}_latency'] for key in ('dns', 'whois', 'http')},
+            }
+            with open(options['output'], 'w') as f:
+                json.dump({'meta': meta, 'routes': summary, 'journeys': dict(stats.journeys)}, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options['cleanup']:
+            self.cleanup()
+
+    @staticmethod
+    def stop(processes):
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def ensure_accounts(self, count, password):
+        usernames = [f'{ACCOUNT_PREFIX}{i}' for i in range(max(count, 1))]
+        # One hash for every account, hashing per account is slow on purpose
+        hashed = make_password(password)
+        User.objects.filter(username__in=usernames).update(password=hashed)
+        existing = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=username, email=f'{username}@example.com', password=hashed)
+            for username in usernames if username not in existing
+        )
+        return [(username, password) for username in usernames]
+
+    def start_server(self, options, env):
+        host = '127.0.0.1'
+        bind = f'{host}:{free_port(host)}'
+        command = [sys.executable, '-m', 'gunicorn', '--bind', bind, '--workers', str(options['workers']),
+                   '--log-level', 'warning', '--timeout', str(int(options['timeout']) + 30)]
+        if options['server'] == 'asgi':
+            command += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'myapp.loadtest_server:asgi_application']
+        else:
+            command += ['--threads', str(options['threads']), 'myapp.loadtest_server:application']
+        self.stdout.write(' '.join(command[2:]))
+        return f'http://{bind}', subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+
+    def wait_for_server(self, url, process, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'The server exited with status {process.returncode}')
+            try:
+                urllib.request.urlopen(url + '/', timeout=5).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'The server did not answer within {timeout}s')
+
+    def report(self, summary, stats, stand_ins):
+        self.stdout.write(
+            f"{'route':<18} {'requests':>8} {'req/s':>7} {'errors':>7} "
+            f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+        for route, row in summary.items():
+            if route == 'all':
+                self.stdout.write('-' * 80)
+            latencies = ''.join(
+                f" {row[key]:8.1f}" if row['samples'] else f" {'-':>8}"
+                for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')
+            )
+            self.stdout.write(
+                f"{route:<18} {row['requests']:8d} {row['rps']:7.1f} {row['error_rate']:7.1%}{latencies}"
+            )
+        for route, row in summary.items():
+            if row['errors'] and route != 'all':
+                kinds = ', '.join(f'{kind} x{count}' for kind, count in row['error_kinds'].items())
+                self.stderr.write(self.style.WARNING(f'{route}: {kinds}'))
+        self.stdout.write('Journeys: ' + ', '.join(f'{name} {count}' for name, count in sorted(stats.journeys.items())))
+        if stand_ins is not None:
+            self.stdout.write(
+                f'Stand-ins: {stand_ins.dns.queries} DNS queries, {stand_ins.whois.queries} WHOIS queries, '
+                f'{stand_ins.http.requests} HTTP requests'
+            )
+
+    def cleanup(self):
+        users = User.objects.filter(username__startswith=ACCOUNT_PREFIX)
+        reports = ScamReport.objects.filter(reporter__in=users)
+        count = reports.count()
+        # Reports outlive their reporter otherwise (SET_NULL)
+        reports.delete()
+        self.stdout.write(f'Deleted {users.count()} load test accounts and their {count} reports')
+        users.delete()
@@ -0,0 +1,552 @@
+import math
+import os
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from array import array
+from io import BytesIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.core.files.base import ContentFile
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from PIL import Image
+
+from myapp import reputation, urlcanon
+from myapp.models import (
+    EXCERPT_LENGTH, Donation, EvidenceBlob, ReportComment, ReportEvidence, ReportVote, ScamReport, UserProfile,
+    make_excerpt,
+)
+from myapp.storage import blob_name, content_digest, evidence_storage, image_hash
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+FIRST_NAMES = ['ayse', 'mehmet', 'elif', 'can', 'zeynep', 'emre', 'selin', 'burak', 'deniz', 'john', 'maria', 'alex']
+WORDS = ['kargo', 'odeme', 'yatirim', 'kripto', 'banka', 'kredi', 'iade', 'indirim', 'store', 'delivery', 'wallet',
+         'bonus', 'destek', 'hediye', 'market', 'outlet', 'trade', 'invest', 'secure', 'login', 'pay', 'shop']
+SUFFIXES = ['com', 'com', 'com', 'net', 'org', 'com.tr', 'com.tr', 'shop', 'online', 'co.uk', 'xyz', 'github.io']
+SUBDOMAINS = ['secure', 'login', 'pay', 'm', 'app', 'destek']
+REPORT_TYPE_WEIGHTS = {'shopping': 40, 'investment': 20, 'banking': 15, 'social': 15, 'other': 10}
+STATUS_WEIGHTS = {'pending': 70, 'verified': 22, 'rejected': 8}
+# Share of upvotes a report gets, by status
+UPVOTE_SHARE = {'pending': 0.6, 'verified': 0.85, 'rejected': 0.25}
+TITLES = [
+    '{brand} never delivered my order', 'Fake {brand} investment platform', '{brand} phishing page asks for card details',
+    '{brand} giveaway scam on social media', 'Refund scam pretending to be {brand}', '{brand} crypto doubling scheme',
+    'Cargo fee SMS from {brand}', '{brand} fake support line',
+]
+SENTENCES = [
+    'I paid with my credit card and never received anything.',
+    'The site looked exactly like the official store.',
+    'They asked for an extra customs fee after the payment.',
+    'Customer support stopped answering after the transfer.',
+    'The link came in an SMS about a pending cargo delivery.',
+    'They promised a guaranteed monthly return of twenty percent.',
+    'My bank flagged the transaction as suspicious the next day.',
+    'The domain was registered only a few weeks ago.',
+    'An account on Instagram advertised huge discounts.',
+    'The payment page requested my SMS verification code.',
+    'Several friends received the same message.',
+    'The company address on the site does not exist.',
+    'After I complained they blocked my number.',
+    'Withdrawals were always delayed with new excuses.',
+    'They impersonated a well known bank in the emails.',
+]
+COMMENTS = [
+    'Same thing happened to me.', 'Reported this to my bank as well.', 'Thanks for the warning!',
+    'They are now using a different domain.', 'I almost paid, glad I checked here first.',
+    'The police told me to file a complaint too.', 'Still online as of today.', 'Can confirm, total scam.',
+]
+EVIDENCE_TITLES = ['Payment receipt', 'Screenshot of checkout', 'SMS message', 'Email from the scammer', 'Chat log']
+CURRENCY_WEIGHTS = {'TRY': 70, 'USD': 20, 'EUR': 10}
+PAYMENT_STATUS_WEIGHTS = {'completed': 90, 'pending': 6, 'failed': 4}
+
+
+def zipf_cum_weights(count, exponent):
+    """
+    Cumulative Zipf weights for ranks 1..count, for random.choices
+    """
+    total = 0.0
+    cum_weights = []
+    for rank in range(1, count + 1):
+        total += rank ** -exponent
+        cum_weights.append(total)
+    return cum_weights
+
+
+def allocate(rng, total, weights, cap):
+    """
+    Split about total items over slots in proportion to weights, no slot
+    getting more than cap; the excess of capped slots is spread over the
+    others and fractions are rounded at random so small shares still add up
+    """
+    counts = [0] * len(weights)
+    active = [i for i, weight in enumerate(weights) if weight > 0]
+    remaining = total
+    while active and remaining > 0:
+        scale = remaining / sum(weights[i] for i in active)
+        over = [i for i in active if weights[i] * scale >= cap]
+        if not over:
+            random = rng.random
+            for i in active:
+                share = weights[i] * scale
+                counts[i] = int(share + random())
+            break
+        for i in over:
+            counts[i] = cap
+        remaining -= cap * len(over)
+        over = set(over)
+        active = [i for i in active if i not in over]
+    return counts
+
+
+def timestamp_factory():
+    """
+    Fast seconds-since-epoch -> database value conversion; the backend's own
+    adapter costs more than generating a row
+    """
+    if not isinstance(connection.ops.adapt_datetimefield_value(EPOCH), str):
+        return lambda seconds: EPOCH + timedelta(seconds=seconds)
+    # Text backends store naive UTC 'YYYY-MM-DD HH:MM:SS.ffffff'; format the
+    # date once per day and the time arithmetically
+    days = {}
+
+    def timestamp(seconds):
+        micros = int(seconds * 1_000_000)
+        day, micros = divmod(micros, 86_400_000_000)
+        date = days.get(day)
+        if date is None:
+            date = days[day] = (EPOCH + timedelta(days=day)).strftime('%Y-%m-%d ')
+        seconds, micros = divmod(micros, 1_000_000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f'{date}{hours:02d}:{minutes:02d}:{seconds:02d}.{micros:06d}'
+    return timestamp
+
+
+class Command(BaseCommand):
+    help = 'Generate realistic users, reports, votes, comments, evidence and donations for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--reports', type=int, default=100_000)
+        parser.add_argument('--votes', type=int, default=1_000_000)
+        parser.add_argument('--comments', type=int, default=None, help='Default: 3 per 10 votes')
+        parser.add_argument('--evidence', type=int, default=None, help='Default: half the number of reports')
+        parser.add_argument('--evidence-images', type=int, default=100,
+                            help='Distinct image files the evidence rows share')
+        parser.add_argument('--donations', type=int, default=None, help='Default: one per 5 reports')
+        parser.add_argument('--domains', type=int, default=None, help='Distinct scam domains, default: reports / 4')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Popularity skew of domains, reporters and reports')
+        parser.add_argument('--days', type=int, default=730, help='Spread the data over this many past days')
+        parser.add_argument('--password', default='password', help='Password of every generated user')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--skip-search-index', action='store_true',
+                            help='Do not rebuild the full-text search index afterwards')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        self.timestamp = timestamp_factory()
+        self.end = (timezone.now() - EPOCH).total_seconds()
+        self.start = self.end - options['days'] * 86400
+        self.rows = 0
+        self.insert_time = 0.0
+        self.evidence_images = options['evidence_images']
+        reports = options['reports']
+        votes = options['votes']
+
+        started = time.monotonic()
+        # Every generated row references ids generated before it, so the
+        # per-row foreign key lookups can be skipped, as loaddata does
+        with self.unsynced(), connection.constraint_checks_disabled():
+            self.create_users(options['users'], options['password'])
+            self.plan_reports(
+                reports, votes,
+                options['comments'] if options['comments'] is not None else votes * 3 // 10,
+                options['evidence'] if options['evidence'] is not None else reports // 2,
+                options['donations'] if options['donations'] is not None else reports // 5,
+                options['domains'] or max(1, reports // 4),
+            )
+            self.create_reports()
+            self.create_profiles()
+            self.create_votes()
+            self.create_comments()
+            self.create_evidence()
+            self.create_donations()
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [User, UserProfile, ScamReport, ReportVote, ReportComment, ReportEvidence, Donation]
+            ):
+                cursor.execute(sql)
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Inserted {self.rows} rows in {elapsed:.1f}s ({self.rows / elapsed:,.0f} rows/s, '
+            f'{self.rows / self.insert_time:,.0f} rows/s in the database)'
+        ))
+
+        if reports and not options['skip_search_index']:
+            call_command('rebuild_search_index', batch_size=5000, stdout=self.stdout)
+
+    @contextmanager
+    def unsynced(self):
+        """
+        On SQLite, skip the fsync after every batch and use a larger page
+        cache while seeding; losing the seed data in a crash is fine. The
+        previous settings are restored afterwards.
+        """
+        if connection.vendor != 'sqlite' or connection.in_atomic_block:
+            yield
+            return
+        pragmas = {'synchronous': 'OFF', 'cache_size': -262144}
+        with connection.cursor() as cursor:
+            previous = {}
+            for pragma, value in pragmas.items():
+                cursor.execute(f'PRAGMA {pragma}')
+                previous[pragma] = cursor.fetchone()[0]
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                for pragma, value in previous.items():
+                    cursor.execute(f'PRAGMA {pragma} = {value}')
+
+    def insert(self, model, fields, rows):
+        """
+        Write rows in batches with executemany. bulk_create builds a model
+        instance and a multi-row statement per batch, several times slower
+        at this volume.
+        """
+        opts = model._meta
+        quote = connection.ops.quote_name
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(opts.db_table),
+            ', '.join(quote(opts.get_field(name).column) for name in fields),
+            ', '.join(['%s'] * len(fields)),
+        )
+        count = 0
+        batch = []
+        with self.deferred_indexes(model):
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    count += self._write(sql, batch)
+                    batch = []
+            count += self._write(sql, batch)
+        self.rows += count
+        self.stdout.write(f'{opts.verbose_name_plural}: {count}')
+
+    @contextmanager
+    def deferred_indexes(self, model):
+        """
+        On SQLite, drop the table's indexes while it is filled and build
+        them again afterwards: sorting once is much cheaper than updating
+        the B-trees row by row
+        """
+        if connection.vendor != 'sqlite':
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                [model._meta.db_table]
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(name)}')
+        try:
+            yield
+        finally:
+            start = time.perf_counter()
+            with connection.cursor() as cursor:
+                for _, sql in indexes:
+                    cursor.execute(sql)
+            self.insert_time += time.perf_counter() - start
+
+    def _write(self, sql, batch):
+        if not batch:
+            return 0
+        start = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, batch)
+        self.insert_time += time.perf_counter() - start
+        return len(batch)
+
+    def next_id(self, model):
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def skewed_time(self, start=None):
+        # Newer activity is more common; squaring a uniform skews towards the end
+        start = self.start if start is None else start
+        return self.end - (self.end - start) * self.rng.random() ** 2
+
+    def create_users(self, count, password):
+        rng = self.rng
+        password = make_password(password)
+        self.first_user_id = self.next_id(User)
+        self.user_count = count
+        self.user_joined = array('d', (self.skewed_time() for _ in range(count)))
+        # Zipf over a shuffled ranking so the most active reporters are spread out
+        self.reporter_ranks = list(range(count))
+        rng.shuffle(self.reporter_ranks)
+        self.reporter_cum_weights = zipf_cum_weights(count, self.zipf)
+
+        def rows():
+            for i in range(count):
+                user_id = self.first_user_id + i
+                name = rng.choice(FIRST_NAMES)
+                yield (
+                    password, False, f'seed{user_id}', name.title(), '', f'{name}.{user_id}@example.com',
+                    False, True, self.timestamp(self.user_joined[i]),
+                )
+        self.insert(User, ['password', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                           'is_staff', 'is_active', 'date_joined'], rows())
+
+    def make_domains(self, count):
+        rng = self.rng
+        domains = []
+        for i in range(count):
+            host = f'{rng.choice(WORDS)}-{rng.choice(WORDS)}{i}.{rng.choice(SUFFIXES)}'
+            if rng.random() < 0.2:
+                host = f'{rng.choice(SUBDOMAINS)}.{host}'
+            domains.append((host, urlcanon.domain_key(host), urlcanon.registrable_domain(host)))
+        return domains
+
+    def plan_reports(self, reports, votes, comments, evidence, donations, domains):
+        """
+        Decide per report how many votes, comments, evidence items and
+        donations it gets, so counters can be written with the report
+        """
+        rng = self.rng
+        self.report_count = reports
+        self.first_report_id = self.next_id(ScamReport)
+        self.domains = self.make_domains(domains)
+        self.domain_cum_weights = zipf_cum_weights(domains, self.zipf)
+        # A few reports attract most of the activity
+        ranks = list(range(1, reports + 1))
+        rng.shuffle(ranks)
+        popularity = [rank ** -self.zipf for rank in ranks]
+        self.vote_counts = array('I', allocate(rng, votes, popularity, self.user_count))
+        self.comment_counts = array('I', allocate(rng, comments, popularity, 1000))
+        self.evidence_counts = array('I', allocate(rng, evidence, popularity, 50))
+        self.donation_counts = array('I', allocate(rng, donations, popularity, 1000))
+        self.upvote_counts = array('I', bytes(4 * reports))
+        self.report_times = array('d', bytes(8 * reports))
+        self.reporter_reports = array('I', bytes(4 * self.user_count))
+        self.reporter_verified = array('I', bytes(4 * self.user_count))
+        self.reporter_score = array('i', bytes(4 * self.user_count))
+
+    def create_reports(self):
+        rng = self.rng
+        report_types, type_weights = list(REPORT_TYPE_WEIGHTS), list(REPORT_TYPE_WEIGHTS.values())
+        statuses, status_weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        excerpts = {}
+
+        def rows():
+            for i in range(self.report_count):
+                reporter = self.reporter_ranks[
+                    rng.choices(range(self.user_count), cum_weights=self.reporter_cum_weights)[0]
+                ]
+                host, key, registrable = rng.choices(self.domains, cum_weights=self.domain_cum_weights)[0]
+                status = rng.choices(statuses, status_weights)[0]
+                report_type = rng.choices(report_types, type_weights)[0]
+                title = rng.choice(TITLES).format(brand=registrable.split('.')[0].split('-')[0].title())
+                # A random opening followed by a run of the other sentences keeps
+                # the number of distinct excerpts small enough to cache
+                first, start = rng.randrange(len(SENTENCES)), rng.randrange(len(SENTENCES))
+                description = ' '.join([SENTENCES[first]] + [
+                    SENTENCES[(start + j) % len(SENTENCES)] for j in range(rng.randint(1, 5))
+                ])
+                # Descriptions are single-spaced, so the excerpt only depends
+                # on the first EXCERPT_LENGTH + 1 characters
+                prefix = description[:EXCERPT_LENGTH + 1]
+                excerpt = excerpts.get(prefix)
+                if excerpt is None:
+                    excerpt = excerpts[prefix] = make_excerpt(description)
+
+                submitted = self.skewed_time(max(self.start, self.user_joined[reporter]))
+                self.report_times[i] = submitted
+                votes = self.vote_counts[i]
+                share = UPVOTE_SHARE[status]
+                upvotes = round(votes * share + rng.gauss(0, math.sqrt(votes * share * (1 - share))))
+                upvotes = min(votes, max(0, upvotes))
+                self.upvote_counts[i] = upvotes
+                downvotes = votes - upvotes
+
+                verified = status == 'verified'
+                self.reporter_reports[reporter] += 1
+                self.reporter_verified[reporter] += verified
+                self.reporter_score[reporter] += (
+                    reputation.VERIFIED_POINTS * verified +
+                    reputation.VOTE_POINTS['upvote'] * upvotes +
+                    reputation.VOTE_POINTS['downvote'] * downvotes
+                )
+                views = votes * rng.randint(5, 20) + rng.randint(0, 50)
+                updated = self.timestamp(min(self.end, submitted + rng.random() * 7 * 86400))
+                yield (
+                    self.first_report_id + i, self.first_user_id + reporter, report_type, title, description,
+                    excerpt, f'https://{host}/{rng.choice(WORDS)}?id={rng.randint(1, 99999)}', host, key,
+                    registrable, False, status, rng.random() < 0.95, self.timestamp(submitted), updated,
+                    views, views, False, updated if verified else None, upvotes, downvotes, 0,
+                )
+        self.insert(ScamReport, [
+            'id', 'reporter', 'report_type', 'title', 'description', 'excerpt', 'scam_url', 'domain', 'domain_key',
+            'registrable_domain', 'is_blacklisted', 'status', 'is_public', 'submission_date', 'last_updated',
+            'view_count', 'views', 'is_flagged', 'verification_date', 'upvotes', 'downvotes', 'fragment_version',
+        ], rows())
+
+    def create_profiles(self):
+        def rows():
+            for i in range(self.user_count):
+                yield (
+                    self.first_user_id + i, self.reporter_score[i], self.reporter_verified[i] > 0, False,
+                    self.timestamp(self.user_joined[i]), self.reporter_reports[i], self.reporter_verified[i], 0, 0,
+                )
+        self.insert(UserProfile, [
+            'user', 'reputation_score', 'is_verified', 'is_flagged', 'join_date', 'total_reports',
+            'verified_reports', 'flagged_reports', 'warning_count',
+        ], rows())
+
+    def distinct_users(self, count):
+        """
+        count different user ids: a random start and a stride coprime with
+        the number of users visit each user at most once
+        """
+        users = self.user_count
+        start = self.rng.randrange(users)
+        stride = self.rng.randrange(1, users) if users > 1 else 1
+        while math.gcd(stride, users) != 1:
+            stride += 1
+        first = self.first_user_id
+        return [first + (start + j * stride) % users for j in range(count)]
+
+    def activity_times(self, i, count):
+        # skewed_time() inlined, this runs once per vote
+        end, random, timestamp = self.end, self.rng.random, self.timestamp
+        span = end - self.report_times[i]
+        return [timestamp(end - span * random() ** 2) for _ in range(count)]
+
+    def create_votes(self):
+        def rows():
+            for i, count in enumerate(self.vote_counts):
+                if not count:
+                    continue
+                report_id = self.first_report_id + i
+                upvotes = self.upvote_counts[i]
+                vote_types = ['upvote'] * upvotes + ['downvote'] * (count - upvotes)
+                for user_id, vote_type, voted in zip(
+                    self.distinct_users(count), vote_types, self.activity_times(i, count)
+                ):
+                    yield report_id, user_id, vote_type, voted
+        self.insert(ReportVote, ['report', 'user', 'vote_type', 'vote_date'], rows())
+
+    def create_comments(self):
+        rng = self.rng
+
+        def rows():
+            first_user, users, random = self.first_user_id, self.user_count, rng.random
+            for i, count in enumerate(self.comment_counts):
+                report_id = self.first_report_id + i
+                for created in self.activity_times(i, count):
+                    yield report_id, first_user + int(random() * users), rng.choice(COMMENTS), created, random() < 0.3
+        self.insert(ReportComment, ['report', 'user', 'content', 'created_at', 'is_verified'], rows())
+
+    def make_image(self):
+        """
+        A PNG screenshot stand-in: a grid of random colour blocks
+        """
+        rng = self.rng
+        image = Image.new('RGB', (8, 6))
+        image.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256)) for _ in range(48)])
+        buffer = BytesIO()
+        image.resize((320, 240), Image.Resampling.NEAREST).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def create_images(self, count):
+        """
+        Store `count` images as evidence blobs without references; their
+        thumbnails are left to the generate_thumbnails command
+        """
+        storage = evidence_storage()
+        blobs = []
+        for _ in range(count):
+            data = self.make_image()
+            content = ContentFile(data)
+            digest = content_digest(content)
+            blob, _ = EvidenceBlob.objects.get_or_create(sha256=digest, defaults={
+                'name': blob_name(digest, 'seed.png'), 'size': content.size, 'ref_count': 0,
+                'dhash': image_hash(content, 'seed.png'),
+            })
+            path = storage.path(blob.name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            blobs.append(blob)
+        return blobs
+
+    def create_evidence(self):
+        """
+        Evidence rows sharing a pool of real image files, reference-counted
+        like uploads
+        """
+        rng = self.rng
+        total = sum(self.evidence_counts)
+        if not total:
+            return
+        names = [blob.name for blob in self.create_images(max(1, min(self.evidence_images, total)))]
+        references = Counter()
+
+        def rows():
+            first_user, users = self.first_user_id, self.user_count
+            for i, count in enumerate(self.evidence_counts):
+                report_id = self.first_report_id + i
+                for uploaded in self.activity_times(i, count):
+                    name = rng.choice(names)
+                    references[name] += 1
+                    yield (
+                        report_id, first_user + rng.randrange(users), rng.choice(EVIDENCE_TITLES),
+                        rng.choice(SENTENCES), name, uploaded, rng.random() < 0.4,
+                    )
+        self.insert(ReportEvidence, [
+            'report', 'user', 'title', 'description', 'file', 'uploaded_at', 'is_verified',
+        ], rows())
+        for name, count in references.items():
+            EvidenceBlob.objects.filter(name=name).update(ref_count=F('ref_count') + count)
+        for name in set(names) - set(references):
+            if EvidenceBlob.objects.filter(name=name, ref_count=0).delete()[0]:
+                evidence_storage().delete_blob_file(name)
+
+    def create_donations(self):
+        rng = self.rng
+        currencies, currency_weights = list(CURRENCY_WEIGHTS), list(CURRENCY_WEIGHTS.values())
+        statuses, status_weights = list(PAYMENT_STATUS_WEIGHTS), list(PAYMENT_STATUS_WEIGHTS.values())
+
+        def rows():
+            first_user, users = self.first_user_id, self.user_count
+            for i, count in enumerate(self.donation_counts):
+                report_id = self.first_report_id + i
+                for donated in self.activity_times(i, count):
+                    # Mostly small amounts with a long tail
+                    amount = Decimal(min(99999, round(rng.lognormvariate(3.5, 1.0), 2))).quantize(Decimal('0.01'))
+                    yield (
+                        first_user + rng.randrange(users), report_id, amount,
+                        rng.choices(currencies, currency_weights)[0], rng.choices(statuses, status_weights)[0],
+                        f'SEED-{report_id}-{rng.getrandbits(32):08x}', donated, donated,
+                        rng.random() < 0.2, '',
+                    )
+        self.insert(Donation, [
+            'user', 'report', 'amount', 'currency', 'payment_status', 'transaction_id', 'donation_date',
+            'last_updated', 'is_anonymous', 'message',
+        ], rows())
@@ -0,0 +1,639 @@
+"""
+Header-only metadata of evidence files.
+
+extract() never decodes pixels or page content. Image.open() reads just
+the image header, which is where Pillow finds the EXIF block of JPEG, WebP
+and TIFF files, and of PNG files storing it before the image data. A PDF
+is read from its end: the startxref offset leads to the cross-reference
+table or stream, whose trailer names the document catalog and the info
+dictionary, and only the few objects needed for the page count and the
+producer are read, seeking to them through the cross-reference entries.
+
+ScamEvidence.metadata is filled in off the request path: schedule() runs
+extract() in a pool of EVIDENCE_METADATA_WORKERS processes once the
+evidence is committed, see myapp.process_pool, and backfill() extracts the
+rows stored before in parallel. extract() only reads files, so this module
+imports Django models lazily.
+"""
+import os
+import re
+import zlib
+from collections import namedtuple
+
+from PIL import ExifTags, Image
+
+from .process_pool import BackgroundPool, process_pool
+
+IMAGE_TYPES = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'tiff', 'tif', 'bmp')
+
+# EXIF text longer than this is binary data such as a maker note
+MAX_TEXT_LENGTH = 256
+
+# The end of file marker and startxref must be in the last kilobyte, some
+# writers append a little more
+TAIL_SIZE = 4096
+READ_SIZE = 4096
+MAX_OBJECT_SIZE = 1024 * 1024
+MAX_XREF_SECTIONS = 64
+
+PDF_INFO_FIELDS = {
+    'Producer': 'producer', 'Creator': 'creator', 'Title': 'title', 'Author': 'author',
+    'CreationDate': 'creation_date', 'ModDate': 'modification_date',
+}
+
+
+def extract(path, file_type=None):
+    """
+    Metadata of the file at `path`, by extension unless file_type is given;
+    failures are reported under 'error'
+    """
+    file_type = (file_type or os.path.splitext(path)[1][1:]).lower()
+    metadata = {'file_type': file_type}
+    try:
+        metadata['size'] = os.path.getsize(path)
+        if file_type in IMAGE_TYPES:
+            metadata.update(image_metadata(path))
+        elif file_type == 'pdf':
+            metadata.update(pdf_metadata(path))
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        metadata['error'] = str(e) or e.__class__.__name__
+    return metadata
+
+
+def _json_value(value):
+    """
+    EXIF value as JSON: rationals become floats, short byte strings text
+    and anything else binary None
+    """
+    if isinstance(value, bytes):
+        if len(value) > MAX_TEXT_LENGTH:
+            return None
+        value = value.decode('utf-8', 'replace')
+    if isinstance(value, str):
+        # Postgres rejects NUL characters in JSON
+        return value.replace('\x00', '').strip()
+    if isinstance(value, (tuple, list)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, (bool, int)):
+        return value
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return str(value)
+    return number if number == number and abs(number) != float('inf') else None
+
+
+def _tags(ifd, names):
+    tags = {}
+    for tag, value in ifd.items():
+        value = _json_value(value)
+        if value is not None and value != '':
+            tags[names.get(tag, str(tag))] = value
+    return tags
+
+
+def image_metadata(path):
+    with Image.open(path) as image:
+        metadata = {'format': image.format, 'width': image.width, 'height': image.height, 'mode': image.mode}
+        # PngImageFile.getexif() decodes the image to look for an EXIF chunk
+        # after the pixel data
+        exif = Image.Image.getexif(image)
+        tags = _tags(exif, ExifTags.TAGS)
+        tags.pop('ExifOffset', None)
+        tags.pop('GPSInfo', None)
+        tags.update(_tags(exif.get_ifd(ExifTags.IFD.Exif), ExifTags.TAGS))
+        if tags:
+            metadata['exif'] = tags
+        gps = _tags(exif.get_ifd(ExifTags.IFD.GPSInfo), ExifTags.GPSTAGS)
+        if gps:
+            metadata['gps'] = gps
+    return metadata
+
+
+class PDFError(ValueError):
+    pass
+
+
+Ref = namedtuple('Ref', 'num gen')
+
+
+class Name(str):
+    pass
+
+
+class Keyword(str):
+    pass
+
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+DELIMITERS = b'()<>[]{}/%'
+NUMBER = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)')
+ESCAPES = {ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t', ord('b'): b'\b', ord('f'): b'\f'}
+
+
+class Parser:
+    """
+    Parses PDF objects from bytes; running past the end raises IndexError
+    so the caller can read more
+    """
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def skip(self):
+        data = self.data
+        while True:
+            while self.pos < len(data) and data[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(data) and data[self.pos] == ord('%'):
+                while self.pos < len(data) and data[self.pos] not in b'\r\n':
+                    self.pos += 1
+            else:
+                return
+
+    def token(self):
+        """
+        The next keyword or number, as bytes
+        """
+        self.skip()
+        start = self.pos
+        while self.pos < len(self.data) and self.data[self.pos] not in WHITESPACE + DELIMITERS:
+            self.pos += 1
+        if self.pos >= len(self.data):
+            raise IndexError('End of data')
+        return self.data[start:self.pos]
+
+    def integer(self):
+        token = self.token()
+        if not token.isdigit():
+            raise PDFError(f'Expected a number, found {token[:20]!r}')
+        return int(token)
+
+    def expect(self, keyword):
+        token = self.token()
+        if token != keyword:
+            raise PDFError(f'Expected {keyword.decode()}, found {token[:20]!r}')
+
+    def value(self):
+        self.skip()
+        data = self.data
+        char = data[self.pos]
+        if data.startswith(b'<<', self.pos):
+            self.pos += 2
+            result = {}
+            while True:
+                self.skip()
+                if data.startswith(b'>>', self.pos):
+                    self.pos += 2
+                    return result
+                key = self.value()
+                if not isinstance(key, Name):
+                    raise PDFError('Dictionary key is not a name')
+                result[str(key)] = self.value()
+        if char == ord('['):
+            self.pos += 1
+            result = []
+            while True:
+                self.skip()
+                if data[self.pos] == ord(']'):
+                    self.pos += 1
+                    return result
+                result.append(self.value())
+        if char == ord('/'):
+            self.pos += 1
+            start = self.pos
+            while data[self.pos] not in WHITESPACE + DELIMITERS:
+                self.pos += 1
+            name = re.sub(rb'#([0-9a-fA-F]{2})', lambda m: bytes([int(m[1], 16)]), data[start:self.pos])
+            return Name(name.decode('latin-1'))
+        if char == ord('('):
+            return self.literal_string()
+        if char == ord('<'):
+            end = data.find(b'>', self.pos)
+            if end < 0:
+                raise IndexError('End of data')
+            digits = re.sub(rb'\s', b'', data[self.pos + 1:end])
+            self.pos = end + 1
+            return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode('ascii'))
+
+        token = self.token()
+        if not token:
+            raise PDFError(f'Unexpected {data[self.pos:self.pos + 1]!r}')
+        if NUMBER.fullmatch(token):
+            if not token.isdigit():
+                return float(token)
+            # "num gen R" is a reference
+            mark = self.pos
+            try:
+                gen = self.token()
+                if gen.isdigit() and self.token() == b'R':
+                    return Ref(int(token), int(gen))
+            except IndexError:
+                if self.pos >= len(data):
+                    raise
+            self.pos = mark
+            return int(token)
+        return {b'true': True, b'false': False, b'null': None}.get(token, Keyword(token.decode('latin-1')))
+
+    def literal_string(self):
+        data = self.data
+        self.pos += 1
+        depth = 1
+        result = bytearray()
+        while True:
+            char = data[self.pos]
+            self.pos += 1
+            if char == ord('\\'):
+                char = data[self.pos]
+                self.pos += 1
+                if char in ESCAPES:
+                    result += ESCAPES[char]
+                elif char in b'01234567':
+                    digits = re.match(rb'[0-7]{1,3}', data[self.pos - 1:self.pos + 2])[0]
+                    self.pos += len(digits) - 1
+                    result.append(int(digits, 8) & 0xff)
+                elif char == ord('\r'):
+                    # A line continuation
+                    if data[self.pos] == ord('\n'):
+                        self.pos += 1
+                elif char != ord('\n'):
+                    result.append(char)
+                continue
+            if char == ord('('):
+                depth += 1
+            elif char == ord(')'):
+                depth -= 1
+                if not depth:
+                    return bytes(result)
+            result.append(char)
+
+
+def _unpredict(data, params):
+    """
+    Undo the PNG row predictors of a FlateDecode stream
+    """
+    predictor = params.get('Predictor', 1)
+    if predictor < 10:
+        if predictor != 1:
+            raise PDFError(f'Unsupported predictor {predictor}')
+        return data
+    columns = params.get('Columns', 1) * params.get('Colors', 1) * params.get('BitsPerComponent', 8) // 8
+    bpp = max(1, params.get('Colors', 1) * params.get('BitsPerComponent', 8) // 8)
+    rows = []
+    previous = bytearray(columns)
+    for start in range(0, len(data), columns + 1):
+        kind, row = data[start], bytearray(data[start + 1:start + 1 + columns])
+        for i in range(len(row)):
+            left = row[i - bpp] if i >= bpp else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xff
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xff
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xff
+            elif kind == 4:
+                up_left = previous[i - bpp] if i >= bpp else 0
+                estimate = left + up - up_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - up_left))
+                row[i] = (row[i] + (left, up, up_left)[distances.index(min(distances))]) & 0xff
+        rows.append(bytes(row))
+        previous = row
+    return b''.join(rows)
+
+
+def decode_stream(dictionary, data):
+    filters = dictionary.get('Filter') or []
+    params = dictionary.get('DecodeParms') or {}
+    if not isinstance(filters, list):
+        filters, params = [filters], [params]
+    elif not isinstance(params, list):
+        params = [params] * len(filters)
+    for name, param in zip(filters, params):
+        if name != 'FlateDecode':
+            raise PDFError(f'Unsupported stream filter {name}')
+        data = _unpredict(zlib.decompress(data), param or {})
+    return data
+
+
+class PDFReader:
+    """
+    Random access to the objects of a PDF file through its cross-reference
+    sections, newest first
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.f.seek(0, os.SEEK_END)
+        self.size = self.f.tell()
+        self.sections = []
+        self.trailer = {}
+        self._object_streams = {}
+        self._load_xref()
+
+    def read_at(self, offset, length):
+        self.f.seek(offset)
+        return self.f.read(length)
+
+    def parse_at(self, offset, parse):
+        """
+        parse(Parser) over the file from `offset`, reading more until the
+        result fits
+        """
+        length = READ_SIZE
+        while True:
+            parser = Parser(self.read_at(offset, length))
+            try:
+                return parse(parser), offset + parser.pos
+            except IndexError:
+                if length >= MAX_OBJECT_SIZE or offset + length >= self.size:
+                    raise PDFError(f'Truncated object at offset {offset}')
+                length *= 4
+
+    def _load_xref(self):
+        tail = self.read_at(max(0, self.size - TAIL_SIZE), TAIL_SIZE)
+        start = tail.rfind(b'startxref')
+        if start < 0:
+            raise PDFError('No startxref, the file is not a complete PDF')
+        offset = Parser(tail, start + len(b'startxref')).integer()
+        seen = set()
+        pending = [offset]
+        while pending and len(seen) < MAX_XREF_SECTIONS:
+            offset = pending.pop(0)
+            if offset in seen or not 0 <= offset < self.size:
+                continue
+            seen.add(offset)
+            trailer = self._read_section(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            # A hybrid file's stream ranks right after its own table
+            for key in ('XRefStm', 'Prev'):
+                if isinstance(trailer.get(key), int):
+                    pending.append(trailer[key])
+        if not self.sections:
+            raise PDFError('No cross-reference section')
+
+    def _read_section(self, offset):
+        if self.read_at(offset, 4) == b'xref':
+            return self._read_table(offset + 4)
+        (dictionary, data), _ = self.parse_at(offset, self._parse_object_with_stream)
+        if not isinstance(dictionary, dict) or dictionary.get('Type') != 'XRef' or data is None:
+            raise PDFError(f'No cross-reference section at offset {offset}')
+        data = decode_stream(dictionary, data)
+        widths = dictionary['W']
+        index = dictionary.get('Index') or [0, dictionary['Size']]
+        entries = {}
+        position = 0
+        entry_size = sum(widths)
+        for first, count in zip(index[::2], index[1::2]):
+            for num in range(first, first + count):
+                entry = data[position:position + entry_size]
+                position += entry_size
+                fields = []
+                start = 0
+                for width in widths:
+                    fields.append(int.from_bytes(entry[start:start + width], 'big') if width else None)
+                    start += width
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    entries[num] = ('offset', fields[1])
+                elif kind == 2:
+                    entries[num] = ('compressed', fields[1], fields[2] or 0)
+                else:
+                    entries[num] = ('free',)
+        self.sections.append(('stream', entries))
+        return dictionary
+
+    def _read_table(self, offset):
+        """
+        Note where each subsection's fixed 20-byte entries are and skip
+        over them to the trailer
+        """
+        subsections = []
+        while True:
+            result, position = self.parse_at(offset, self._subsection_header)
+            if result is None:
+                break
+            first, count = result
+            subsections.append((first, count, position))
+            offset = position + count * 20
+        self.sections.append(('table', subsections))
+        trailer, _ = self.parse_at(position, Parser.value)
+        if not isinstance(trailer, dict):
+            raise PDFError('Malformed trailer')
+        return trailer
+
+    @staticmethod
+    def _subsection_header(parser):
+        """
+        (first object number, count) of a table subsection, None at the
+        trailer
+        """
+        token = parser.token()
+        if token == b'trailer':
+            return None
+        if not token.isdigit():
+            raise PDFError(f'Malformed cross-reference table at {token[:20]!r}')
+        first, count = int(token), parser.integer()
+        # Entries start after the end of line
+        while parser.data[parser.pos] in WHITESPACE:
+            parser.pos += 1
+        return first, count
+
+    def _parse_object_with_stream(self, parser):
+        parser.integer()
+        parser.integer()
+        parser.expect(b'obj')
+        value = parser.value()
+        mark = parser.pos
+        if not isinstance(value, dict) or parser.token() != b'stream':
+            parser.pos = mark
+            return value, None
+        if parser.data.startswith(b'\r\n', parser.pos):
+            parser.pos += 2
+        elif parser.data[parser.pos] in b'\r\n':
+            parser.pos += 1
+        length = value.get('Length')
+        if isinstance(length, Ref):
+            length = self.resolve(length)
+        if not isinstance(length, int) or parser.pos + length > len(parser.data):
+            raise IndexError('Stream not read yet')
+        return value, parser.data[parser.pos:parser.pos + length]
+
+    def _entry(self, num):
+        for kind, section in self.sections:
+            if kind == 'stream':
+                if num in section:
+                    return section[num]
+                continue
+            for first, count, position in section:
+                if first <= num < first + count:
+                    line = self.read_at(position + (num - first) * 20, 20).split()
+                    if len(line) < 3:
+                        raise PDFError(f'Malformed cross-reference entry of object {num}')
+                    return ('offset', int(line[0])) if line[2] == b'n' else ('free',)
+        return ('free',)
+
+    def object(self, ref):
+        entry = self._entry(ref.num)
+        if entry[0] == 'offset':
+            (value, _), _ = self.parse_at(entry[1], self._parse_object_with_stream)
+            return value
+        if entry[0] == 'compressed':
+            return self._compressed_object(entry[1], entry[2])
+        return None
+
+    def _compressed_object(self, stream_num, index):
+        if stream_num not in self._object_streams:
+            entry = self._entry(stream_num)
+            if entry[0] != 'offset':
+                raise PDFError(f'Object stream {stream_num} not found')
+            (dictionary, data), _ = self.parse_at(entry[1], self._parse_object_with_stream)
+            self._object_streams[stream_num] = (dictionary, decode_stream(dictionary, data))
+        dictionary, data = self._object_streams[stream_num]
+        parser = Parser(data)
+        offsets = [(parser.integer(), parser.integer()) for _ in range(dictionary['N'])]
+        parser.pos = dictionary['First'] + offsets[index][1]
+        return parser.value()
+
+    def resolve(self, value, depth=0):
+        while isinstance(value, Ref):
+            if depth > 32:
+                raise PDFError('Reference loop')
+            value = self.object(value)
+            depth += 1
+        return value
+
+
+def pdf_text(value):
+    """
+    A PDF text string: UTF-16 with a byte order mark, UTF-8 with one, or
+    PDFDocEncoding, close enough to Latin-1 for metadata
+    """
+    if not isinstance(value, bytes):
+        return str(value)
+    if value.startswith(b'\xfe\xff'):
+        text = value[2:].decode('utf-16-be', 'replace')
+    elif value.startswith(b'\xef\xbb\xbf'):
+        text = value[3:].decode('utf-8', 'replace')
+    else:
+        text = value.decode('latin-1')
+    return text.replace('\x00', '').strip()
+
+
+PDF_DATE = re.compile(r"D:(\d{4})(\d{2})?(\d{2})?(\d{2})?(\d{2})?(\d{2})?(Z|[+-]\d{2}'?\d{2}'?)?")
+
+
+def pdf_date(text):
+    """
+    D:YYYYMMDDHHmmSSOHH'mm' as ISO 8601, other text unchanged
+    """
+    match = PDF_DATE.match(text)
+    if not match:
+        return text
+    year, month, day, hour, minute, second, zone = match.groups()
+    result = f'{year}-{month or "01"}-{day or "01"}T{hour or "00"}:{minute or "00"}:{second or "00"}'
+    if zone == 'Z':
+        result += 'Z'
+    elif zone:
+        digits = zone.replace("'", '')
+        result += f'{digits[:3]}:{digits[3:5] or "00"}'
+    return result
+
+
+def pdf_metadata(path):
+    try:
+        return _pdf_metadata(path)
+    except (IndexError, KeyError, TypeError, RecursionError, zlib.error) as e:
+        raise PDFError(f'Malformed PDF: {e}')
+
+
+def _pdf_metadata(path):
+    with open(path, 'rb') as f:
+        header = f.read(1024)
+        match = re.search(rb'%PDF-(\d\.\d)', header)
+        if not match:
+            raise PDFError('No PDF header')
+        metadata = {'version': match[1].decode()}
+        reader = PDFReader(f)
+        trailer = reader.trailer
+        catalog = reader.resolve(trailer.get('Root'))
+        if isinstance(catalog, dict):
+            if isinstance(catalog.get('Version'), Name) and catalog['Version'] > metadata['version']:
+                metadata['version'] = str(catalog['Version'])
+            pages = reader.resolve(catalog.get('Pages'))
+            count = reader.resolve(pages.get('Count')) if isinstance(pages, dict) else None
+            if isinstance(count, int):
+                metadata['pages'] = count
+        metadata['encrypted'] = 'Encrypt' in trailer
+        info = reader.resolve(trailer.get('Info'))
+        # Encrypted documents encrypt their info strings too
+        if isinstance(info, dict) and not metadata['encrypted']:
+            for key, field in PDF_INFO_FIELDS.items():
+                value = reader.resolve(info.get(key))
+                if isinstance(value, (bytes, str)):
+                    text = pdf_text(value)
+                    if text:
+                        metadata[field] = pdf_date(text) if field.endswith('_date') else text
+    return metadata
+
+
+_background = BackgroundPool('EVIDENCE_METADATA_WORKERS', 1)
+
+
+def schedule(evidence):
+    """
+    Extract the metadata of a ScamEvidence once the current transaction
+    commits and store it unless the file was replaced meanwhile
+    """
+    from .models import ScamEvidence
+    from .storage import evidence_storage
+
+    pk, name = evidence.pk, evidence.file.name
+
+    def store(metadata):
+        ScamEvidence.objects.filter(pk=pk, file=name).update(metadata=metadata)
+
+    _background.run_after_commit(
+        extract, (evidence_storage().path(name), evidence.file_type), store, f'Extracting the metadata of {name}'
+    )
+
+
+def backfill(batch_size=500, workers=None, redo=False, progress=None):
+    """
+    Extract the metadata of every ScamEvidence without it, or of all of them
+    with redo=True, batch_size rows at a time on `workers` processes; a file
+    shared by several rows is read once per batch. Returns (extracted,
+    failed), the numbers of rows stored without and with an 'error';
+    progress(extracted, failed, total) is called after each batch.
+    """
+    from .models import ScamEvidence
+    from .storage import evidence_storage
+
+    rows = ScamEvidence.objects.exclude(file='')
+    if not redo:
+        rows = rows.filter(metadata__isnull=True)
+    total = rows.count()
+    workers = workers or os.cpu_count() or 1
+    extracted = failed = 0
+    after = 0
+    with process_pool(workers) as executor:
+        while True:
+            batch = list(rows.filter(id__gt=after).order_by('id').values_list('id', 'file', 'file_type')[:batch_size])
+            if not batch:
+                break
+            after = batch[-1][0]
+            files = {name: file_type for _, name, file_type in batch}
+            results = dict(zip(files, executor.map(
+                extract, [evidence_storage().path(name) for name in files], files.values(),
+                chunksize=max(1, len(files) // (workers * 4)),
+            )))
+            updates = [ScamEvidence(id=row_id, metadata=results[name]) for row_id, name, _ in batch]
+            ScamEvidence.objects.bulk_update(updates, ['metadata'])
+            errors = sum(1 for row in updates if 'error' in row.metadata)
+            extracted += len(updates) - errors
+            failed += errors
+            if progress:
+                progress(extracted, failed, total)
+    return extracted, failed
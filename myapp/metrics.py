@@ -0,0 +1,189 @@
+"""
+Per-view request metrics in Prometheus histograms.
+
+MetricsMiddleware times every request and, through a database
+execute_wrapper, counts its queries and the time spent in them. The
+observations are kept per URL name in fixed-bucket histograms in this
+process and exposed in the Prometheus text format by views.prometheus_metrics; each
+worker process reports its own series, distinguished by the scrape target.
+"""
+import bisect
+import heapq
+import hmac
+import ipaddress
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+METRICS = (
+    ('request_duration_seconds', 'Time spent handling a request', DURATION_BUCKETS),
+    ('request_queries', 'Database queries run by a request', QUERY_BUCKETS),
+    ('request_sql_duration_seconds', 'Time a request spent in database queries', DURATION_BUCKETS),
+    ('response_size_bytes', 'Size of the response body', SIZE_BUCKETS),
+)
+
+UNRESOLVED = '<unresolved>'
+
+# Behind a reverse proxy every request comes from a private address, so only
+# loopback is trusted unless METRICS_ALLOWED_NETWORKS says otherwise
+DEFAULT_ALLOWED_NETWORKS = ('127.0.0.0/8', '::1/128')
+
+
+class Histogram:
+    """
+    Cumulative-on-export histogram over fixed upper bounds
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # One slot per bucket plus the +Inf overflow
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+
+    def __init__(self):
+        # (metric name, view name) -> Histogram
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, view_name, values):
+        """
+        Record one request; values holds one number per entry of METRICS
+        """
+        with self._lock:
+            for (name, _, buckets), value in zip(METRICS, values):
+                histogram = self._histograms.get((name, view_name))
+                if histogram is None:
+                    histogram = self._histograms[name, view_name] = Histogram(buckets)
+                histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def get(self, name, view_name):
+        return self._histograms.get((name, view_name))
+
+    def render(self, prefix='django'):
+        """
+        All histograms in the Prometheus text exposition format
+        """
+        with self._lock:
+            snapshot = sorted(
+                (key, list(h.counts), h.sum, h.count, h.buckets) for key, h in self._histograms.items()
+            )
+        lines = []
+        for metric, description, _ in METRICS:
+            name = f'{prefix}_{metric}'
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (key, view_name), counts, total, count, buckets in snapshot:
+                if key != metric:
+                    continue
+                label = view_name.replace('\\', '\\\\').replace('"', '\\"')
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{view="{label}"}} {total:.6g}')
+                lines.append(f'{name}_count{{view="{label}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper hook counting a request's queries and
+    keeping the slowest few for the slow-request log
+    """
+
+    def __init__(self, keep=0):
+        self.count = 0
+        self.duration = 0.0
+        self.keep = keep
+        self.slowest = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.keep:
+                # Tie-break on the count so SQL strings are never compared
+                entry = (elapsed, self.count, sql)
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, entry)
+                elif elapsed > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, entry)
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match is not None else None) or UNRESOLVED
+
+
+def slow_request_threshold():
+    """
+    Seconds after which a request is logged with its slowest queries, None
+    to disable the log
+    """
+    return getattr(settings, 'SLOW_REQUEST_THRESHOLD', None)
+
+
+def log_slow_request(request, name, elapsed, recorder):
+    queries = '\n'.join(
+        f'  {duration * 1000:8.1f} ms  {sql}' for duration, _, sql in sorted(recorder.slowest, reverse=True)
+    )
+    logger.warning(
+        'Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms\n%s',
+        request.method, request.path, name, elapsed * 1000, recorder.count, recorder.duration * 1000, queries
+    )
+
+
+def can_scrape(request):
+    """
+    Staff users, requests bearing METRICS_TOKEN as "Authorization: Bearer
+    <token>", and requests whose REMOTE_ADDR is in METRICS_ALLOWED_NETWORKS
+    (X-Forwarded-For is ignored, it is set by the client)
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_staff:
+        return True
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and hmac.compare_digest(
+        request.META.get('HTTP_AUTHORIZATION', '').encode(), f'Bearer {token}'.encode()
+    ):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    networks = getattr(settings, 'METRICS_ALLOWED_NETWORKS', DEFAULT_ALLOWED_NETWORKS)
+    return any(address in ipaddress.ip_network(network) for network in networks)
@@ -1,48 +1,105 @@
-import requests
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.db import connection
 from .models import UserProfile
-from django.utils import timezone
-import json
+from .geolocation import geolocator
+from .context_processors import get_profile
+from . import metrics
+import time
+
+TRACKING_SESSION_KEY = '_user_tracking'
 
 class UserTrackingMiddleware:
+    """
+    Records the last IP address and location of authenticated users.
+
+    What was last written is remembered in the session, so the profile is
+    only updated when the IP or location changes or when
+    USER_TRACKING_WRITE_INTERVAL seconds have passed; other requests do no
+    profile queries at all.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
         if request.user.is_authenticated:
-            ip_address = self.get_client_ip(request)
-            location = self.get_location_from_ip(ip_address)
-            
-            try:
-                profile = UserProfile.objects.get(user=request.user)
-                profile.last_ip = ip_address
-                profile.last_location = location
-                profile.last_login_time = timezone.now()
-                profile.save()
-            except UserProfile.DoesNotExist:
-                UserProfile.objects.create(
-                    user=request.user,
-                    last_ip=ip_address,
-                    last_location=location
-                )
+            self.track(request)
 
         response = self.get_response(request)
         return response
 
+    def track(self, request):
+        ip_address = self.get_client_ip(request)
+        # None while the location is still being resolved in the background
+        location = self.get_location_from_ip(ip_address)
+
+        marker = request.session.get(TRACKING_SESSION_KEY)
+        now = time.time()
+        if marker and self.is_fresh(marker, ip_address, location, now):
+            return
+
+        updates = {'last_ip': ip_address}
+        if location is not None:
+            updates['last_location'] = location
+        if not UserProfile.objects.filter(user=request.user).update(**updates):
+            UserProfile.objects.get_or_create(user=request.user, defaults=updates)
+        else:
+            # Keep the profile loaded with the session user in step for this request
+            profile = get_profile(request.user)
+            if profile is not None:
+                for name, value in updates.items():
+                    setattr(profile, name, value)
+
+        request.session[TRACKING_SESSION_KEY] = {
+            'ip': ip_address,
+            'location': location if location is not None else (marker or {}).get('location'),
+            'written_at': now,
+        }
+
+    def is_fresh(self, marker, ip_address, location, now):
+        interval = getattr(settings, 'USER_TRACKING_WRITE_INTERVAL', 15 * 60)
+        return (
+            marker['ip'] == ip_address and
+            (location is None or marker['location'] == location) and
+            now - marker['written_at'] < interval
+        )
+
     def get_client_ip(self, request):
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
         if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
+            ip = x_forwarded_for.split(',')[0].strip()
         else:
             ip = request.META.get('REMOTE_ADDR')
         return ip
 
     def get_location_from_ip(self, ip):
-        try:
-            response = requests.get(f'http://ip-api.com/json/{ip}')
-            data = response.json()
-            if data['status'] == 'success':
-                return f"{data['city']}, {data['country']} ({data['isp']})"
-            return "Konum bilgisi alınamadı"
-        except:
-            return "Konum bilgisi alınamadı" 
\ No newline at end of file
+        return geolocator.locate(ip)
+
+
+class MetricsMiddleware:
+    """
+    Records duration, query count, SQL time and response size per URL name
+    in myapp.metrics; requests slower than SLOW_REQUEST_THRESHOLD seconds
+    are logged with their SLOW_REQUEST_TOP_QUERIES slowest queries.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = metrics.slow_request_threshold()
+        recorder = metrics.QueryRecorder(
+            keep=getattr(settings, 'SLOW_REQUEST_TOP_QUERIES', 5) if threshold is not None else 0
+        )
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        name = metrics.view_name(request)
+        metrics.registry.observe(
+            name, (elapsed, recorder.count, recorder.duration, metrics.response_size(response))
+        )
+        if threshold is not None and elapsed >= threshold:
+            metrics.log_slow_request(request, name, elapsed, recorder)
+        return response
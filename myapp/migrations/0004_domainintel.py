@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0003_scamreport_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DomainIntel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('domain', models.CharField(max_length=253)),
+                ('kind', models.CharField(choices=[('whois', 'WHOIS'), ('dns', 'DNS Records'), ('ip', 'IP Address')], max_length=10)),
+                ('payload', models.JSONField()),
+                ('is_negative', models.BooleanField(default=False)),
+                ('fetched_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Domain Intelligence',
+                'verbose_name_plural': 'Domain Intelligence',
+                'unique_together': {('domain', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 12:51
+
+from django.db import migrations
+from django.db.models import F
+
+
+def reconcile_view_counts(apps, schema_editor):
+    # views and view_count are kept in step from now on; start both from
+    # the larger of the two.
+    ScamReport = apps.get_model('myapp', 'ScamReport')
+    ScamReport.objects.filter(views__lt=F('view_count')).update(views=F('view_count'))
+    ScamReport.objects.filter(view_count__lt=F('views')).update(view_count=F('views'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_analysisjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(reconcile_view_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_votes(apps, schema_editor):
+    ScamReport = apps.get_model('myapp', 'ScamReport')
+    ReportVote = apps.get_model('myapp', 'ReportVote')
+    rows = ReportVote.objects.values('report', 'vote_type').annotate(total=Count('id')).order_by()
+    for row in rows:
+        field = 'upvotes' if row['vote_type'] == 'upvote' else 'downvotes'
+        ScamReport.objects.filter(id=row['report']).update(**{field: row['total']})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0006_reconcile_view_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scamreport',
+            name='downvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='scamreport',
+            name='upvotes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_votes, migrations.RunPython.noop),
+    ]
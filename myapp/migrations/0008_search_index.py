@@ -0,0 +1,78 @@
+# Generated by Django 5.2 on 2026-10-18 13:31
+
+import unicodedata
+
+from django.db import migrations
+
+# A frozen copy of myapp.search.fold(), migrations must not use app code
+_TURKISH_FOLD = str.maketrans({'İ': 'i', 'I': 'i', 'ı': 'i'})
+
+
+def fold(text):
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text.translate(_TURKISH_FOLD).casefold())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS myapp_scamreport_fts '
+            'USING fts5(title, description, scam_url, report_type, tokenize="unicode61")'
+        )
+        sql = (
+            'INSERT INTO myapp_scamreport_fts (title, description, scam_url, report_type, rowid) '
+            'VALUES (%s, %s, %s, %s, %s)'
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE myapp_scamreport ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS myapp_scamreport_search_vector_gin '
+            'ON myapp_scamreport USING gin (search_vector)'
+        )
+        sql = (
+            "UPDATE myapp_scamreport SET search_vector = "
+            "setweight(to_tsvector('simple', %s), 'A') || "
+            "setweight(to_tsvector('simple', %s), 'B') || "
+            "setweight(to_tsvector('simple', %s), 'C') || "
+            "setweight(to_tsvector('simple', %s), 'C') WHERE id = %s"
+        )
+    else:
+        return
+
+    ScamReport = apps.get_model('myapp', 'ScamReport')
+    labels = dict(ScamReport._meta.get_field('report_type').choices)
+    rows = ScamReport.objects.using(connection.alias).values_list(
+        'id', 'report_type', 'title', 'description', 'scam_url'
+    ).iterator(chunk_size=1000)
+    batch = []
+    with connection.cursor() as cursor:
+        for report_id, report_type, title, description, scam_url in rows:
+            type_label = labels.get(report_type, report_type or '')
+            batch.append((fold(title), fold(description), fold(scam_url), fold(type_label), report_id))
+            if len(batch) >= 1000:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS myapp_scamreport_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE myapp_scamreport DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_scamreport_vote_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
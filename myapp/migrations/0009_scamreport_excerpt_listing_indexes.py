@@ -0,0 +1,51 @@
+# Generated by Django 5.2 on 2026-10-18 12:39
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+# A frozen copy of myapp.models.make_excerpt(), migrations must not use app code
+def make_excerpt(text):
+    return Truncator(' '.join((text or '').split())).chars(200)
+
+
+def fill_excerpts(apps, schema_editor):
+    ScamReport = apps.get_model('myapp', 'ScamReport')
+    batch = []
+    for report in ScamReport.objects.only('id', 'description').iterator(chunk_size=1000):
+        report.excerpt = make_excerpt(report.description)
+        batch.append(report)
+        if len(batch) >= 1000:
+            ScamReport.objects.bulk_update(batch, ['excerpt'])
+            batch = []
+    ScamReport.objects.bulk_update(batch, ['excerpt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scamreport',
+            name='excerpt',
+            field=models.CharField(blank=True, default='', max_length=200),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='scamreport',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['-submission_date', '-id'], name='report_public_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scamreport',
+            index=models.Index(condition=models.Q(('is_public', True)), fields=['report_type', '-submission_date', '-id'], name='report_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scamreport',
+            index=models.Index(fields=['reporter', '-submission_date', '-id'], name='report_reporter_date_idx'),
+        ),
+    ]
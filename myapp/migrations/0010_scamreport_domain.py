@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0009_scamreport_excerpt_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scamreport',
+            name='domain',
+            field=models.CharField(blank=True, default='', max_length=253),
+        ),
+        migrations.AddField(
+            model_name='scamreport',
+            name='domain_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=253),
+        ),
+        migrations.AddField(
+            model_name='scamreport',
+            name='registrable_domain',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=253),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 12:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0010_scamreport_domain'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='donation',
+            name='report',
+            field=models.ForeignKey(blank=True, help_text='Report whose reporter the donation supports, if any', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='donations', to='myapp.scamreport'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0011_donation_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='scamreport',
+            name='fragment_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
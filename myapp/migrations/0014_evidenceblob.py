@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-18 13:41
+
+import myapp.models
+import myapp.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0013_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvidenceBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='reportevidence',
+            name='file',
+            field=models.FileField(storage=myapp.storage.evidence_storage, upload_to='evidence/'),
+        ),
+        migrations.AlterField(
+            model_name='scamevidence',
+            name='file',
+            field=models.FileField(storage=myapp.storage.evidence_storage, upload_to=myapp.models.scam_evidence_path),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0014_evidenceblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidenceblob',
+            name='dhash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
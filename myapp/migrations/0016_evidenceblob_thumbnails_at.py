@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0015_evidenceblob_dhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidenceblob',
+            name='thumbnails_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
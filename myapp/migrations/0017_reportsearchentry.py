@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 15:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0016_evidenceblob_thumbnails_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportSearchEntry',
+            fields=[
+                ('report', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='myapp.scamreport')),
+            ],
+            options={
+                'db_table': 'myapp_scamreport_fts',
+                'managed': False,
+            },
+        ),
+    ]
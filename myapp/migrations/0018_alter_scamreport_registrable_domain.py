@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0017_reportsearchentry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scamreport',
+            name='registrable_domain',
+            field=models.CharField(blank=True, default='', max_length=253),
+        ),
+    ]
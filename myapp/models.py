@@ -1,10 +1,70 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.text import Truncator
 import os
+import time
+import uuid
+
+from . import thumbnails, urlcanon
+from .storage import evidence_storage
+
 
 def scam_evidence_path(instance, filename):
-    return f'scam_evidence/{instance.id}/{filename}'
+    # The evidence storage files it under its content hash, the id is not
+    # known yet when the file is saved with a new row
+    return f'scam_evidence/{filename}'
+
+EXCERPT_LENGTH = 200
+
+
+def make_excerpt(text):
+    return Truncator(' '.join((text or '').split())).chars(EXCERPT_LENGTH)
+
+
+def new_fragment_version():
+    # A wall-clock stamp rather than a counter: a stale instance saved
+    # later gets a fresh stamp, so no version is ever reused
+    return time.time_ns()
+
+# Listings read the precomputed excerpt instead of the full description
+LISTING_DEFERRED_FIELDS = ('description', 'blacklist_details', 'url_analysis')
+
+RECENT_DONATIONS = 5
+
+
+class ScamReportQuerySet(models.QuerySet):
+
+    def for_list(self):
+        """
+        Listing rows: the reporter joined in, large text fields left out
+        """
+        return self.select_related('reporter').defer(*LISTING_DEFERRED_FIELDS)
+
+    def for_detail(self):
+        """
+        Everything the detail page renders, in a fixed number of queries
+        however many comments, evidence items or donations a report has
+        """
+        return self.select_related('reporter').prefetch_related(*detail_prefetches())
+
+
+def detail_prefetches(*relations):
+    """
+    Prefetches of the related rows the detail page shows, for the given
+    relations ('evidence', 'comments', 'donations') or all of them
+    """
+    prefetches = {
+        'evidence': models.Prefetch('evidence', queryset=ReportEvidence.objects.with_thumbnails().order_by('-uploaded_at')),
+        'comments': models.Prefetch('comments', queryset=ReportComment.objects.select_related('user')),
+        'donations': models.Prefetch(
+            'donations',
+            queryset=Donation.objects.filter(payment_status='completed').select_related('user')[:RECENT_DONATIONS],
+            to_attr='recent_donations'
+        ),
+    }
+    return [prefetches[relation] for relation in relations or prefetches]
+
 
 class ScamReport(models.Model):
     REPORT_TYPES = [
@@ -31,7 +91,14 @@ class ScamReport(models.Model):
     report_type = models.CharField(max_length=20, choices=REPORT_TYPES)
     title = models.CharField(max_length=200)
     description = models.TextField()
+    # Short plain-text preview shown in listings, which defer description
+    excerpt = models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='')
     scam_url = models.URLField(blank=True, null=True)
+    # Canonical host and registrable domain of scam_url, see urlcanon;
+    # domain_key is the host with its labels reversed for subdomain seeks
+    domain = models.CharField(max_length=253, blank=True, default='')
+    domain_key = models.CharField(max_length=253, blank=True, default='', db_index=True)
+    registrable_domain = models.CharField(max_length=253, blank=True, default='')
     domain_age = models.CharField(max_length=100, blank=True, null=True)
     domain_registrar = models.CharField(max_length=200, blank=True, null=True)
     domain_country = models.CharField(max_length=100, blank=True, null=True)
@@ -48,6 +115,34 @@ class ScamReport(models.Model):
     verified_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='verified_reports')
     verification_date = models.DateTimeField(null=True, blank=True)
     views = models.IntegerField(default=0)
+    url_analysis = models.JSONField(blank=True, null=True)
+    analyzed_at = models.DateTimeField(null=True, blank=True)
+    upvotes = models.IntegerField(default=0)
+    downvotes = models.IntegerField(default=0)
+    # Part of the cache key of the rendered page fragments (myapp.fragments);
+    # changes on every save and on changes to comments, evidence and donations
+    fragment_version = models.BigIntegerField(default=0, editable=False)
+
+    objects = ScamReportQuerySet.as_manager()
+
+    # Fields whose transitions move reputation and the reporter's profile counters
+    TRACKED_FIELDS = ('reporter_id', 'status', 'is_flagged')
+
+    # Tracked field values as last loaded or saved, used to detect transitions;
+    # DEFERRED until known, then loaded by a pre_save handler
+    _saved_state = models.DEFERRED
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if all(field in instance.__dict__ for field in cls.TRACKED_FIELDS):
+            instance._saved_state = instance.tracked_state()
+        else:
+            instance._saved_state = models.DEFERRED
+        return instance
+
+    def tracked_state(self):
+        return tuple(getattr(self, field) for field in self.TRACKED_FIELDS)
 
     def __str__(self):
         return self.title
@@ -55,16 +150,60 @@ class ScamReport(models.Model):
     def save(self, *args, **kwargs):
         if self.status == 'verified' and not self.verification_date:
             self.verification_date = timezone.now()
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        deferred = self.get_deferred_fields()
+        self.fragment_version = new_fragment_version()
+        derived = {'fragment_version'}
+        if update_fields is None or 'description' in update_fields:
+            if 'description' not in deferred:
+                self.excerpt = make_excerpt(self.description)
+                derived.add('excerpt')
+        if update_fields is None or 'scam_url' in update_fields:
+            if 'scam_url' not in deferred:
+                self.domain, self.registrable_domain = urlcanon.split_url(self.scam_url)
+                self.domain_key = urlcanon.domain_key(self.domain)
+                derived.update(('domain', 'domain_key', 'registrable_domain'))
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, *derived}
+        # The post_save handlers keep reputation and the profile counters in
+        # step, in the same transaction as the report
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     class Meta:
         ordering = ['-submission_date']
         verbose_name = 'Scam Report'
         verbose_name_plural = 'Scam Reports'
+        indexes = [
+            # Keyset pagination of the listings on (submission_date, id)
+            models.Index(
+                fields=['-submission_date', '-id'], condition=models.Q(is_public=True),
+                name='report_public_date_idx'
+            ),
+            models.Index(
+                fields=['report_type', '-submission_date', '-id'], condition=models.Q(is_public=True),
+                name='report_type_date_idx'
+            ),
+            models.Index(fields=['reporter', '-submission_date', '-id'], name='report_reporter_date_idx'),
+        ]
+
+class ReportSearchEntry(models.Model):
+    """
+    A row of the SQLite FTS5 search index, see myapp.search; only mapped so
+    searches can join it, the table is maintained by the search backend
+    """
+    report = models.OneToOneField(
+        ScamReport, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_entry'
+    )
+
+    class Meta:
+        managed = False
+        db_table = 'myapp_scamreport_fts'
 
 class ScamEvidence(models.Model):
     report = models.ForeignKey(ScamReport, on_delete=models.CASCADE, related_name='scam_evidence')
-    file = models.FileField(upload_to=scam_evidence_path)
+    file = models.FileField(upload_to=scam_evidence_path, storage=evidence_storage)
     description = models.TextField()
     file_type = models.CharField(max_length=50)
     metadata = models.JSONField(blank=True, null=True)
@@ -78,6 +217,24 @@ class ScamEvidence(models.Model):
             self.file_type = os.path.splitext(self.file.name)[1][1:].lower()
         super().save(*args, **kwargs)
 
+class EvidenceBlob(models.Model):
+    """
+    An evidence file stored once under its SHA-256 and shared by every
+    evidence row with the same content, see myapp.storage
+    """
+    sha256 = models.CharField(max_length=64, unique=True)
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    # Perceptual hash of images as a signed 64-bit value, see myapp.perceptual
+    dhash = models.BigIntegerField(null=True, blank=True)
+    # When the thumbnails were rendered, see myapp.thumbnails
+    thumbnails_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
 class ReportComment(models.Model):
     report = models.ForeignKey(ScamReport, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -117,15 +274,13 @@ class UserProfile(models.Model):
         return f"{self.user.username}'s Profile"
 
     def update_reputation(self):
-        verified_reports = self.user.submitted_reports.filter(status='verified').count()
-        total_upvotes = sum(report.reportvote_set.filter(vote_type='upvote').count() 
-                           for report in self.user.submitted_reports.all())
-        total_downvotes = sum(report.reportvote_set.filter(vote_type='downvote').count() 
-                            for report in self.user.submitted_reports.all())
-        
-
-        self.reputation_score = (verified_reports * 10) + (total_upvotes * 2) - (total_downvotes * 1)
-        self.save()
+        """
+        Recompute the score from scratch, votes and status changes keep it
+        up to date incrementally through myapp.reputation
+        """
+        from .reputation import compute_scores
+        self.reputation_score = compute_scores(reporter=self.user_id).get(self.user_id, 0)
+        self.save(update_fields=['reputation_score'])
 
 class ReportVote(models.Model):
     VOTE_CHOICES = [
@@ -141,19 +296,35 @@ class ReportVote(models.Model):
     class Meta:
         unique_together = ['report', 'user']
 
+    # Vote type as last loaded or saved, used to apply reputation deltas
+    _saved_vote_type = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._saved_vote_type = instance.__dict__.get('vote_type', models.DEFERRED)
+        return instance
+
     def __str__(self):
         return f"{self.user.username} {self.vote_type}d {self.report.title}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.report.reporter.userprofile.update_reputation()
+class ReportEvidenceQuerySet(models.QuerySet):
+
+    def with_thumbnails(self):
+        """
+        Annotate has_thumbnails, whether the file's thumbnails are rendered
+        """
+        return self.annotate(has_thumbnails=models.Exists(
+            EvidenceBlob.objects.filter(name=models.OuterRef('file'), thumbnails_at__isnull=False)
+        ))
+
 
 class ReportEvidence(models.Model):
     report = models.ForeignKey(ScamReport, on_delete=models.CASCADE, related_name='evidence')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
     description = models.TextField()
-    file = models.FileField(upload_to='evidence/')
+    file = models.FileField(upload_to='evidence/', storage=evidence_storage)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_verified = models.BooleanField(default=False)
     verified_by = models.ForeignKey(
@@ -165,9 +336,21 @@ class ReportEvidence(models.Model):
     )
     verification_date = models.DateTimeField(null=True, blank=True)
 
+    objects = ReportEvidenceQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.title} - {self.report.title}"
 
+    @property
+    def thumbnail_sources(self):
+        """
+        thumbnails.sources() of the file, None until they are rendered or
+        without the with_thumbnails() annotation
+        """
+        if getattr(self, 'has_thumbnails', False):
+            return thumbnails.sources(self.file.name)
+        return None
+
     class Meta:
         ordering = ['-uploaded_at']
 
@@ -185,6 +368,10 @@ class Donation(models.Model):
     ]
 
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='donations')
+    report = models.ForeignKey(
+        ScamReport, on_delete=models.SET_NULL, null=True, blank=True, related_name='donations',
+        help_text='Report whose reporter the donation supports, if any'
+    )
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, default='TRY')
     payment_status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
@@ -199,3 +386,88 @@ class Donation(models.Model):
 
     class Meta:
         ordering = ['-donation_date']
+
+class DomainIntel(models.Model):
+    KIND_CHOICES = [
+        ('whois', 'WHOIS'),
+        ('dns', 'DNS Records'),
+        ('ip', 'IP Address'),
+    ]
+
+    domain = models.CharField(max_length=253)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    payload = models.JSONField()
+    is_negative = models.BooleanField(default=False)
+    fetched_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} for {self.domain}"
+
+    class Meta:
+        unique_together = ['domain', 'kind']
+        verbose_name = 'Domain Intelligence'
+        verbose_name_plural = 'Domain Intelligence'
+
+class AnalysisJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed')
+    ]
+
+    report = models.ForeignKey(ScamReport, on_delete=models.CASCADE, related_name='analysis_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Analysis of {self.report_id} ({self.status})"
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+        ]
+
+class UploadSession(models.Model):
+    """
+    A chunked evidence upload in progress; the id is the token the client
+    resumes with and received the offset of the next chunk
+    """
+    TARGET_CHOICES = [
+        ('evidence', 'Report evidence'),
+        ('scam_evidence', 'Reporter evidence')
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    report = models.ForeignKey(ScamReport, on_delete=models.CASCADE, related_name='upload_sessions')
+    target = models.CharField(max_length=20, choices=TARGET_CHOICES, default='evidence')
+    filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=10)
+    title = models.CharField(max_length=200, blank=True)
+    description = models.TextField(blank=True)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # Until when the request writing a chunk holds the session, see myapp.uploads
+    writing_until = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.received}/{self.size})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['completed_at', 'updated_at']),
+        ]
@@ -0,0 +1,138 @@
+"""
+Keyset (cursor) pagination for report listings.
+
+Instead of OFFSET, each page ends with a cursor holding the sort key of its
+last row, and the next page is fetched with a WHERE on that key. With a
+composite index on the sort keys every page costs the same as the first,
+however deep it is. Listings sort on (submission_date, id); ranked search
+results sort on (search_rank, id).
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _encode_value(value):
+    # Full precision: DjangoJSONEncoder drops microseconds, which would
+    # make rows sharing the cursor's millisecond fall between two pages
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError(f'Cannot encode {type(value).__name__} in a cursor')
+
+
+def get_page_size(value=None):
+    default = getattr(settings, 'REPORTS_PAGE_SIZE', 25)
+    try:
+        size = int(value) if value else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset on ordering keys such as ('-submission_date', '-id').
+    The last key must be unique so that every row has a distinct position.
+    """
+
+    def __init__(self, queryset, keys=('-submission_date', '-id'), page_size=None):
+        self.queryset = queryset
+        self.keys = [(key.lstrip('-'), key.startswith('-')) for key in keys]
+        self.page_size = get_page_size(page_size)
+
+    def encode_cursor(self, item):
+        values = [getattr(item, name) for name, _ in self.keys]
+        data = json.dumps(values, default=_encode_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, TypeError) as e:
+            raise InvalidCursor(str(e))
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise InvalidCursor('Cursor does not match the ordering')
+        return [self._to_python(name, value) for (name, _), value in zip(self.keys, values)]
+
+    def _to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as search_rank
+            return value
+        try:
+            return field.to_python(value)
+        except ValidationError as e:
+            raise InvalidCursor(str(e))
+
+    def _after(self, values):
+        """
+        Build (k1 > v1) OR (k1 = v1 AND k2 > v2) ... for the cursor position
+        """
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        # The redundant bound on the first key lets the database seek the
+        # index to the cursor instead of scanning from the start
+        name, descending = self.keys[0]
+        return Q(**{f'{name}__lte' if descending else f'{name}__gte': values[0]}) & condition
+
+    def page(self, cursor=None):
+        queryset = self.queryset.order_by(*[f'-{name}' if desc else name for name, desc in self.keys])
+        if cursor:
+            queryset = queryset.filter(self._after(self.decode_cursor(cursor)))
+        items = list(queryset[:self.page_size + 1])
+        next_cursor = None
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            next_cursor = self.encode_cursor(items[-1])
+        return KeysetPage(items, next_cursor)
+
+
+def paginate(request, queryset, keys=('-submission_date', '-id')):
+    """
+    Return the page for the cursor and page_size in the query string, an
+    invalid cursor falls back to the first page
+    """
+    paginator = KeysetPaginator(queryset, keys, request.GET.get('page_size'))
+    try:
+        return paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return paginator.page()
+
+
+def page_url(request, cursor):
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    if cursor:
+        query['cursor'] = cursor
+    return f'?{query.urlencode()}' if query else request.path
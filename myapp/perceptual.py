@@ -0,0 +1,55 @@
+"""
+Perceptual hashes of evidence images.
+
+dhash() is the 64-bit difference hash: the image is shrunk to 9x8 grey
+pixels and every bit says whether a pixel is brighter than its right
+neighbour, so re-encoded, rescaled or slightly edited copies of a
+screenshot land a few bits apart. Hashes are stored in a signed 64-bit
+column, see to_signed() and to_unsigned().
+"""
+import os
+
+import numpy as np
+from PIL import Image
+
+HASH_WIDTH = 8
+HASH_BITS = HASH_WIDTH * HASH_WIDTH
+
+IMAGE_TYPES = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tiff')
+
+
+def is_image(name):
+    return os.path.splitext(name)[1][1:].lower() in IMAGE_TYPES
+
+
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def dhash(image):
+    # JPEGs decode straight at a fraction of their size
+    image.draft('L', (HASH_WIDTH * 8, HASH_WIDTH * 8))
+    grey = image.convert('L').resize((HASH_WIDTH + 1, HASH_WIDTH), Image.Resampling.BILINEAR)
+    pixels = np.asarray(grey, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def dhash_file(file):
+    """
+    dhash() of an image path or file object, None when it is not a
+    readable image
+    """
+    try:
+        with Image.open(file) as image:
+            return dhash(image)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
@@ -0,0 +1,72 @@
+"""
+Process pools for the CPU-bound evidence work kept off the request path.
+
+The pools are created on first use with the spawn start method, forking a
+threaded server process is not safe, so the functions they run must live in
+modules that import no Django models. BackgroundPool.run_after_commit()
+submits a call once the current transaction commits and hands its result to
+a callback, which may use the database, in the parent process.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def process_pool(max_workers):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+class BackgroundPool:
+    """
+    A lazily started pool of as many processes as the `setting` says; 0
+    runs the calls in the committing thread instead
+    """
+
+    def __init__(self, setting, default):
+        self.setting = setting
+        self.default = default
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def workers(self):
+        return getattr(settings, self.setting, self.default)
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = process_pool(self.workers())
+            return self._pool
+
+    def run_after_commit(self, fn, args, done, description):
+        """
+        Run fn(*args) once the current transaction commits and call
+        done(result); failures are logged under `description`
+        """
+        transaction.on_commit(lambda: self._submit(fn, args, done, description))
+
+    def _submit(self, fn, args, done, description):
+        if not self.workers():
+            try:
+                done(fn(*args))
+            except Exception:
+                logger.exception('%s failed', description)
+            return
+        future = self.pool().submit(fn, *args)
+        submitter = threading.get_ident()
+        future.add_done_callback(lambda future: self._finished(future, done, description, submitter))
+
+    def _finished(self, future, done, description, submitter):
+        try:
+            done(future.result())
+        except Exception:
+            logger.exception('%s failed', description)
+        finally:
+            # Done callbacks run on the pool's management thread
+            if threading.get_ident() != submitter:
+                connection.close()
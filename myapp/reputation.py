@@ -0,0 +1,143 @@
+"""
+Incremental reputation scoring.
+
+A reporter earns 10 points per verified report, 2 per upvote and loses 1
+per downvote on their reports. Votes and status changes apply only the
+difference, with F() expressions on UserProfile.reputation_score and the
+per-report vote counters; compute_scores() rebuilds scores from scratch
+with a single GROUP BY.
+"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ReportVote, ScamReport, UserProfile, new_fragment_version
+
+VERIFIED_POINTS = 10
+VOTE_POINTS = {
+    'upvote': 2,
+    'downvote': -1,
+}
+VOTE_COUNTERS = {
+    'upvote': 'upvotes',
+    'downvote': 'downvotes',
+}
+
+
+def adjust_score(user_id, delta):
+    if not user_id or not delta:
+        return
+    if UserProfile.objects.filter(user_id=user_id).update(reputation_score=F('reputation_score') + delta):
+        return
+    profile, created = UserProfile.objects.get_or_create(user_id=user_id)
+    if created:
+        # A new profile starts from the full score, which already includes this change
+        profile.update_reputation()
+    else:
+        UserProfile.objects.filter(user_id=user_id).update(reputation_score=F('reputation_score') + delta)
+
+
+def record_vote(report_id, reporter_id, old_type, new_type):
+    """
+    Apply a vote being cast (old_type None), changed, or withdrawn (new_type None)
+    """
+    if old_type == new_type:
+        return
+    counters = {}
+    delta = 0
+    if old_type:
+        counters[VOTE_COUNTERS[old_type]] = F(VOTE_COUNTERS[old_type]) - 1
+        delta -= VOTE_POINTS[old_type]
+    if new_type:
+        counters[VOTE_COUNTERS[new_type]] = F(VOTE_COUNTERS[new_type]) + 1
+        delta += VOTE_POINTS[new_type]
+    with transaction.atomic():
+        ScamReport.objects.filter(id=report_id).update(**counters)
+        adjust_score(reporter_id, delta)
+
+
+def record_status_change(reporter_id, old_status, new_status):
+    delta = VERIFIED_POINTS * ((new_status == 'verified') - (old_status == 'verified'))
+    adjust_score(reporter_id, delta)
+
+
+def update_status(queryset, status, **fields):
+    """
+    QuerySet.update() for report status that keeps reputation and the
+    verified_reports counters in step, used by admin bulk actions. Returns
+    the number of reports updated.
+    """
+    from . import counters
+
+    with transaction.atomic():
+        if status == 'verified':
+            changing, sign = queryset.exclude(status='verified'), 1
+        else:
+            changing, sign = queryset.filter(status='verified'), -1
+        per_reporter = list(
+            changing.filter(reporter__isnull=False)
+            .values('reporter').annotate(reports=Count('id')).order_by()
+        )
+        # update() skips auto_now, but the domain index follows last_updated,
+        # and the page fragments show the status
+        fields.setdefault('last_updated', timezone.now())
+        fields.setdefault('fragment_version', new_fragment_version())
+        updated = queryset.update(status=status, **fields)
+        for row in per_reporter:
+            adjust_score(row['reporter'], sign * VERIFIED_POINTS * row['reports'])
+            counters.adjust(row['reporter'], {'verified_reports': sign * row['reports']})
+    return updated
+
+
+def compute_scores(reporter=None):
+    """
+    Return {user_id: score} computed from the votes table in one GROUP BY query
+    """
+    reports = ScamReport.objects.filter(reporter__isnull=False)
+    if reporter is not None:
+        reports = reports.filter(reporter=reporter)
+    rows = reports.values('reporter').annotate(
+        verified=Count('id', filter=Q(status='verified'), distinct=True),
+        upvotes=Count('votes', filter=Q(votes__vote_type='upvote')),
+        downvotes=Count('votes', filter=Q(votes__vote_type='downvote')),
+    ).order_by()
+    return {
+        row['reporter']: (
+            row['verified'] * VERIFIED_POINTS +
+            row['upvotes'] * VOTE_POINTS['upvote'] +
+            row['downvotes'] * VOTE_POINTS['downvote']
+        )
+        for row in rows
+    }
+
+
+def _vote_count(vote_type):
+    votes = (
+        ReportVote.objects.filter(report=OuterRef('pk'), vote_type=vote_type)
+        .order_by().values('report').annotate(total=Count('id')).values('total')
+    )
+    return Coalesce(Subquery(votes, output_field=IntegerField()), Value(0))
+
+
+def recompute_all(batch_size=1000):
+    """
+    Rebuild every report's vote counters and every profile's score,
+    returns the number of profiles whose score changed
+    """
+    ScamReport.objects.update(upvotes=_vote_count('upvote'), downvotes=_vote_count('downvote'))
+    scores = compute_scores()
+
+    changed = []
+    updated = 0
+    for profile in UserProfile.objects.only('id', 'user_id', 'reputation_score').iterator(chunk_size=batch_size):
+        score = scores.get(profile.user_id, 0)
+        if profile.reputation_score != score:
+            profile.reputation_score = score
+            changed.append(profile)
+        if len(changed) >= batch_size:
+            UserProfile.objects.bulk_update(changed, ['reputation_score'])
+            updated += len(changed)
+            changed = []
+    UserProfile.objects.bulk_update(changed, ['reputation_score'])
+    return updated + len(changed)
@@ -0,0 +1,237 @@
+"""
+Ranked full-text search over scam reports.
+
+The backend is picked from the database vendor: an FTS5 virtual table on
+SQLite, a tsvector column with a GIN index on PostgreSQL, and plain
+icontains filters anywhere else. The index holds case- and accent-folded
+text (Turkish İ/ı aware) and is kept in sync by signals; run
+rebuild_search_index after bulk imports that bypass them.
+"""
+import logging
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+_TURKISH_FOLD = str.maketrans({'İ': 'i', 'I': 'i', 'ı': 'i'})
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def fold(text):
+    """
+    Case- and accent-fold text so 'İSTANBUL', 'istanbul' and 'ıstanbul' match
+    """
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKD', text.translate(_TURKISH_FOLD).casefold())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def _document(report_type, title, description, scam_url):
+    from .models import ScamReport
+    type_label = dict(ScamReport.REPORT_TYPES).get(report_type, report_type or '')
+    return fold(title), fold(description), fold(scam_url), fold(type_label)
+
+
+class SearchBackend:
+    """
+    Base class; search() returns the queryset filtered to matches,
+    annotated with search_rank and ordered by (search_rank, id) descending
+    """
+
+    def setup(self):
+        pass
+
+    def index(self, report):
+        pass
+
+    def remove(self, report_id):
+        pass
+
+    def rebuild(self, rows, batch_size=1000):
+        """
+        rows yields (id, report_type, title, description, scam_url) tuples
+        """
+        pass
+
+    def search(self, queryset, query):
+        raise NotImplementedError
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Unindexed icontains filtering, used where no full-text index is available
+    """
+
+    def search(self, queryset, query):
+        from .models import ScamReport
+        # Like the indexed backends, match the type label as well as its key
+        folded = fold(query)
+        types = [value for value, label in ScamReport.REPORT_TYPES if folded and folded in fold(label)]
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(scam_url__icontains=query) |
+            Q(report_type__icontains=query) |
+            Q(report_type__in=types)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField())).order_by('-search_rank', '-id')
+
+
+class SQLiteFTSBackend(SearchBackend):
+    # Mapped by models.ReportSearchEntry so search() can join it
+    table = 'myapp_scamreport_fts'
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f'USING fts5(title, description, scam_url, report_type, tokenize="unicode61")'
+            )
+
+    def index(self, report):
+        self._write([(report.id, report.report_type, report.title, report.description, report.scam_url)])
+
+    def remove(self, report_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [report_id])
+
+    def rebuild(self, rows, batch_size=1000):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._write(batch, replace=False)
+                batch = []
+        self._write(batch, replace=False)
+
+    def _write(self, rows, replace=True):
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            if replace:
+                cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, description, scam_url, report_type) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                [(report_id, *_document(report_type, title, description, scam_url))
+                 for report_id, report_type, title, description, scam_url in rows]
+            )
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        # Every term must match, the last one as a prefix for search-as-you-type
+        match = ' '.join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+        # Join the FTS table so MATCH and bm25() run once per query, not per
+        # row; bm25() is lower for better matches and title hits weigh the most
+        return queryset.filter(
+            RawSQL(f'{self.table} MATCH %s', (match,), output_field=BooleanField()),
+            search_entry__isnull=False
+        ).annotate(
+            search_rank=RawSQL(f'-bm25({self.table}, 10.0, 1.0, 5.0, 2.0)', ())
+        ).order_by('-search_rank', '-id')
+
+
+class PostgresSearchBackend(SearchBackend):
+    VECTOR_SQL = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B') || "
+        "setweight(to_tsvector('simple', %s), 'C') || "
+        "setweight(to_tsvector('simple', %s), 'C')"
+    )
+
+    def setup(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE myapp_scamreport ADD COLUMN IF NOT EXISTS search_vector tsvector')
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS myapp_scamreport_search_vector_gin '
+                'ON myapp_scamreport USING gin (search_vector)'
+            )
+
+    def index(self, report):
+        self._write([(report.id, report.report_type, report.title, report.description, report.scam_url)])
+
+    def rebuild(self, rows, batch_size=1000):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self._write(batch)
+                batch = []
+        self._write(batch)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE myapp_scamreport SET search_vector = {self.VECTOR_SQL} WHERE id = %s',
+                [(*_document(report_type, title, description, scam_url), report_id)
+                 for report_id, report_type, title, description, scam_url in rows]
+            )
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+        tsquery = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f"SELECT id FROM {table} WHERE search_vector @@ to_tsquery('simple', %s)",
+                (tsquery,)
+            )
+        ).annotate(
+            search_rank=RawSQL(f'ts_rank("{table}"."search_vector", to_tsquery(\'simple\', %s))', (tsquery,))
+        ).order_by('-search_rank', '-id')
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'SEARCH_BACKEND', None)
+        if path:
+            _backend = import_string(path)()
+        elif connection.vendor == 'sqlite':
+            _backend = SQLiteFTSBackend()
+        elif connection.vendor == 'postgresql':
+            _backend = PostgresSearchBackend()
+        else:
+            _backend = LikeSearchBackend()
+    return _backend
+
+
+def search_reports(queryset, query):
+    return get_backend().search(queryset, query)
+
+
+def index_report(report):
+    try:
+        with transaction.atomic():
+            get_backend().index(report)
+    except Exception:
+        logger.exception('Could not update the search index for report %s', report.id)
+
+
+def remove_report(report_id):
+    try:
+        with transaction.atomic():
+            get_backend().remove(report_id)
+    except Exception:
+        logger.exception('Could not remove report %s from the search index', report_id)
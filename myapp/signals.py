@@ -0,0 +1,120 @@
+from django.db.models import DEFERRED
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, fragments, metadata, reputation, search
+from .domain_filter import domain_filter
+from .domain_index import domain_index
+from .models import Donation, ReportComment, ReportEvidence, ReportVote, ScamEvidence, ScamReport
+
+
+def _reporter_id(vote):
+    if ReportVote.report.is_cached(vote):
+        return vote.report.reporter_id
+    return ScamReport.objects.filter(id=vote.report_id).values_list('reporter_id', flat=True).first()
+
+
+# update_fields names of ScamReport.TRACKED_FIELDS
+TRACKED_UPDATE_FIELDS = {'reporter': 'reporter_id', 'reporter_id': 'reporter_id', 'status': 'status', 'is_flagged': 'is_flagged'}
+
+
+@receiver(pre_save, sender=ScamReport)
+def load_saved_state(sender, instance, raw=False, **kwargs):
+    if not raw and instance._saved_state is DEFERRED and instance.pk is not None:
+        instance._saved_state = sender.objects.filter(pk=instance.pk).values_list(*sender.TRACKED_FIELDS).first()
+
+
+def _written_state(instance, old_state, update_fields):
+    # A partial save leaves the other tracked columns as they were
+    if update_fields is None or old_state is None:
+        return instance.tracked_state()
+    written = {TRACKED_UPDATE_FIELDS[field] for field in update_fields if field in TRACKED_UPDATE_FIELDS}
+    return tuple(
+        getattr(instance, field) if field in written else value
+        for field, value in zip(instance.TRACKED_FIELDS, old_state)
+    )
+
+
+@receiver(post_save, sender=ScamReport)
+def report_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not TRACKED_UPDATE_FIELDS.keys() & set(update_fields)):
+        return
+    old_state = None if created else instance._saved_state
+    new_state = _written_state(instance, old_state, update_fields)
+    old_status = old_state[1] if old_state else None
+    if old_status != new_state[1]:
+        reputation.record_status_change(new_state[0], old_status, new_state[1])
+    counters.record_change(old_state, new_state)
+    instance._saved_state = new_state
+
+
+@receiver(post_delete, sender=ScamReport)
+def report_deleted(sender, instance, **kwargs):
+    reputation.record_status_change(instance.reporter_id, instance.status, None)
+    counters.record_change(instance.tracked_state(), None)
+
+
+SEARCHABLE_FIELDS = {'title', 'description', 'scam_url', 'report_type'}
+
+
+@receiver(post_save, sender=ScamReport)
+def update_search_index(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not SEARCHABLE_FIELDS & set(update_fields)):
+        return
+    search.index_report(instance)
+
+
+@receiver(post_delete, sender=ScamReport)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_report(instance.id)
+
+
+@receiver(post_delete, sender=ScamReport)
+def remove_from_domain_index(sender, instance, **kwargs):
+    domain_index.discard(instance.id)
+    domain_filter.forget(instance.domain)
+
+
+@receiver(pre_save, sender=ReportVote)
+def load_saved_vote_type(sender, instance, raw=False, **kwargs):
+    if not raw and instance._saved_vote_type is DEFERRED:
+        instance._saved_vote_type = sender.objects.filter(pk=instance.pk).values_list('vote_type', flat=True).first()
+
+
+@receiver(post_save, sender=ReportVote)
+def vote_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_type = None if created else instance._saved_vote_type
+    reputation.record_vote(instance.report_id, _reporter_id(instance), old_type, instance.vote_type)
+    instance._saved_vote_type = instance.vote_type
+
+
+@receiver(post_delete, sender=ReportVote)
+def vote_deleted(sender, instance, **kwargs):
+    reputation.record_vote(instance.report_id, _reporter_id(instance), instance.vote_type, None)
+
+
+# ScamReport.save() stamps its own fragment version
+@receiver([post_save, post_delete], sender=ReportComment)
+@receiver([post_save, post_delete], sender=ReportEvidence)
+@receiver([post_save, post_delete], sender=Donation)
+def invalidate_report_fragments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.invalidate(instance.report_id)
+
+
+@receiver(pre_save, sender=ScamEvidence)
+def reset_replaced_metadata(sender, instance, raw=False, **kwargs):
+    # The metadata describes the file it was extracted from
+    if raw or instance.pk is None or instance.metadata is None:
+        return
+    saved_file = sender.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+    if saved_file is not None and saved_file != instance.file.name:
+        instance.metadata = None
+
+
+@receiver(post_save, sender=ScamEvidence)
+def extract_evidence_metadata(sender, instance, raw=False, **kwargs):
+    if not raw and instance.file and instance.metadata is None:
+        metadata.schedule(instance)
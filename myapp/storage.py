@@ -0,0 +1,345 @@
+"""
+Content-addressable storage for evidence files.
+
+ReportEvidence.file and ScamEvidence.file are saved under the SHA-256 of
+their content, whatever name they were uploaded with, so a screenshot
+posted under many reports is stored once. Files are sharded on the first
+two hash bytes, cas/ab/cd/<sha256>.<ext>, which keeps every directory
+small. An EvidenceBlob row per stored file counts the FileField values
+naming it: saving a file adds a reference, and delete(), which
+django_cleanup calls when a row is deleted or its file replaced, drops
+one and removes the file with the last. New image blobs also get their
+perceptual hash and thumbnails, see myapp.thumbnails. Files saved before this storage keep their names and
+are deleted as before until relocate() moves them into the layout.
+reconcile() recounts the references from the evidence tables.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, Value, When
+
+from . import perceptual, thumbnails
+
+BLOB_PREFIX = 'cas/'
+
+# Names in the current layout, the ones relocate() leaves alone
+SHARDED_NAME = r'^cas/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}'
+
+
+def content_digest(content):
+    hasher = hashlib.sha256()
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def blob_digest(name):
+    return os.path.basename(name).split('.')[0]
+
+
+def blob_name(digest, name):
+    _, dot, ext = name.rpartition('.')
+    ext = ext.lower() if dot and '/' not in ext else ''
+    return f'{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{"." + ext if ext else ""}'
+
+
+def image_hash(content, name):
+    """
+    Signed dHash of image content, for near-duplicate lookups; None for
+    other files
+    """
+    if not perceptual.is_image(name):
+        return None
+    content.seek(0)
+    value = perceptual.dhash_file(content)
+    content.seek(0)
+    return None if value is None else perceptual.to_signed(value)
+
+
+def is_blob(name):
+    return name.startswith(BLOB_PREFIX)
+
+
+class DigestMismatch(Exception):
+    """
+    A content does not hash to the SHA-256 it was saved with
+    """
+
+
+class HashedFile(File):
+    """
+    A file hashed while it was written, `hasher` holds the SHA-256 state of
+    all its bytes so the storage does not read it again; sha256 is the
+    digest it is expected to have, if known
+    """
+
+    def __init__(self, file, name, hasher, sha256=None):
+        super().__init__(file, name)
+        self.hasher = hasher
+        self.sha256 = sha256
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage keeping one reference-counted copy per content. A
+    content with a `sha256` attribute is only stored when it hashes to that
+    value; a HashedFile, as finished chunked uploads are, is checked against
+    its hasher instead of being read.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Only the extension of the requested name is used
+        return name
+
+    def _save(self, name, content):
+        from .models import EvidenceBlob
+
+        digest = content.hasher.hexdigest() if isinstance(content, HashedFile) else content_digest(content)
+        expected = getattr(content, 'sha256', None)
+        if expected and expected.lower() != digest:
+            raise DigestMismatch(f'{name} hashes to {digest}, not {expected}')
+        size = content.size
+        with transaction.atomic():
+            blob = EvidenceBlob.objects.select_for_update().filter(sha256=digest).first()
+            if blob is not None:
+                EvidenceBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                return blob.name
+            blob = EvidenceBlob(
+                sha256=digest, name=blob_name(digest, name), size=size, ref_count=1, dhash=image_hash(content, name)
+            )
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # Stored by a concurrent upload meanwhile
+                EvidenceBlob.objects.filter(sha256=digest).update(ref_count=F('ref_count') + 1)
+                return EvidenceBlob.objects.get(sha256=digest).name
+            # Written once the row is claimed, a delete of the last
+            # reference may still have removed an older copy
+            if not self.exists(blob.name):
+                stored = super()._save(blob.name, content)
+                if stored != blob.name:
+                    # A concurrent writer created it first, same content
+                    super().delete(stored)
+            if blob.dhash is not None:
+                # Decoded as an image already
+                thumbnails.schedule(blob.name)
+        return blob.name
+
+    def delete(self, name):
+        if not is_blob(name):
+            return super().delete(name)
+        from .models import EvidenceBlob
+
+        with transaction.atomic():
+            blob = EvidenceBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                # Not counted, leave it to reconcile()
+                return
+            if blob.ref_count > 1:
+                EvidenceBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+            self.delete_blob_file(name)
+
+    def delete_blob_file(self, name):
+        super().delete(name)
+        self.delete_thumbnails(name)
+
+    def delete_thumbnails(self, name):
+        for thumbnail in thumbnails.thumbnail_names(name):
+            super().delete(thumbnail)
+
+
+_evidence_storage = ContentAddressedStorage()
+
+
+def evidence_storage():
+    return _evidence_storage
+
+
+def file_fields():
+    """
+    (model, field name) of every FileField stored in evidence_storage
+    """
+    from .models import ReportEvidence, ScamEvidence
+
+    return [(ReportEvidence, 'file'), (ScamEvidence, 'file')]
+
+
+def count_references():
+    counts = {}
+    for model, field in file_fields():
+        rows = (
+            model.objects.filter(**{f'{field}__startswith': BLOB_PREFIX})
+            .values(field).annotate(references=Count('pk')).order_by()
+        )
+        for row in rows:
+            counts[row[field]] = counts.get(row[field], 0) + row['references']
+    return counts
+
+
+def reconcile(dry_run=False):
+    """
+    Set every blob's ref_count to the rows naming it and delete blobs no
+    row names. Returns [(name, stored, actual)] of the blobs that drifted;
+    names referenced without a blob row are reported with stored None and
+    get one when their file exists.
+    """
+    from .models import EvidenceBlob
+
+    counts = count_references()
+    drift = []
+    with transaction.atomic():
+        for blob in EvidenceBlob.objects.select_for_update().order_by('id'):
+            actual = counts.pop(blob.name, 0)
+            if blob.ref_count == actual:
+                continue
+            drift.append((blob.name, blob.ref_count, actual))
+            if dry_run:
+                continue
+            if actual:
+                EvidenceBlob.objects.filter(pk=blob.pk).update(ref_count=actual)
+            else:
+                blob.delete()
+                _evidence_storage.delete_blob_file(blob.name)
+        for name, actual in counts.items():
+            drift.append((name, None, actual))
+            sha256 = blob_digest(name)
+            if dry_run or not _evidence_storage.exists(name) or EvidenceBlob.objects.filter(sha256=sha256).exists():
+                continue
+            EvidenceBlob.objects.create(
+                sha256=sha256, name=name, size=_evidence_storage.size(name), ref_count=actual,
+            )
+    return drift
+
+
+def _link(source, path):
+    """
+    Make `path` another name of the file at `source`, copying when a hard
+    link is not possible; an existing `path` has the same content already
+    """
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(source, path)
+    except FileExistsError:
+        pass
+    except OSError:
+        # Another filesystem, or no hard links
+        partial = f'{path}.{os.getpid()}.{threading.get_ident()}.part'
+        shutil.copyfile(source, partial)
+        os.replace(partial, path)
+
+
+def relocate_file(name):
+    """
+    Hash the file named `name` and link it at its blob name; the original
+    stays until the rows are rewritten. Returns (name, blob name, digest, size).
+    """
+    source = _evidence_storage.path(name)
+    hasher = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    digest = hasher.hexdigest()
+    target = blob_name(digest, name)
+    _link(source, _evidence_storage.path(target))
+    return name, target, digest, os.path.getsize(source)
+
+
+def names_to_relocate(model, field, after='', limit=None):
+    names = (
+        model.objects.exclude(**{f'{field}__regex': SHARDED_NAME}).exclude(**{field: ''})
+        .filter(**{f'{field}__gt': after}).values_list(field, flat=True).distinct().order_by(field)
+    )
+    return list(names[:limit] if limit else names)
+
+
+def relocate(batch_size=500, workers=None, progress=None):
+    """
+    Move every evidence file that is not in the sharded layout to its blob
+    name: batch_size distinct names at a time are hashed and linked on
+    `workers` threads, then the FileField values and blob counts of the
+    batch are rewritten in one transaction and the old files removed.
+    Identical files end up as one blob. Returns (relocated names, failed
+    [(name, error)]); progress(moved, failed) is called after each batch.
+    """
+    relocated = 0
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        for model, field in file_fields():
+            after = ''
+            while True:
+                names = names_to_relocate(model, field, after, batch_size)
+                if not names:
+                    break
+                after = names[-1]
+                futures = {pool.submit(relocate_file, name): name for name in names}
+                moved = []
+                for future, name in futures.items():
+                    try:
+                        moved.append(future.result())
+                    except OSError as e:
+                        failed.append((name, str(e)))
+                if moved:
+                    _rewrite(moved)
+                    relocated += len(moved)
+                if progress:
+                    progress(moved, failed)
+    return relocated, failed
+
+
+def _rewrite(moved):
+    from .models import EvidenceBlob
+
+    sources = [name for name, _, _, _ in moved]
+    targets = {}
+    extra_links = set()
+    with transaction.atomic():
+        blobs = {
+            blob.sha256: blob
+            for blob in EvidenceBlob.objects.select_for_update().filter(sha256__in={m[2] for m in moved})
+        }
+        references = Counter()
+        for model, field in file_fields():
+            rows = (
+                model.objects.filter(**{f'{field}__in': sources})
+                .values(field).annotate(references=Count('pk')).order_by()
+            )
+            for row in rows:
+                references[row[field]] += row['references']
+
+        for name, target, digest, size in moved:
+            blob = blobs.get(digest)
+            if blob is None:
+                blob = blobs[digest] = EvidenceBlob(sha256=digest, name=target, size=size, ref_count=0)
+            if blob.name == name:
+                # Saved in an older layout, its rows are counted already
+                blob.name = target
+            else:
+                blob.ref_count += references[name]
+            final = blob_name(digest, blob.name)
+            if final != target:
+                # The same content stored with another extension
+                _link(_evidence_storage.path(target), _evidence_storage.path(final))
+                extra_links.add(target)
+            targets[name] = final
+
+        for blob in blobs.values():
+            blob.save()
+        for model, field in file_fields():
+            model.objects.filter(**{f'{field}__in': sources}).update(**{field: Case(
+                *[When(**{field: name}, then=Value(target)) for name, target in targets.items()],
+                default=F(field), output_field=model._meta.get_field(field),
+            )})
+    for name in [*sources, *extra_links]:
+        _evidence_storage.delete_blob_file(name)
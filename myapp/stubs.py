@@ -0,0 +1,429 @@
+"""
+Local stand-ins for the network services the app talks to, used by the
+benchmark and load-testing commands so they run without network access.
+"""
+import hashlib
+import json
+import socket
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import quote, unquote
+
+import dns.message
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+from django.test.utils import override_settings
+
+# Environment variable passing NetworkStandIns.config() to server processes
+STAND_INS_ENV = 'LOAD_TEST_STAND_INS'
+
+
+class StubDNSServer:
+    """
+    UDP DNS server that answers every name with a fixed synthetic zone
+    after an injected delay. Names under .invalid get NXDOMAIN.
+    Each query is answered from its own thread so the delay does not
+    serialize concurrent queries.
+    """
+
+    RECORDS = {
+        dns.rdatatype.A: '192.0.2.10',
+        dns.rdatatype.MX: '10 mail.{name}',
+        dns.rdatatype.NS: 'ns1.{name}',
+        dns.rdatatype.TXT: '"v=spf1 -all"',
+        dns.rdatatype.SOA: 'ns1.{name} hostmaster.{name} 2024010101 7200 3600 1209600 300',
+    }
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.queries = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._thread = None
+        self._running = False
+        self._lock = threading.Lock()
+
+    @property
+    def address(self):
+        return self._sock.getsockname()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='stub-dns', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self._sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(4096)
+            except OSError:
+                break
+            threading.Thread(target=self._answer, args=(data, addr), daemon=True).start()
+
+    def _answer(self, data, addr):
+        with self._lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            query = dns.message.from_wire(data)
+        except Exception:
+            return
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text()
+        if name.rstrip('.').endswith('.invalid'):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        elif question.rdtype in self.RECORDS:
+            text = self.RECORDS[question.rdtype].format(name=name)
+            response.answer.append(
+                dns.rrset.from_text(question.name, 300, dns.rdataclass.IN, question.rdtype, text)
+            )
+        try:
+            self._sock.sendto(response.to_wire(), addr)
+        except OSError:
+            pass
+
+
+def _digest(name):
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=4).digest(), 'big')
+
+
+class WhoisRecord(dict):
+    """
+    Mimics python-whois results, a dict whose keys are also attributes
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class StubWhois:
+    """
+    Stand-in for whois.whois: a deterministic record per domain after an
+    injected delay, about one domain in five registered in the last 90
+    days. Names under .invalid are not found.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, domain):
+        with self._lock:
+            self.queries += 1
+        if self.latency:
+            time.sleep(self.latency)
+        record = whois_record(domain)
+        if record is None:
+            raise Exception(f'No match for "{domain}".')
+        return record
+
+
+def whois_record(domain):
+    """
+    The deterministic record the WHOIS stubs serve for a domain, None for
+    names under .invalid
+    """
+    if domain.rstrip('.').endswith('.invalid'):
+        return None
+    digest = _digest(domain)
+    age = digest % 90 if digest % 5 == 0 else 90 + digest % 5000
+    created = datetime.now().replace(microsecond=0) - timedelta(days=age)
+    return WhoisRecord(
+        domain_name=domain,
+        registrar='Stub Registrar, Inc.',
+        creation_date=created,
+        expiration_date=created + timedelta(days=365 * (1 + digest % 3)),
+        name_servers=[f'ns1.{domain}', f'ns2.{domain}'],
+        country=['TR', 'US', 'NL', 'RU', 'CN'][digest % 5],
+    )
+
+
+class StubResponse:
+
+    def __init__(self, status_code=200, text='', json_data=None):
+        self.status_code = status_code
+        self.text = text
+        self._json = json_data
+
+    def json(self):
+        if self._json is None:
+            raise ValueError('No JSON body')
+        return self._json
+
+
+class StubHTTP:
+    """
+    Stand-in for requests.get: a clean 200 response after an injected delay,
+    "malicious" for URLs containing a name under .invalid
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, url, *args, **kwargs):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        verdict = 'malicious' if '.invalid' in url else 'clean'
+        return StubResponse(text=f'<html>{verdict}</html>', json_data={'is_scam': verdict == 'malicious'})
+
+
+@contextmanager
+def stub_network(dns_latency=0.0, whois_latency=0.0, http_latency=0.0):
+    """
+    Route the DNS, WHOIS and HTTP calls of myapp.utils to local stubs with
+    the given delays in seconds; yields (dns server, whois stub, http stub)
+    """
+    from . import utils
+
+    with StubDNSServer(latency=dns_latency) as server:
+        host, port = server.address
+        whois_stub = StubWhois(whois_latency)
+        http_stub = StubHTTP(http_latency)
+
+        def gethostbyname(name):
+            # The system resolver would bypass the stub server
+            return str(utils._make_resolver().resolve(name, 'A')[0])
+
+        with override_settings(DNS_NAMESERVERS=[host], DNS_PORT=port), \
+                mock.patch.object(utils.whois, 'whois', whois_stub), \
+                mock.patch.object(utils.requests, 'get', http_stub), \
+                mock.patch.object(utils.socket, 'gethostbyname', gethostbyname):
+            yield server, whois_stub, http_stub
+
+
+class _ThreadedServer:
+    """
+    Start/stop and context manager plumbing for the socketserver based stubs
+    """
+
+    server = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class StubWhoisServer(_ThreadedServer):
+    """
+    WHOIS server (the port 43 protocol: one query line, a text record back)
+    serving whois_record() in the common gTLD format after an injected delay
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.queries = 0
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                domain = self.rfile.readline(256).decode('ascii', 'replace').strip().lower()
+                with stub._lock:
+                    stub.queries += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                self.wfile.write(stub.render(domain).encode())
+
+        self._lock = threading.Lock()
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @staticmethod
+    def render(domain):
+        record = whois_record(domain)
+        if record is None:
+            return f'No match for "{domain.upper()}".\r\n'
+        lines = [
+            f'Domain Name: {domain.upper()}',
+            f'Registrar: {record.registrar}',
+            f'Creation Date: {record.creation_date:%Y-%m-%dT%H:%M:%SZ}',
+            f'Registry Expiry Date: {record.expiration_date:%Y-%m-%dT%H:%M:%SZ}',
+            *(f'Name Server: {ns.upper()}' for ns in record.name_servers),
+            f'Registrant Country: {record.country}',
+        ]
+        return '\r\n'.join(lines) + '\r\n'
+
+
+class StubHTTPServer(_ThreadedServer):
+    """
+    HTTP server standing in for ip-api.com under /json/<ip> and for the
+    blacklist services everywhere else, after an injected delay. The
+    blacklist pages say "malicious" for URLs with a name under .invalid.
+    """
+
+    CITIES = [('Istanbul', 'Turkey'), ('Ankara', 'Turkey'), ('Amsterdam', 'Netherlands'), ('Frankfurt', 'Germany')]
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                if self.path.startswith('/json/'):
+                    body = json.dumps(stub.geolocate(unquote(self.path[len('/json/'):]))).encode()
+                    content_type = 'application/json'
+                else:
+                    verdict = 'malicious' if '.invalid' in unquote(self.path) else 'clean'
+                    body = f'<html><body>{verdict}</body></html>'.encode()
+                    content_type = 'text/html'
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self.address
+        return f'http://{host}:{port}'
+
+    @classmethod
+    def geolocate(cls, ip):
+        city, country = cls.CITIES[_digest(ip) % len(cls.CITIES)]
+        return {'status': 'success', 'query': ip, 'city': city, 'country': country, 'isp': 'Stub Telecom'}
+
+
+class NetworkStandIns:
+    """
+    The DNS, WHOIS and HTTP stand-in servers together. config() describes
+    where they listen, for connect_stand_ins() in another process.
+    """
+
+    def __init__(self, dns_latency=0.0, whois_latency=0.0, http_latency=0.0):
+        self.dns = StubDNSServer(latency=dns_latency)
+        self.whois = StubWhoisServer(latency=whois_latency)
+        self.http = StubHTTPServer(latency=http_latency)
+
+    def start(self):
+        self.dns.start()
+        self.whois.start()
+        self.http.start()
+        return self
+
+    def stop(self):
+        for server in (self.dns, self.whois, self.http):
+            server.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def config(self):
+        return {
+            'dns': list(self.dns.address),
+            'whois': list(self.whois.address),
+            'http': self.http.url,
+        }
+
+
+class RemoteWhois:
+    """
+    whois.whois replacement that queries one WHOIS server and parses the
+    answer with python-whois' generic parser
+    """
+
+    def __init__(self, host, port, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+    def __call__(self, domain):
+        from whois.parser import PywhoisError, WhoisEntry
+
+        with socket.create_connection((self.host, self.port), timeout=self.timeout) as sock:
+            sock.sendall(f'{domain}\r\n'.encode())
+            chunks = []
+            while chunk := sock.recv(4096):
+                chunks.append(chunk)
+        text = b''.join(chunks).decode('utf-8', 'replace')
+        if text.startswith('No match for'):
+            raise PywhoisError(text)
+        return WhoisEntry(domain, text)
+
+
+def connect_stand_ins(config):
+    """
+    Route this process's DNS, WHOIS, blacklist and ip-api traffic to the
+    stand-in servers described by NetworkStandIns.config(). Meant for
+    processes started by the load-testing command only.
+    """
+    from django.conf import settings
+
+    from . import geolocation, utils
+
+    dns_host, dns_port = config['dns']
+    settings.DNS_NAMESERVERS = [dns_host]
+    settings.DNS_PORT = dns_port
+    utils.whois.whois = RemoteWhois(*config['whois'])
+    real_get = utils.requests.get
+    base_url = config['http']
+
+    def get(url, *args, **kwargs):
+        if not url.startswith(base_url):
+            # Keep the original URL in the path, the blacklist stand-in looks at it
+            url = f'{base_url}/fetch/{quote(url, safe="")}'
+        return real_get(url, *args, **kwargs)
+
+    def gethostbyname(name):
+        # The system resolver would bypass the stand-in DNS server
+        return str(utils._make_resolver().resolve(name, 'A')[0])
+
+    utils.requests.get = get
+    utils.socket.gethostbyname = gethostbyname
+    geolocation.geolocator._resolver = geolocation.IPAPIResolver(base_url=f'{base_url}/json/')
@@ -1,3 +1,1513 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from PIL import ExifTags, Image
+from reportlab.pdfgen import canvas
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .domain_filter import DomainFilter, domain_filter
+from .domain_index import DomainIndex, domain_index
+from .geolocation import CSVRangeResolver, Geolocator, GeoResolver, IPAPIResolver, UNKNOWN_LOCATION
+from .image_index import ImageIndex, similar_to_report
+from . import (
+    benchmarks, counters, domain_cache, image_index, jobs, metadata, metrics, perceptual, reputation, search, storage,
+    thumbnails, uploads, urlcanon, utils,
+)
+from .caching import LRUCache
+from .models import (
+    AnalysisJob, DomainIntel, Donation, EvidenceBlob, ReportComment, ReportEvidence, ReportVote, ScamEvidence, ScamReport, UploadSession,
+    UserProfile, make_excerpt,
+)
+from .stubs import RemoteWhois, StubHTTPServer, StubWhoisServer, stub_network, whois_record
+from .view_counter import ViewCounter, view_counter
+
+
+def make_report(reporter, **kwargs):
+    fields = {
+        'title': 'Fake store',
+        'description': 'Took my money and never shipped.',
+        'scam_url': 'https://fake-store.example/',
+        'report_type': 'shopping',
+    }
+    fields.update(kwargs)
+    return ScamReport.objects.create(reporter=reporter, **fields)
+
+
+def tearDownModule():
+    # Views buffered by the requests of the tests belong to the test database
+    view_counter.reset()
+
+
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+
+    def test_flush_updates_both_counters_without_touching_last_updated(self):
+        last_updated = self.report.last_updated
+        counter = ViewCounter(flush_interval=3600, flush_threshold=1000)
+        for _ in range(5):
+            counter.record(self.report.id)
+
+        self.assertEqual(counter.pending(self.report.id), 5)
+        self.assertEqual(counter.flush(), 1)
+
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.views, 5)
+        self.assertEqual(self.report.view_count, 5)
+        self.assertEqual(self.report.last_updated, last_updated)
+        self.assertEqual(counter.pending(self.report.id), 0)
+
+    def test_threshold_triggers_flush(self):
+        counter = ViewCounter(flush_interval=3600, flush_threshold=3)
+        for _ in range(3):
+            counter.record(self.report.id)
+
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.views, 3)
+
+    def test_views_are_not_flushed_into_another_database(self):
+        counter = ViewCounter(flush_interval=3600, flush_threshold=1000)
+        counter.record(self.report.id)
+        with mock.patch.dict(connection.settings_dict, {'NAME': 'db.sqlite3'}), \
+                self.assertLogs('myapp.view_counter', 'WARNING'):
+            self.assertEqual(counter.flush(), 0)
+        self.assertEqual(counter.pending(self.report.id), 0)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.views, 0)
+
+    def test_view_report_does_not_save_report(self):
+        last_updated = self.report.last_updated
+        with self.settings(VIEW_COUNT_FLUSH_INTERVAL=3600):
+            response = self.client.get(f'/view-report/{self.report.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.last_updated, last_updated)
+
+
+class ViewCounterStressTests(TransactionTestCase):
+    def test_no_lost_counts_across_workers_and_threads(self):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        reports = [make_report(user, title=f'Report {i}') for i in range(5)]
+        # Each counter stands in for one worker process flushing its own buffer.
+        workers = [ViewCounter(flush_interval=3600, flush_threshold=25) for _ in range(4)]
+        threads_per_worker = 4
+        views_per_thread = 200
+
+        def browse(counter, offset):
+            for i in range(views_per_thread):
+                counter.record(reports[(offset + i) % len(reports)].id)
+
+        threads = [
+            threading.Thread(target=browse, args=(counter, n))
+            for counter in workers
+            for n in range(threads_per_worker)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for counter in workers:
+            counter.flush()
+
+        expected = len(workers) * threads_per_worker * views_per_thread
+        totals = ScamReport.objects.values_list('views', 'view_count')
+        self.assertEqual(sum(views for views, _ in totals), expected)
+        self.assertEqual(sum(view_count for _, view_count in totals), expected)
+
+
+    def test_started_counter_flushes_on_a_timer(self):
+        user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        report = make_report(user)
+        counter = ViewCounter(flush_interval=0.2, flush_threshold=1000)
+        counter.start()
+        try:
+            for _ in range(3):
+                counter.record(report.id)
+            self.assertEqual(counter.pending(report.id), 3)
+            deadline = time.monotonic() + 5
+            while counter.pending(report.id) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            counter.stop()
+        report.refresh_from_db()
+        self.assertEqual(report.views, 3)
+
+
+class GeolocationTests(SimpleTestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w') as f:
+            f.write('start_ip,end_ip,city,country,isp\n')
+            f.write('81.212.0.0,81.215.255.255,Istanbul,Turkey,Turk Telekom\n')
+            f.write('8.8.8.0,8.8.8.255,Mountain View,United States,Google\n')
+            f.write('2a02:e0::,2a02:e0:ffff:ffff:ffff:ffff:ffff:ffff,Ankara,Turkey,\n')
+        self.addCleanup(os.remove, self.path)
+
+    def test_csv_range_lookup(self):
+        resolver = CSVRangeResolver(self.path)
+        self.assertEqual(resolver.lookup('81.213.1.1'), 'Istanbul, Turkey (Turk Telekom)')
+        self.assertEqual(resolver.lookup('8.8.8.8'), 'Mountain View, United States (Google)')
+        self.assertEqual(resolver.lookup('2a02:e0::1'), 'Ankara, Turkey')
+        self.assertIsNone(resolver.lookup('81.216.0.1'))
+        self.assertIsNone(resolver.lookup('1.1.1.1'))
+
+    def test_cache_miss_resolves_in_background(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowResolver(GeoResolver):
+            def lookup(self, ip):
+                started.set()
+                release.wait(5)
+                return 'Izmir, Turkey'
+
+        geolocator = Geolocator(resolver=SlowResolver())
+        self.assertIsNone(geolocator.locate('81.213.1.1'))
+        self.assertTrue(started.wait(5))
+        release.set()
+        geolocator._executor.shutdown(wait=True)
+        self.assertEqual(geolocator.locate('81.213.1.1'), 'Izmir, Turkey')
+        self.assertEqual(geolocator.resolve('127.0.0.1'), UNKNOWN_LOCATION)
+
+
+class UserTrackingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('tracked', 'tracked@example.com', 'password')
+        self.client.force_login(self.user)
+
+    def profile_queries(self, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/', **extra)
+        # The session user is loaded joined with its profile, see ProfileModelBackend
+        return [
+            q['sql'] for q in queries
+            if 'myapp_userprofile' in q['sql'] and 'FROM "auth_user"' not in q['sql']
+        ]
+
+    def test_steady_state_requests_do_not_touch_profile(self):
+        self.assertTrue(self.profile_queries(REMOTE_ADDR='10.0.0.1'))
+        self.assertEqual(UserProfile.objects.get(user=self.user).last_ip, '10.0.0.1')
+
+        self.assertEqual(self.profile_queries(REMOTE_ADDR='10.0.0.1'), [])
+        self.assertEqual(self.profile_queries(REMOTE_ADDR='10.0.0.1'), [])
+
+    def test_ip_change_or_interval_writes_again(self):
+        self.profile_queries(REMOTE_ADDR='10.0.0.1')
+        self.assertTrue(self.profile_queries(REMOTE_ADDR='10.0.0.2'))
+        self.assertEqual(UserProfile.objects.get(user=self.user).last_ip, '10.0.0.2')
+
+        with self.settings(USER_TRACKING_WRITE_INTERVAL=0):
+            self.assertTrue(self.profile_queries(REMOTE_ADDR='10.0.0.2'))
+
+
+class SignupTests(TestCase):
+    def test_signup_logs_the_new_user_in(self):
+        response = self.client.post(reverse('signup'), {
+            'username': 'newcomer', 'email': 'newcomer@example.com',
+            'password1': 'a-long-passphrase', 'password2': 'a-long-passphrase',
+        })
+        self.assertRedirects(response, reverse('home'))
+        user = User.objects.get(username='newcomer')
+        self.assertEqual(int(self.client.session['_auth_user_id']), user.id)
+        self.assertEqual(self.client.session['_auth_user_backend'], 'myapp.backends.ProfileModelBackend')
+
+
+class ReputationTests(TestCase):
+    def setUp(self):
+        self.reporter = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.voter = User.objects.create_user('voter', 'voter@example.com', 'password')
+        self.report = make_report(self.reporter)
+
+    def score(self):
+        return UserProfile.objects.get(user=self.reporter).reputation_score
+
+    def test_vote_change_and_unvote_apply_deltas(self):
+        self.client.force_login(self.voter)
+        url = f'/vote-report/{self.report.id}/'
+
+        response = self.client.post(url, {'vote_type': 'upvote'}, content_type='application/json')
+        self.assertEqual(response.json()['upvotes'], 1)
+        self.assertEqual(self.score(), 2)
+
+        response = self.client.post(url, {'vote_type': 'downvote'}, content_type='application/json')
+        self.assertEqual((response.json()['upvotes'], response.json()['downvotes']), (0, 1))
+        self.assertEqual(self.score(), -1)
+
+        response = self.client.post(url, {'vote_type': 'downvote'}, content_type='application/json')
+        self.assertEqual(response.json()['user_vote'], None)
+        self.assertEqual(self.score(), 0)
+        self.assertFalse(ReportVote.objects.exists())
+
+    def test_vote_query_count_does_not_grow_with_reports(self):
+        for i in range(20):
+            make_report(self.reporter, title=f'Report {i}')
+        ReportVote.objects.create(report=self.report, user=self.voter, vote_type='upvote')
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        with self.assertNumQueries(5):
+            ReportVote.objects.create(report=self.report, user=other, vote_type='upvote')
+        self.assertEqual(self.score(), 4)
+
+    def test_status_changes_and_bulk_approve(self):
+        self.report.status = 'verified'
+        self.report.save()
+        self.assertEqual(self.score(), 10)
+
+        second = make_report(self.reporter, title='Second')
+        reputation.update_status(ScamReport.objects.all(), 'verified')
+        self.assertEqual(self.score(), 20)
+
+        reputation.update_status(ScamReport.objects.filter(id=second.id), 'rejected')
+        self.assertEqual(self.score(), 10)
+
+    def test_recompute_matches_incremental_scores(self):
+        ReportVote.objects.create(report=self.report, user=self.voter, vote_type='upvote')
+        reputation.update_status(ScamReport.objects.all(), 'verified')
+        incremental = self.score()
+
+        UserProfile.objects.update(reputation_score=0)
+        ScamReport.objects.update(upvotes=0)
+        reputation.recompute_all()
+        self.assertEqual(self.score(), incremental)
+        self.assertEqual(ScamReport.objects.get().upvotes, 1)
+
+
+class UserCounterTests(TestCase):
+    def setUp(self):
+        self.reporter = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.other = User.objects.create_user('other', 'other@example.com', 'password')
+
+    def counts(self, user=None):
+        profile = UserProfile.objects.get(user=user or self.reporter)
+        return profile.total_reports, profile.verified_reports, profile.flagged_reports
+
+    def test_saves_and_deletes_adjust_counters(self):
+        report = make_report(self.reporter)
+        make_report(self.reporter, title='Second')
+        self.assertEqual(self.counts(), (2, 0, 0))
+
+        report.status = 'verified'
+        report.save(update_fields=['status'])
+        report.is_flagged = True
+        report.save()
+        self.assertEqual(self.counts(), (2, 1, 1))
+        # Unchanged saves and deferred loads do not count twice
+        report.save()
+        ScamReport.objects.only('id', 'title').get(id=report.id).save()
+        self.assertEqual(self.counts(), (2, 1, 1))
+
+        report.reporter = self.other
+        report.save()
+        self.assertEqual(self.counts(), (1, 0, 0))
+        self.assertEqual(self.counts(self.other), (1, 1, 1))
+
+        report.delete()
+        self.assertEqual(self.counts(self.other), (0, 0, 0))
+
+    def test_admin_bulk_actions_adjust_counters(self):
+        first = make_report(self.reporter)
+        for i in range(2):
+            make_report(self.reporter, title=f'Report {i}')
+        make_report(self.other)
+        reputation.update_status(ScamReport.objects.all(), 'verified')
+        counters.update_flag(ScamReport.objects.filter(reporter=self.reporter), True)
+        counters.update_flag(ScamReport.objects.all(), True)
+        self.assertEqual(self.counts(), (3, 3, 3))
+        self.assertEqual(self.counts(self.other), (1, 1, 1))
+
+        counters.update_flag(ScamReport.objects.filter(reporter=self.other), False)
+        reputation.update_status(ScamReport.objects.filter(id=first.id), 'rejected')
+        self.assertEqual(self.counts(), (3, 2, 3))
+        self.assertEqual(self.counts(self.other), (1, 1, 0))
+
+    def test_reconcile_fixes_drift(self):
+        make_report(self.reporter, status='verified')
+        make_report(self.other)
+        UserProfile.objects.filter(user=self.reporter).update(total_reports=7, flagged_reports=2)
+        UserProfile.objects.filter(user=self.other).delete()
+
+        out = StringIO()
+        call_command('reconcile_user_counters', dry_run=True, stdout=out)
+        self.assertIn('Found 2 drifted profiles', out.getvalue())
+        self.assertEqual(self.counts(), (7, 1, 2))
+
+        call_command('reconcile_user_counters', stdout=StringIO())
+        self.assertEqual(self.counts(), (1, 1, 0))
+        self.assertEqual(self.counts(self.other), (1, 0, 0))
+        self.assertEqual(counters.reconcile(), [])
+
+    def test_sidebar_and_profile_page_read_loaded_profile(self):
+        for i in range(3):
+            make_report(self.reporter, title=f'Report {i}', status='verified' if i else 'pending')
+        self.client.force_login(self.reporter)
+        self.client.get(reverse('profile'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('profile'))
+        self.assertContains(response, '3 (2 verified)')
+        self.assertContains(response, '<strong>Verified Reports:</strong> 2', html=False)
+        # The session and the user joined with its profile
+        self.assertEqual(len(queries), 2)
+
+
+class ChunkedUploadTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        settings = self.settings(MEDIA_ROOT=tmpdir.name, EVIDENCE_UPLOAD_CHUNK_SIZE=1000)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+        self.client.force_login(self.user)
+        self.data = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 10
+
+    def start(self, **fields):
+        data = {'filename': 'shot.png', 'size': len(self.data), 'title': 'Checkout page', **fields}
+        return self.client.post(
+            reverse('start_upload', args=[self.report.id]), data, content_type='application/json'
+        )
+
+    def send(self, upload_id, offset, chunk):
+        return self.client.post(
+            reverse('upload_chunk', args=[upload_id]), chunk,
+            content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset)
+        )
+
+    def test_resumed_upload_is_hashed_and_moved_into_place(self):
+        upload_id = self.start().json()['upload_id']
+        self.assertEqual(self.send(upload_id, 0, self.data[:1000]).json()['offset'], 1000)
+        # A retried chunk is refused with the offset to carry on from
+        response = self.send(upload_id, 0, self.data[:1000])
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 1000))
+
+        # Another worker takes over and catches up from the part file
+        uploads.hashers.discard(UploadSession.objects.get().id)
+        self.assertEqual(self.client.get(reverse('upload_status', args=[upload_id])).json()['offset'], 1000)
+        self.assertEqual(self.send(upload_id, 1000, self.data[1000:2000]).status_code, 200)
+        self.assertEqual(self.send(upload_id, 2000, self.data[2000:]).json()['offset'], len(self.data))
+
+        digest = hashlib.sha256(self.data).hexdigest()
+        # The finished file is not read again to hash it
+        with mock.patch.object(storage, 'content_digest', side_effect=AssertionError('read back')):
+            response = self.client.post(
+                reverse('finish_upload', args=[upload_id]), {'sha256': digest}, content_type='application/json'
+            )
+        self.assertEqual(response.json()['sha256'], digest)
+        evidence = ReportEvidence.objects.get(report=self.report)
+        self.assertEqual((evidence.title, evidence.user), ('Checkout page', self.user))
+        with evidence.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(os.listdir(uploads.upload_dir()), [])
+
+    def test_only_the_claiming_request_writes(self):
+        upload_id = self.start().json()['upload_id']
+        self.send(upload_id, 0, self.data[:1000])
+        # A request is still writing the next chunk
+        UploadSession.objects.update(writing_until=timezone.now() + timedelta(minutes=1))
+        response = self.send(upload_id, 1000, b'x' * 1000)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 1000))
+        with open(uploads.part_path(UploadSession.objects.get()), 'rb') as f:
+            self.assertEqual(f.read(), self.data[:1000])
+
+        # The claim of a writer that died expires
+        UploadSession.objects.update(writing_until=timezone.now() - timedelta(seconds=1))
+        self.send(upload_id, 1000, self.data[1000:2000])
+        self.send(upload_id, 2000, self.data[2000:])
+        self.assertIsNone(UploadSession.objects.get().writing_until)
+
+        finish = reverse('finish_upload', args=[upload_id])
+        response = self.client.post(finish, {'sha256': '0' * 64}, content_type='application/json')
+        self.assertEqual(response.status_code, 422)
+        self.assertFalse(ReportEvidence.objects.exists())
+        self.assertFalse(EvidenceBlob.objects.exists())
+        response = self.client.post(finish, {}, content_type='application/json')
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(self.data).hexdigest())
+
+    def test_size_and_type_limits(self):
+        self.assertEqual(self.start(filename='payload.exe').status_code, 400)
+        self.assertEqual(self.start(size=10**10).status_code, 413)
+
+        upload_id = self.start().json()['upload_id']
+        self.assertEqual(self.send(upload_id, 0, self.data[:1001]).status_code, 413)
+        self.assertEqual(self.send(upload_id, 0, b'MZ' + self.data[2:1000]).status_code, 415)
+        response = self.client.post(reverse('finish_upload', args=[upload_id]), {}, content_type='application/json')
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 0))
+
+    def test_reporter_evidence(self):
+        other = User.objects.create_user('other', 'other@example.com', 'password')
+        self.client.force_login(other)
+        self.assertEqual(self.start(target='scam_evidence').status_code, 403)
+
+        self.client.force_login(self.user)
+        upload_id = self.start(target='scam_evidence', description='Invoice').json()['upload_id']
+        self.send(upload_id, 0, self.data[:1000])
+        self.send(upload_id, 1000, self.data[1000:2000])
+        self.send(upload_id, 2000, self.data[2000:])
+        self.client.post(reverse('finish_upload', args=[upload_id]), {}, content_type='application/json')
+        evidence = ScamEvidence.objects.get()
+        self.assertEqual(evidence.file.name, storage.blob_name(hashlib.sha256(self.data).hexdigest(), 'shot.png'))
+        self.assertEqual(evidence.file_type, 'png')
+
+
+class EvidenceStorageTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        settings = self.settings(MEDIA_ROOT=tmpdir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def add_evidence(self, report, content, name='shot.png'):
+        return ReportEvidence.objects.create(
+            report=report, user=self.user, title='Screenshot', description='Checkout page',
+            file=SimpleUploadedFile(name, content)
+        )
+
+    def test_same_content_is_stored_once_until_last_reference(self):
+        first, second = make_report(self.user), make_report(self.user)
+        a = self.add_evidence(first, b'same screenshot')
+        b = self.add_evidence(second, b'same screenshot', name='other.PNG')
+        self.assertEqual(a.file.name, b.file.name)
+        digest = hashlib.sha256(b'same screenshot').hexdigest()
+        self.assertEqual(a.file.name, f'cas/{digest[:2]}/{digest[2:4]}/{digest}.png')
+        self.assertEqual(EvidenceBlob.objects.get().ref_count, 2)
+        path = a.file.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(EvidenceBlob.objects.get().ref_count, 1)
+
+        # Replacing the file drops the last reference of the old content
+        b.file = SimpleUploadedFile('new.png', b'new screenshot')
+        with self.captureOnCommitCallbacks(execute=True):
+            b.save()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(list(EvidenceBlob.objects.values_list('ref_count', flat=True)), [1])
+
+    def test_content_must_hash_to_its_sha256(self):
+        genuine = self.add_evidence(make_report(self.user), b'genuine screenshot')
+        planted = SimpleUploadedFile('shot.png', b'planted screenshot')
+        planted.sha256 = hashlib.sha256(b'genuine screenshot').hexdigest()
+        with self.assertRaises(storage.DigestMismatch):
+            storage.evidence_storage().save('shot.png', planted)
+        self.assertEqual(EvidenceBlob.objects.get().ref_count, 1)
+        with genuine.file.open('rb') as f:
+            self.assertEqual(f.read(), b'genuine screenshot')
+
+    def test_reconcile_recounts_references(self):
+        report = make_report(self.user)
+        evidence = self.add_evidence(report, b'screenshot')
+        orphan = self.add_evidence(report, b'orphan')
+        ReportEvidence.objects.filter(id=orphan.id).delete()
+        EvidenceBlob.objects.filter(name=evidence.file.name).update(ref_count=5)
+
+        out = StringIO()
+        call_command('reconcile_evidence_blobs', stdout=out)
+        self.assertIn('Fixed 2 drifted blobs', out.getvalue())
+        self.assertEqual(list(EvidenceBlob.objects.values_list('name', 'ref_count')), [(evidence.file.name, 1)])
+        self.assertFalse(os.path.exists(orphan.file.path))
+        self.assertEqual(storage.reconcile(), [])
+
+    def write(self, name, content):
+        path = storage.evidence_storage().path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def test_relocate_moves_old_layouts_and_merges_copies(self):
+        report = make_report(self.user)
+        legacy = {'evidence/a.png': b'storefront', 'evidence/b.png': b'storefront', 'evidence/z.jpeg': b'invoice'}
+        for name, content in legacy.items():
+            self.write(name, content)
+            ReportEvidence.objects.create(report=report, user=self.user, title=name, description='', file=name)
+        self.write('scam_evidence/None/c.pdf', b'%PDF-1.4 receipt')
+        ScamEvidence.objects.create(report=report, description='', file_type='pdf', file='scam_evidence/None/c.pdf')
+        # Saved by the flat layout of the first content-addressed version
+        digest = hashlib.sha256(b'invoice').hexdigest()
+        self.write(f'cas/{digest}.jpg', b'invoice')
+        EvidenceBlob.objects.create(sha256=digest, name=f'cas/{digest}.jpg', size=7, ref_count=2)
+        ReportEvidence.objects.create(report=report, user=self.user, title='flat', description='', file=f'cas/{digest}.jpg')
+        ScamEvidence.objects.create(report=report, description='', file_type='jpg', file=f'cas/{digest}.jpg')
+
+        call_command('relocate_evidence', batch_size=2, workers=2, stdout=StringIO())
+
+        evidence = [*ReportEvidence.objects.all(), *ScamEvidence.objects.all()]
+        for row in evidence:
+            self.assertRegex(row.file.name, storage.SHARDED_NAME)
+            with row.file.open('rb') as f:
+                self.assertIn(f.read(), (b'storefront', b'invoice', b'%PDF-1.4 receipt'))
+        self.assertEqual(len({row.file.name for row in evidence}), 3)
+        self.assertEqual(sorted(EvidenceBlob.objects.values_list('ref_count', flat=True)), [1, 2, 3])
+        self.assertEqual(EvidenceBlob.objects.get(sha256=digest).name, storage.blob_name(digest, 'invoice.jpg'))
+        self.assertEqual(storage.reconcile(dry_run=True), [])
+        files = [
+            os.path.relpath(os.path.join(root, name), storage.evidence_storage().location)
+            for root, _, names in os.walk(storage.evidence_storage().location) for name in names
+        ]
+        # One file per content, the old copies are gone
+        self.assertEqual(sorted(files), sorted({row.file.name for row in evidence}))
+
+
+def make_image(seed, size=(64, 48), fmt='PNG', shade=0):
+    """
+    A random greyscale image of blocks, `shade` brightened, encoded as fmt
+    """
+    rng = np.random.default_rng(seed)
+    blocks = rng.integers(0, 200, (6, 8), dtype=np.uint8) + shade
+    image = Image.fromarray(blocks).resize(size, Image.Resampling.NEAREST)
+    buffer = BytesIO()
+    image.save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class ImageIndexTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        settings = self.settings(MEDIA_ROOT=tmpdir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def test_dhash_survives_reencoding_and_resizing(self):
+        original = perceptual.dhash_file(BytesIO(make_image(1)))
+        copy = perceptual.dhash_file(BytesIO(make_image(1, size=(128, 96), fmt='JPEG', shade=20)))
+        other = perceptual.dhash_file(BytesIO(make_image(2)))
+        self.assertLessEqual(perceptual.distance(original, copy), 6)
+        self.assertGreater(perceptual.distance(original, other), 16)
+        self.assertIsNone(perceptual.dhash_file(BytesIO(b'not an image')))
+
+    def test_lookup_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        hashes = [int(value) for value in rng.integers(0, 2**63, 400, dtype=np.int64)]
+        # Near copies of the first hash, some in the tail added after the build
+        hashes += [hashes[0] ^ (1 << bit) ^ (1 << (bit + 20)) for bit in range(0, 40, 4)]
+        index = ImageIndex()
+        index._build(np.arange(300, dtype=np.int64), np.array(hashes[:300], dtype=np.uint64))
+        index._tail_ids = list(range(300, len(hashes)))
+        index._tail_hashes = hashes[300:]
+        for query in (hashes[0], hashes[5] ^ 0b111, hashes[-1]):
+            for radius in (0, 4, 10):
+                expected = sorted(
+                    (perceptual.distance(query, value), i) for i, value in enumerate(hashes)
+                    if perceptual.distance(query, value) <= radius
+                )
+                found = sorted((distance, i) for i, distance in index.lookup(query, radius))
+                self.assertEqual(found, expected)
+
+    def test_report_page_lists_similar_evidence_of_other_reports(self):
+        first, second, third = (make_report(self.user, title=title) for title in ('First', 'Second', 'Third'))
+        ReportEvidence.objects.create(
+            report=first, user=self.user, title='Checkout', description='', file=SimpleUploadedFile('a.png', make_image(1))
+        )
+        copy = ReportEvidence.objects.create(
+            report=second, user=self.user, title='Same checkout', description='',
+            file=SimpleUploadedFile('b.jpg', make_image(1, size=(128, 96), fmt='JPEG')),
+        )
+        ReportEvidence.objects.create(
+            report=third, user=self.user, title='Unrelated', description='', file=SimpleUploadedFile('c.png', make_image(2))
+        )
+        # Stored before hashing, filled in by the backfill
+        EvidenceBlob.objects.filter(name=copy.file.name).update(dhash=None)
+        out = StringIO()
+        call_command('hash_evidence_images', stdout=out)
+        self.assertIn('Hashed 1 images', out.getvalue())
+
+        image_index.image_index.refresh(full=True)
+        self.assertEqual([row.report for _, row in similar_to_report(first)], [second])
+        response = self.client.get(reverse('view_report', args=[first.id]))
+        self.assertContains(response, 'Similar Evidence in Other Reports')
+        self.assertContains(response, reverse('view_report', args=[second.id]))
+        self.assertNotContains(response, reverse('view_report', args=[third.id]))
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:myapp_reportevidence_change', args=[copy.id]))
+        self.assertContains(response, reverse('admin:myapp_scamreport_change', args=[first.id]))
+
+
+    def test_nearest_evidence_comes_first_whatever_its_age(self):
+        first, second, third = (make_report(self.user, title=title) for title in ('First', 'Second', 'Third'))
+        for report, name, content in (
+            (first, 'a.png', make_image(1)),
+            (second, 'b.png', make_image(1)),
+            (third, 'c.png', make_image(1, size=(50, 40))),
+        ):
+            ReportEvidence.objects.create(
+                report=report, user=self.user, title='Checkout', description='', file=SimpleUploadedFile(name, content)
+            )
+        image_index.image_index.refresh(full=True)
+        self.assertEqual([(distance, row.report) for distance, row in similar_to_report(first, limit=1)], [(0, second)])
+        self.assertEqual([row.report for _, row in similar_to_report(first)], [second, third])
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        settings = self.settings(MEDIA_ROOT=tmpdir.name, EVIDENCE_THUMBNAIL_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+
+    def thumbnail_paths(self, name):
+        return [storage.evidence_storage().path(thumb) for thumb in thumbnails.thumbnail_names(name)]
+
+    def test_upload_renders_thumbnails_shown_lazily(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence = ReportEvidence.objects.create(
+                report=self.report, user=self.user, title='Checkout', description='',
+                file=SimpleUploadedFile('shot.png', make_image(1, size=(1200, 900))),
+            )
+        paths = self.thumbnail_paths(evidence.file.name)
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        small = thumbnails.thumbnail_name(evidence.file.name, 320, 'webp')
+        with Image.open(storage.evidence_storage().path(small)) as image:
+            self.assertEqual(image.size, (320, 240))
+
+        response = self.client.get(reverse('view_report', args=[self.report.id]))
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, thumbnails.thumbnail_name(evidence.file.name, 960, 'webp'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence.delete()
+        self.assertFalse(any(os.path.exists(path) for path in paths))
+
+    def test_backfill_renders_existing_images_in_processes(self):
+        evidence = ReportEvidence.objects.create(
+            report=self.report, user=self.user, title='Checkout', description='',
+            file=SimpleUploadedFile('shot.jpg', make_image(1, fmt='JPEG')),
+        )
+        ScamEvidence.objects.create(
+            report=self.report, description='', file=SimpleUploadedFile('receipt.png', make_image(2))
+        )
+        broken = ScamEvidence.objects.create(
+            report=self.report, description='', file=SimpleUploadedFile('broken.png', b'not an image')
+        )
+        response = self.client.get(reverse('view_report', args=[self.report.id]))
+        self.assertNotContains(response, '<picture>')
+
+        out, err = StringIO(), StringIO()
+        call_command('generate_thumbnails', workers=2, stdout=out, stderr=err)
+        self.assertIn('Rendered thumbnails of 2 images', out.getvalue())
+        self.assertIn(broken.file.name, err.getvalue())
+        self.assertEqual(EvidenceBlob.objects.filter(thumbnails_at__isnull=False).count(), 2)
+        self.assertTrue(all(os.path.exists(path) for path in self.thumbnail_paths(evidence.file.name)))
+        response = self.client.get(reverse('view_report', args=[self.report.id]))
+        self.assertContains(response, '<picture>')
+
+
+def make_xref_stream_pdf():
+    """
+    A PDF 1.5 whose catalog and page tree sit in a compressed object stream
+    indexed by a cross-reference stream with the PNG Up predictor
+    """
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>', b'<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >>',
+        b'<< /Type /Page /Parent 2 0 R >>', b'<< /Type /Page /Parent 2 0 R >>',
+    ]
+    body = header = b''
+    for num, obj in enumerate(objects, 1):
+        header += b'%d %d ' % (num, len(body))
+        body += obj + b' '
+    out = b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n'
+    offsets = {5: len(out)}
+    out += b"5 0 obj\n<< /Producer (Acme PDF \\(beta\\)) /Title <FEFF00540065007300740020> "
+    out += b"/CreationDate (D:20240501103000+02'00') >>\nendobj\n"
+    offsets[6] = len(out)
+    stream = zlib.compress(header + body)
+    out += b'6 0 obj\n<< /Type /ObjStm /N 4 /First %d /Filter /FlateDecode /Length %d >>\nstream\n' % (
+        len(header), len(stream)
+    ) + stream + b'\nendstream\nendobj\n'
+    offsets[7] = len(out)
+    rows = [(0, 0, 0)] + [(2, 6, index) for index in range(4)] + [(1, offsets[num], 0) for num in (5, 6, 7)]
+    data, previous = b'', bytes(4)
+    for kind, field, index in rows:
+        row = bytes([kind]) + field.to_bytes(2, 'big') + bytes([index])
+        data += b'\x02' + bytes((a - b) & 0xff for a, b in zip(row, previous))
+        previous = row
+    stream = zlib.compress(data)
+    out += (
+        b'7 0 obj\n<< /Type /XRef /Size 8 /W [1 2 1] /Root 1 0 R /Info 5 0 R /Filter /FlateDecode '
+        b'/DecodeParms << /Columns 4 /Predictor 12 >> /Length %d >>\nstream\n' % len(stream)
+    ) + stream + b'\nendstream\nendobj\n'
+    return out + b'startxref\n%d\n%%%%EOF\n' % offsets[7]
+
+
+class EvidenceMetadataTests(TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        settings = self.settings(MEDIA_ROOT=tmpdir.name, EVIDENCE_METADATA_WORKERS=0, EVIDENCE_THUMBNAIL_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+
+    def path(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_pdf_pages_and_producer_come_from_the_trailer(self):
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer)
+        pdf.setTitle('Invoice (copy)')
+        for page in range(3):
+            pdf.drawString(100, 100, f'Page {page}')
+            pdf.showPage()
+        pdf.save()
+        result = metadata.extract(self.path('invoice.pdf', buffer.getvalue()))
+        self.assertEqual(result['pages'], 3)
+        self.assertEqual(result['title'], 'Invoice (copy)')
+        self.assertIn('ReportLab', result['producer'])
+
+        result = metadata.extract(self.path('receipt.pdf', make_xref_stream_pdf()))
+        self.assertEqual(
+            {key: result[key] for key in ('version', 'pages', 'producer', 'title', 'creation_date')},
+            {'version': '1.5', 'pages': 2, 'producer': 'Acme PDF (beta)', 'title': 'Test',
+             'creation_date': '2024-05-01T10:30:00+02:00'},
+        )
+        self.assertIn('error', metadata.extract(self.path('broken.pdf', b'%PDF-1.4\n' + b'0' * 5000)))
+
+    def test_corrupt_xref_streams_are_reported_not_raised(self):
+        pdf = make_xref_stream_pdf()
+        xref = pdf.rindex(b'7 0 obj')
+        corrupt = {
+            'truncated.pdf': (pdf[:len(pdf) // 2], 'No startxref'),
+            'moved.pdf': (pdf.replace(b'startxref\n%d' % xref, b'startxref\n%d' % (xref - 40)), 'Expected a number'),
+            'deflate.pdf': (pdf[:xref] + pdf[xref:].replace(b'stream\n', b'stream\nxx', 1), 'Malformed PDF'),
+            'predictor.pdf': (pdf.replace(b'/Predictor 12', b'/Predictor 3'), 'Unsupported predictor 3'),
+            'widths.pdf': (pdf.replace(b'/W [1 2 1]', b'/W [1 1 1]'), 'Object stream 2 not found'),
+            'headless.pdf': (pdf[20:], 'No PDF header'),
+        }
+        for name, (content, error) in corrupt.items():
+            with self.subTest(name):
+                self.assertIn(error, metadata.extract(self.path(name, content))['error'])
+
+        # A dangling catalog loses the page count, not the document info
+        result = metadata.extract(self.path('dangling.pdf', pdf.replace(b'/Root 1 0 R', b'/Root 9 0 R')))
+        self.assertNotIn('error', result)
+        self.assertNotIn('pages', result)
+        self.assertEqual(result['producer'], 'Acme PDF (beta)')
+
+    def test_replaced_file_gets_new_metadata(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence = ScamEvidence.objects.create(
+                report=self.report, description='', file=SimpleUploadedFile('receipt.pdf', make_xref_stream_pdf())
+            )
+        evidence.refresh_from_db()
+        self.assertEqual(evidence.metadata['pages'], 2)
+
+        evidence.file = SimpleUploadedFile('shot.png', make_image(1))
+        evidence.file_type = 'png'
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence.save()
+        evidence.refresh_from_db()
+        self.assertEqual((evidence.metadata['format'], evidence.metadata['width']), ('PNG', 64))
+
+    def test_exif_is_read_from_the_header_only(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Canon'
+        exif.get_ifd(ExifTags.IFD.Exif)[0x9003] = '2024:05:01 10:30:00'
+        buffer = BytesIO()
+        Image.fromarray(np.random.default_rng(1).integers(0, 255, (600, 800, 3), dtype=np.uint8)).save(
+            buffer, 'JPEG', exif=exif
+        )
+        # The pixel data is cut short, decoding it would fail
+        path = self.path('shot.jpg', buffer.getvalue()[:len(buffer.getvalue()) // 4])
+        result = metadata.extract(path)
+        self.assertNotIn('error', result)
+        self.assertEqual((result['width'], result['height']), (800, 600))
+        self.assertEqual(result['exif'], {'Make': 'Canon', 'DateTimeOriginal': '2024:05:01 10:30:00'})
+
+    def test_new_evidence_and_backfill_fill_metadata(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence = ScamEvidence.objects.create(
+                report=self.report, description='', file=SimpleUploadedFile('receipt.pdf', make_xref_stream_pdf())
+            )
+        evidence.refresh_from_db()
+        self.assertEqual(evidence.metadata['pages'], 2)
+
+        for name in ('a.pdf', 'b.pdf', 'c.png'):
+            content = make_image(1) if name.endswith('.png') else make_xref_stream_pdf()
+            ScamEvidence.objects.create(report=self.report, description='', file=SimpleUploadedFile(name, content))
+        ScamEvidence.objects.create(report=self.report, description='', file=SimpleUploadedFile('d.png', b'broken'))
+        ScamEvidence.objects.update(metadata=None)
+        out = StringIO()
+        call_command('extract_evidence_metadata', batch_size=2, workers=2, stdout=out)
+        self.assertIn('5/5 rows', out.getvalue())
+        self.assertIn('Extracted metadata of 4 rows', out.getvalue())
+        self.assertEqual(ScamEvidence.objects.filter(metadata__pages=2).count(), 3)
+        self.assertEqual(ScamEvidence.objects.get(file__endswith='.png', metadata__width=64).metadata['format'], 'PNG')
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def test_fold_handles_turkish_casing(self):
+        self.assertEqual(search.fold('İSTANBUL'), 'istanbul')
+        self.assertEqual(search.fold('ıslak İmza'), 'islak imza')
+        self.assertEqual(search.tokenize('Yatırım, KRİPTO!'), ['yatirim', 'kripto'])
+
+    def test_title_matches_rank_first_and_index_follows_edits(self):
+        body = make_report(self.user, title='Unrelated', description='Sahte kargo takip mesajı')
+        title = make_report(self.user, title='Kargo dolandırıcılığı')
+        make_report(self.user, title='Crypto', description='Fake exchange')
+
+        results = list(search.search_reports(ScamReport.objects.all(), 'KARGO'))
+        self.assertEqual(results, [title, body])
+        # The last term matches as a prefix
+        self.assertEqual(list(search.search_reports(ScamReport.objects.all(), 'dolandir')), [title])
+
+        title.title = 'Renamed'
+        title.save()
+        body.delete()
+        self.assertEqual(list(search.search_reports(ScamReport.objects.all(), 'kargo')), [])
+
+    def test_backends_match_the_report_type(self):
+        shopping = make_report(self.user, title='Kargo', report_type='shopping')
+        make_report(self.user, title='Crypto', report_type='investment')
+        for backend in (search.get_backend(), search.LikeSearchBackend()):
+            with self.subTest(backend=type(backend).__name__):
+                self.assertEqual(list(backend.search(ScamReport.objects.all(), 'Shopping')), [shopping])
+                self.assertEqual(list(backend.search(ScamReport.objects.all(), 'shopping scam')), [shopping])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.reports = [make_report(self.user, title=f'Report {i}', description='Word ' * 100) for i in range(7)]
+        # Ties on submission_date must still page by id
+        ScamReport.objects.filter(id__in=[r.id for r in self.reports[2:5]]).update(
+            submission_date=self.reports[2].submission_date
+        )
+
+    def test_api_pages_cover_every_report_once(self):
+        seen = []
+        cursor = ''
+        while True:
+            data = self.client.get('/api/reports/', {'page_size': 3, 'cursor': cursor}).json()
+            seen += [item['id'] for item in data['results']]
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+        expected = list(ScamReport.objects.order_by('-submission_date', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_listing_defers_description_and_shows_excerpt(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/public-reports/', {'page_size': 5})
+        self.assertContains(response, 'Next')
+        listing = [q['sql'] for q in queries if 'FROM "myapp_scamreport"' in q['sql']]
+        self.assertTrue(listing)
+        self.assertFalse(any('"myapp_scamreport"."description"' in sql for sql in listing))
+        self.assertEqual(len(self.reports[0].excerpt), 200)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get('/api/reports/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.json()['results']), 7)
+
+
+class URLCanonicalizationTests(SimpleTestCase):
+    def test_canonical_host_and_registrable_domain(self):
+        cases = {
+            'https://user:pw@WWW.Shop.Example.co.uk:8443/path?q=1': ('shop.example.co.uk', 'example.co.uk'),
+            'http://www.example.com.': ('example.com', 'example.com'),
+            'evil.github.io/login': ('evil.github.io', 'evil.github.io'),
+            'https://münchen.de/': ('xn--mnchen-3ya.de', 'xn--mnchen-3ya.de'),
+            'foo.bar.kawasaki.jp': ('foo.bar.kawasaki.jp', 'foo.bar.kawasaki.jp'),
+            'www.city.kawasaki.jp': ('city.kawasaki.jp', 'city.kawasaki.jp'),
+            'http://[2001:db8::1]:80/': ('2001:db8::1', '2001:db8::1'),
+            'www.com': ('www.com', 'www.com'),
+            'http:///nothing': ('', ''),
+        }
+        for url, expected in cases.items():
+            with self.subTest(url=url):
+                self.assertEqual(urlcanon.split_url(url), expected)
+        self.assertEqual(urlcanon.canonicalize_host('https://WWW.Example.com./', strip_www=False), 'www.example.com')
+
+    def test_parent_domains(self):
+        self.assertEqual(
+            urlcanon.parent_domains('a.b.example.com.tr'),
+            ['a.b.example.com.tr', 'b.example.com.tr', 'example.com.tr']
+        )
+
+
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+
+    def analysis(self, partial=False):
+        return {
+            'domain_age': 400, 'whois_info': {'registrar': 'Stub Registrar, Inc.', 'country': 'TR'},
+            'dns_records': {}, 'ip_address': None, 'is_valid': True, 'risk_level': 'low',
+            'warnings': ['WHOIS lookup timed out, results are partial'] if partial else [], 'partial': partial,
+        }
+
+    def run_claimed(self, analysis, blacklist=None):
+        job = jobs.claim_job('test')
+        blacklist = blacklist or {'is_blacklisted': False, 'details': [], 'errors': []}
+        with mock.patch.object(jobs, 'analyze_url', return_value=analysis), \
+                mock.patch.object(jobs, 'check_blacklist', return_value=blacklist):
+            return job, jobs.run_job(job)
+
+    def run_failing(self, analysis, blacklist=None):
+        with self.assertLogs('myapp.jobs', 'WARNING'):
+            return self.run_claimed(analysis, blacklist)
+
+    def test_claim_locks_the_job(self):
+        queued = jobs.enqueue_report_analysis(self.report)
+        job = jobs.claim_job('worker-1')
+        self.assertEqual((job.id, job.status, job.locked_by, job.attempts), (queued.id, 'running', 'worker-1', 1))
+        self.assertIsNone(jobs.claim_job('worker-2'))
+
+        # A worker that died leaves its job to be taken over after the lock timeout
+        AnalysisJob.objects.filter(id=job.id).update(locked_at=timezone.now() - timedelta(seconds=301))
+        job = jobs.claim_job('worker-2')
+        self.assertEqual((job.locked_by, job.attempts), ('worker-2', 2))
+
+    def test_successful_run_stores_the_analysis(self):
+        jobs.enqueue_report_analysis(self.report)
+        job, ok = self.run_claimed(self.analysis())
+        self.assertTrue(ok)
+        job.refresh_from_db()
+        self.report.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((self.report.domain_age, self.report.domain_registrar), ('400 days', 'Stub Registrar, Inc.'))
+        self.assertIsNotNone(self.report.analyzed_at)
+
+    def test_incomplete_lookups_are_retried(self):
+        jobs.enqueue_report_analysis(self.report)
+        job, ok = self.run_failing(self.analysis(partial=True))
+        self.assertFalse(ok)
+        job.refresh_from_db()
+        self.report.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('queued', ''))
+        self.assertIn('WHOIS lookup timed out', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+        self.assertIsNone(self.report.analyzed_at)
+
+        AnalysisJob.objects.filter(id=job.id).update(run_after=timezone.now())
+        unreachable = {'is_blacklisted': False, 'details': [], 'errors': ['a: timed out', 'b: timed out']}
+        job, ok = self.run_failing(self.analysis(), unreachable)
+        job.refresh_from_db()
+        self.assertEqual((ok, job.status, job.attempts), (False, 'queued', 2))
+        self.assertIn('Blacklist lookup failed', job.last_error)
+
+    def test_last_attempt_keeps_partial_results(self):
+        jobs.enqueue_report_analysis(self.report)
+        with self.settings(ANALYSIS_MAX_ATTEMPTS=1):
+            job, ok = self.run_failing(self.analysis(partial=True))
+        job.refresh_from_db()
+        self.report.refresh_from_db()
+        self.assertEqual((ok, job.status), (False, 'failed'))
+        self.assertTrue(self.report.url_analysis['partial'])
+
+    def test_enqueue_missing_from_the_worker(self):
+        analyzed = make_report(self.user, analyzed_at=timezone.now())
+        make_report(self.user, scam_url='')
+        jobs.enqueue_report_analysis(self.report)
+        missing = make_report(self.user)
+
+        out = StringIO()
+        with mock.patch.object(jobs, 'run_job', return_value=True) as run_job:
+            call_command('run_analysis_worker', '--enqueue-missing', '--once', '--poll-interval', '0', stdout=out)
+        self.assertIn('Queued 1 reports for analysis', out.getvalue())
+        self.assertEqual(
+            sorted(call.args[0].report_id for call in run_job.call_args_list), [self.report.id, missing.id]
+        )
+        self.assertFalse(AnalysisJob.objects.filter(report=analyzed).exists())
+
+
+class AnalyzeURLTests(SimpleTestCase):
+    def analyze(self, dns_latency=0.0, whois_latency=0.0, deadline=0.5):
+        with stub_network(dns_latency=dns_latency, whois_latency=whois_latency), \
+                self.settings(DNS_CONCURRENT_RESOLUTION=True, ANALYZE_URL_DEADLINE=deadline):
+            started = time.monotonic()
+            results = utils.analyze_url('https://slow-shop.example/', use_cache=False)
+            return results, time.monotonic() - started
+
+    def test_slow_whois_returns_dns_results(self):
+        results, elapsed = self.analyze(whois_latency=2)
+        self.assertLess(elapsed, 1.5)
+        self.assertTrue(results['is_valid'])
+        self.assertIn('WHOIS lookup timed out, results are partial', results['warnings'])
+        self.assertEqual(results['dns_records']['A'], ['192.0.2.10'])
+        self.assertEqual(results['ip_address'], '192.0.2.10')
+
+    def test_slow_dns_returns_whois_results(self):
+        results, elapsed = self.analyze(dns_latency=2)
+        self.assertLess(elapsed, 1.5)
+        self.assertIsNotNone(results['whois_info'])
+        self.assertEqual(results['dns_records'], {'A': [], 'MX': [], 'NS': [], 'TXT': []})
+        self.assertTrue(any('DNS lookup timed out' in w for w in results['warnings']))
+        self.assertIn('Could not resolve IP address: lookup timed out', results['warnings'])
+
+    def test_dns_queries_the_host_as_written(self):
+        with stub_network(), self.settings(DNS_CONCURRENT_RESOLUTION=True), \
+                mock.patch.object(utils, 'lookup_dns_records', wraps=utils.lookup_dns_records) as lookup, \
+                mock.patch.object(utils, 'get_domain_info', wraps=utils.get_domain_info) as whois:
+            utils.analyze_url('https://WWW.Shop.Example.co.uk:8443/login', use_cache=False)
+        self.assertEqual(lookup.call_args.args[0], 'www.shop.example.co.uk')
+        self.assertEqual(whois.call_args.args[0], 'example.co.uk')
+
+    def test_whois_runs_outside_the_dns_pool(self):
+        threads = []
+        with stub_network() as (_, whois_stub, _), self.settings(DNS_CONCURRENT_RESOLUTION=True):
+            def record_thread(domain):
+                threads.append(threading.current_thread().name)
+                return whois_stub(domain)
+
+            with mock.patch.object(utils.whois, 'whois', record_thread):
+                utils.analyze_url('https://shop.example/', use_cache=False)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('whois-lookup'))
+
+
+class DomainCacheTests(TestCase):
+    def setUp(self):
+        domain_cache.clear_local()
+        self.addCleanup(domain_cache.clear_local)
+        self.calls = []
+
+    def fetch(self, payload):
+        def fetch(domain):
+            self.calls.append(domain)
+            return payload
+        return fetch
+
+    def test_hits_are_served_until_the_ttl_expires(self):
+        fetch = self.fetch({'registrar': 'Example'})
+        for _ in range(2):
+            domain_cache.get_or_fetch('fake-store.example', 'whois', fetch, lambda payload: False)
+        self.assertEqual(self.calls, ['fake-store.example'])
+        row = DomainIntel.objects.get()
+        self.assertFalse(row.is_negative)
+        self.assertAlmostEqual((row.expires_at - row.fetched_at).total_seconds(), 24 * 60 * 60)
+
+        # Another process only sees the table, expired rows are refetched
+        domain_cache.clear_local()
+        DomainIntel.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        domain_cache.get_or_fetch('fake-store.example', 'whois', fetch, lambda payload: False)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(domain_cache.purge_expired(), 0)
+
+    def test_failures_use_the_shorter_negative_ttl(self):
+        with self.settings(DOMAIN_INTEL_TTLS={'negative': 30}):
+            domain_cache.get_or_fetch('gone.example', 'dns', self.fetch({'error': 'NXDOMAIN'}), lambda p: 'error' in p)
+        row = DomainIntel.objects.get()
+        self.assertTrue(row.is_negative)
+        self.assertAlmostEqual((row.expires_at - row.fetched_at).total_seconds(), 30)
+
+        # Served from the process until the negative TTL, then from the table
+        DomainIntel.objects.update(expires_at=timezone.now())
+        self.assertIsNotNone(domain_cache.get_cached('gone.example', 'dns'))
+        with mock.patch('myapp.caching.time.monotonic', return_value=time.monotonic() + 31):
+            self.assertIsNone(domain_cache.get_cached('gone.example', 'dns'))
+        self.assertEqual(domain_cache.purge_expired(), 1)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual((cache.get('a'), cache.get('c'), len(cache)), (1, 3, 2))
+        cache.set('d', 4, ttl=10)
+        with mock.patch('myapp.caching.time.monotonic', return_value=time.monotonic() + 11):
+            self.assertNotIn('d', cache)
+            self.assertIn('c', cache)
+
+
+class DomainLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def lookup(self, url):
+        return self.client.get('/api/lookup/', {'url': url}).json()
+
+    def test_exact_parent_and_subdomain_matches(self):
+        report = make_report(self.user, scam_url='https://www.Fake-Store.com.tr:443/checkout')
+        sub = make_report(self.user, scam_url='http://pay.fake-store.com.tr/')
+        make_report(self.user, scam_url='https://fake-store.com/')
+        self.assertEqual((report.domain, report.registrable_domain), ('fake-store.com.tr', 'fake-store.com.tr'))
+
+        data = self.lookup('fake-store.com.tr')
+        self.assertEqual({(m['id'], m['match']) for m in data['matches']}, {(report.id, 'exact'), (sub.id, 'subdomain')})
+
+        data = self.lookup('https://login.pay.fake-store.com.tr/x')
+        self.assertEqual({(m['id'], m['match']) for m in data['matches']}, {(report.id, 'parent'), (sub.id, 'parent')})
+        self.assertFalse(self.lookup('other.com.tr')['reported'])
+
+    def test_domain_follows_url_edits(self):
+        report = make_report(self.user, scam_url='https://old.example/')
+        report.scam_url = 'https://new.example/'
+        report.save(update_fields=['scam_url'])
+        report.refresh_from_db()
+        self.assertEqual(report.domain, 'new.example')
+
+
+class DomainIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def test_verdicts_follow_incremental_refresh(self):
+        report = make_report(self.user, scam_url='https://fake-store.com.tr/checkout')
+        make_report(self.user, scam_url='https://github.io/', status='verified')
+        index = DomainIndex(refresh_interval=0)
+        urls = ['http://www.fake-store.com.tr/x', 'pay.fake-store.com.tr', 'evil.github.io', 'http:///']
+
+        self.assertEqual(
+            [result['verdict'] for result in index.check_urls(urls)],
+            ['suspicious', 'suspicious', 'unknown', 'invalid']
+        )
+
+        report.status = 'verified'
+        report.save()
+        result = index.check_urls(urls)[1]
+        self.assertEqual((result['verdict'], result['domain'], result['verified']), ('scam', 'fake-store.com.tr', 1))
+
+        reputation.update_status(ScamReport.objects.filter(id=report.id), 'rejected')
+        self.assertEqual(index.check_urls(urls)[0]['verdict'], 'unknown')
+
+    def test_backfilled_domains_reach_the_index(self):
+        old = make_report(self.user, scam_url='https://www.fake-store.com.tr/')
+        make_report(self.user, scam_url='https://other.example/')
+        # As left by an older canonicalization, e.g. before a suffix list update
+        ScamReport.objects.filter(id=old.id).update(
+            domain='stale.example', domain_key='example.stale', registrable_domain='stale.example',
+            last_updated=timezone.now() - timedelta(days=1)
+        )
+        index = DomainIndex(refresh_interval=0)
+        self.assertEqual(index.check_urls(['fake-store.com.tr'])[0]['verdict'], 'unknown')
+
+        call_command('backfill_domains', '--all', stdout=StringIO())
+        old.refresh_from_db()
+        self.assertEqual((old.domain, old.registrable_domain), ('fake-store.com.tr', 'fake-store.com.tr'))
+        self.assertEqual(index.check_urls(['fake-store.com.tr'])[0]['verdict'], 'suspicious')
+
+    def test_check_urls_endpoint(self):
+        make_report(self.user, scam_url='https://fake-store.com.tr/', status='verified')
+        domain_index.refresh(full=True)
+        response = self.client.post(
+            '/api/check-urls/', {'urls': ['fake-store.com.tr/a', 'example.org']}, content_type='application/json'
+        )
+        self.assertEqual([r['verdict'] for r in response.json()['results']], ['scam', 'unknown'])
+
+        with self.settings(URL_CHECK_MAX_URLS=1):
+            response = self.client.post('/api/check-urls/', {'urls': ['a.com', 'b.com']}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DomainFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def test_membership_without_false_positives(self):
+        hosts = [f'site-{i}.example.com' for i in range(5000)]
+        domain_filter = DomainFilter(error_rate=0.1)
+        domain_filter.build(hosts)
+        self.assertTrue(all(host in domain_filter for host in hosts))
+        self.assertFalse(any(f'other-{i}.example.com' in domain_filter for i in range(5000)))
+        self.assertEqual(domain_filter.match('pay.site-7.example.com'), 'site-7.example.com')
+        self.assertIsNone(domain_filter.match('example.com'))
+
+    def test_incremental_refresh(self):
+        report = make_report(self.user, scam_url='https://fake-store.com.tr/checkout')
+        domain_filter = DomainFilter(refresh_interval=0)
+        self.assertEqual(domain_filter.is_reported('http://www.pay.fake-store.com.tr/x'), 'fake-store.com.tr')
+
+        make_report(self.user, scam_url='https://other-store.net/')
+        self.assertEqual(domain_filter.is_reported('other-store.net'), 'other-store.net')
+
+        reputation.update_status(ScamReport.objects.filter(id=report.id), 'rejected')
+        self.assertIsNone(domain_filter.is_reported('fake-store.com.tr'))
+        self.assertEqual(len(domain_filter), 1)
+
+    def test_already_reported_endpoint(self):
+        make_report(self.user, scam_url='https://fake-store.com.tr/')
+        domain_filter.refresh(full=True)
+        response = self.client.get('/api/already-reported/', {'url': 'https://shop.fake-store.com.tr/a'})
+        self.assertEqual(response.json(), {'reported': True, 'domain': 'fake-store.com.tr'})
+        response = self.client.get('/api/already-reported/', {'url': 'example.org'})
+        self.assertEqual(response.json(), {'reported': False, 'domain': None})
+
+
+class ReportQueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+
+    def add_activity(self, report, count):
+        for i in range(count):
+            commenter = User.objects.create_user(f'commenter{report.id}-{i}', f'c{report.id}-{i}@example.com', 'password')
+            ReportComment.objects.create(report=report, user=commenter, content=f'Comment {i}')
+            ReportEvidence.objects.create(
+                report=report, user=commenter, title=f'Screenshot {i}', description='Checkout page', file='evidence/shot.png'
+            )
+            Donation.objects.create(report=report, user=commenter, amount=10, payment_status='completed')
+
+    def render_queries(self, report):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('view_report', args=[report.id]))
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_detail_page_query_count_is_fixed(self):
+        small, large = make_report(self.user), make_report(self.user)
+        self.add_activity(small, 1)
+        self.add_activity(large, 8)
+
+        with self.settings(VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_FLUSH_THRESHOLD=10**6):
+            _, small_queries = self.render_queries(small)
+            response, large_queries = self.render_queries(large)
+            # Fragments are cached now, only the report is loaded
+            cached, cached_queries = self.render_queries(large)
+        # The report with its reporter, then evidence, comments with their
+        # authors, the recent donations with their donors and the hashes
+        # of the report's images
+        self.assertEqual(small_queries, 5)
+        self.assertEqual(large_queries, 5)
+        self.assertEqual(cached_queries, 1)
+        self.assertEqual(len(response.context['report'].recent_donations), 5)
+        self.assertContains(response, f'c{large.id}-7@example.com', count=2)
+        self.assertContains(cached, f'c{large.id}-7@example.com', count=2)
+
+    def test_listing_query_count_is_fixed(self):
+        for i in range(6):
+            reporter = User.objects.create_user(f'user{i}', f'user{i}@example.com', 'password')
+            make_report(reporter, title=f'Report {i}')
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('public_reports'))
+            self.assertContains(response, 'user5')
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+        self.url = reverse('view_report', args=[self.report.id])
+
+    def test_changes_invalidate_cached_fragments(self):
+        self.assertContains(self.client.get(self.url), 'No comments yet.')
+        comment = ReportComment.objects.create(report=self.report, user=self.user, content='Same site took my money')
+        self.assertContains(self.client.get(self.url), 'Same site took my money')
+
+        comment.delete()
+        self.assertContains(self.client.get(self.url), 'No comments yet.')
+
+        self.report.url_analysis = {'risk_level': 'high', 'warnings': ['Domain registered 3 days ago']}
+        self.report.save(update_fields=['url_analysis'])
+        self.assertContains(self.client.get(self.url), 'Domain registered 3 days ago')
+
+    def test_moderation_buttons_are_not_shared(self):
+        comment = ReportComment.objects.create(report=self.report, user=self.user, content='Pending comment')
+        verify_url = reverse('verify_comment', args=[comment.id])
+        staff = User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.force_login(staff)
+        self.assertContains(self.client.get(self.url), verify_url)
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Pending comment')
+        self.assertNotContains(response, verify_url)
+
+    def test_invalid_forms_render_the_whole_report(self):
+        self.client.force_login(self.user)
+        for url in (reverse('add_comment', args=[self.report.id]), reverse('add_evidence', args=[self.report.id])):
+            with self.subTest(url):
+                response = self.client.post(url, {})
+                self.assertContains(response, 'Took my money and never shipped.')
+                self.assertContains(response, 'This field is required.')
+                self.assertContains(response, 'No comments yet.')
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.user = User.objects.create_user('reporter', 'reporter@example.com', 'password')
+        self.report = make_report(self.user)
+
+    def test_requests_are_recorded_per_view(self):
+        with self.settings(VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_FLUSH_THRESHOLD=10**6):
+            response = self.client.get(reverse('view_report', args=[self.report.id]))
+        queries = metrics.registry.get('request_queries', 'view_report')
+        self.assertEqual((queries.count, queries.sum), (1, 5))
+        size = metrics.registry.get('response_size_bytes', 'view_report')
+        self.assertEqual(size.sum, len(response.content))
+
+        text = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('django_request_queries_bucket{view="view_report",le="5"} 1', text)
+        self.assertIn('django_request_duration_seconds_count{view="view_report"} 1', text)
+
+    def test_endpoint_is_restricted(self):
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5').status_code, 403)
+        # The address of a request forwarded by the hosting proxy
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5').status_code, 403)
+        with self.settings(METRICS_TOKEN='s3cret'):
+            response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5', HTTP_AUTHORIZATION='Bearer s3cret')
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.5', HTTP_AUTHORIZATION='Bearer guess')
+            self.assertEqual(response.status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='203.0.113.5').status_code, 200)
+
+    def test_slow_request_log_lists_top_queries(self):
+        # No view count flush, its UPDATE could be among the slowest queries
+        with self.settings(SLOW_REQUEST_THRESHOLD=0, SLOW_REQUEST_TOP_QUERIES=2,
+                           VIEW_COUNT_FLUSH_INTERVAL=3600, VIEW_COUNT_FLUSH_THRESHOLD=10**6):
+            with self.assertLogs('myapp.metrics', 'WARNING') as logs:
+                self.client.get(reverse('view_report', args=[self.report.id]))
+        message = logs.output[0]
+        self.assertIn('(view_report)', message)
+        self.assertEqual(message.count(' ms  SELECT'), 2)
+
+
+def media_root(test):
+    """
+    Point MEDIA_ROOT at a temporary directory for the rest of the test
+    """
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+    settings = test.settings(MEDIA_ROOT=tmpdir.name)
+    settings.enable()
+    test.addCleanup(settings.disable)
+    return tmpdir.name
+
+
+class SeedScaleTests(TestCase):
+    def setUp(self):
+        media_root(self)
+
+    def test_generated_rows_are_consistent(self):
+        call_command(
+            'seed_scale', users=30, reports=200, votes=1500, comments=300, evidence=50, evidence_images=10,
+            donations=40, skip_search_index=True, stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(ScamReport.objects.count(), 200)
+        self.assertAlmostEqual(ReportVote.objects.count(), 1500, delta=150)
+
+        # Denormalized counters match what reputation.recompute_all() would write
+        reports = ScamReport.objects.annotate(
+            up=Count('votes', filter=Q(votes__vote_type='upvote')),
+            down=Count('votes', filter=Q(votes__vote_type='downvote')),
+        )
+        self.assertFalse(reports.exclude(upvotes=F('up'), downvotes=F('down')).exists())
+        scores = reputation.compute_scores()
+        for profile in UserProfile.objects.all():
+            self.assertEqual(profile.reputation_score, scores.get(profile.user_id, 0))
+        self.assertEqual(counters.reconcile(dry_run=True), [])
+        for report in ScamReport.objects.all():
+            self.assertEqual(report.domain, urlcanon.canonicalize_host(report.scam_url))
+            self.assertEqual(report.excerpt, make_excerpt(report.description))
+
+        # Evidence names real image blobs counting their references
+        self.assertAlmostEqual(ReportEvidence.objects.count(), 50, delta=10)
+        self.assertLessEqual(EvidenceBlob.objects.count(), 10)
+        self.assertEqual(storage.reconcile(dry_run=True), [])
+        for blob in EvidenceBlob.objects.all():
+            self.assertIsNotNone(blob.dhash)
+            with Image.open(storage.evidence_storage().path(blob.name)) as image:
+                self.assertEqual(image.size, (320, 240))
+
+
+class BenchmarkTests(TestCase):
+    def test_compare_flags_slower_metrics_only(self):
+        baseline = {'results': {
+            'a': {'p50_ms': 10.0, 'p90_ms': 12.0},
+            'b': {'p50_ms': 0.01, 'p90_ms': 0.01},
+        }}
+        results = {
+            'a': {'p50_ms': 10.5, 'p90_ms': 20.0},
+            # Over the tolerance but far below min_delta_ms
+            'b': {'p50_ms': 0.03, 'p90_ms': 0.03},
+            'new': {'p50_ms': 1.0, 'p90_ms': 1.0},
+        }
+        self.assertEqual(benchmarks.compare(results, baseline, tolerance=0.2), [('a', 'p90_ms', 12.0, 20.0)])
+
+    def test_run_against_stubbed_network(self):
+        media_root(self)
+        call_command('seed_scale', users=10, reports=50, votes=200, skip_search_index=True, stdout=StringIO())
+        names = ['urlcanon.split_url', 'utils.analyze_url', 'view:view_report']
+        with stub_network() as (_, whois_stub, _):
+            results = benchmarks.run(names, iterations=3, warmup=1)
+        self.assertEqual(list(results), names)
+        self.assertEqual(whois_stub.queries, 4)
+        for summary in results.values():
+            self.assertEqual(summary['samples'], 3)
+            self.assertLessEqual(summary['min_ms'], summary['p50_ms'])
+            self.assertLessEqual(summary['p50_ms'], summary['p90_ms'])
+        with self.assertRaises(KeyError):
+            benchmarks.run(['no-such-benchmark'])
+
+
+class NetworkStandInTests(SimpleTestCase):
+    def test_whois_server_answers_in_the_gtld_format(self):
+        with StubWhoisServer() as server:
+            whois = RemoteWhois(*server.address)
+            entry = whois('kargo-takip.com.tr')
+            expected = whois_record('kargo-takip.com.tr')
+            self.assertEqual(entry.creation_date, expected.creation_date)
+            self.assertEqual(entry.registrar, expected.registrar)
+            with self.assertRaises(Exception):
+                whois('nothing.invalid')
+        self.assertEqual(server.queries, 2)
+
+    def test_http_server_stands_in_for_ip_api(self):
+        with StubHTTPServer() as server:
+            location = IPAPIResolver(base_url=f'{server.url}/json/').lookup('81.2.3.4')
+        self.assertIn('(Stub Telecom)', location)
+
+
+class LoadTestTests(LiveServerTestCase):
+    def setUp(self):
+        # Seeded and uploaded evidence goes to a temporary MEDIA_ROOT, and
+        # views the server threads buffer die with the test
+        media_root(self)
+        counter = mock.patch('myapp.views.view_counter', ViewCounter())
+        counter.start()
+        self.addCleanup(counter.stop)
+
+    def test_journeys_against_live_server(self):
+        call_command('seed_scale', users=5, reports=20, votes=40, skip_search_index=True, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output = os.path.join(tmpdir, 'load.json')
+            call_command(
+                'run_load_test', url=self.live_server_url, users=2, duration=2, ramp_up=0, think_time=0,
+                accounts=2, mix='browse=2,submit_report=1,vote=1', output=output, stdout=StringIO(), stderr=StringIO()
+            )
+            with open(output) as f:
+                results = json.load(f)
+        routes = results['routes']
+        self.assertEqual(routes['all']['errors'], 0, routes)
+        for route in ('public_reports', 'view_report', 'login', 'submit_report', 'vote_report'):
+            self.assertGreater(routes[route]['requests'], 0, route)
+        self.assertTrue(ScamReport.objects.filter(reporter__username__startswith='loadtest-').exists())
@@ -0,0 +1,159 @@
+"""
+Thumbnails of evidence images.
+
+Every image blob gets a WebP and a JPEG copy per EVIDENCE_THUMBNAIL_WIDTHS
+width, stored next to it as cas/ab/cd/<sha256>.<width>w.<ext>, so a file
+shared by many reports is resized once. A newly stored blob is scheduled
+once its transaction commits: render() runs in a pool of
+EVIDENCE_THUMBNAIL_WORKERS processes (0 renders in the saving thread), see
+myapp.process_pool, and when it is done EvidenceBlob.thumbnails_at is set
+and the pages showing the file are invalidated. The report page uses the
+thumbnails once they exist and links the full file. backfill() renders the
+blobs stored before.
+
+render() only touches files, the pool processes never load Django models.
+"""
+import os
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .process_pool import BackgroundPool, process_pool
+
+# extension -> Pillow format, the first is served to browsers that accept it
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+
+
+def widths():
+    return tuple(getattr(settings, 'EVIDENCE_THUMBNAIL_WIDTHS', (320, 960)))
+
+
+def quality():
+    return getattr(settings, 'EVIDENCE_THUMBNAIL_QUALITY', 80)
+
+
+def thumbnail_name(name, width, ext):
+    return f'{os.path.splitext(name)[0]}.{width}w.{ext}'
+
+
+def thumbnail_names(name):
+    return [thumbnail_name(name, width, ext) for width in widths() for ext in FORMATS]
+
+
+def render(source, root, sizes, quality):
+    """
+    Write the thumbnails of the image at path `source` to
+    <root>.<width>w.<ext> for each width in `sizes`; an image narrower than
+    a width is not upscaled
+    """
+    with Image.open(source) as image:
+        # JPEGs decode straight at a fraction of their size
+        image.draft('RGB', (max(sizes), max(sizes)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+        for width in sorted(sizes, reverse=True):
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+            for ext, fmt in FORMATS.items():
+                frame = image
+                if fmt == 'JPEG' and image.mode == 'RGBA':
+                    frame = Image.new('RGB', image.size, 'white')
+                    frame.paste(image, mask=image.getchannel('A'))
+                path = f'{root}.{width}w.{ext}'
+                partial = f'{path}.{os.getpid()}.part'
+                frame.save(partial, fmt, quality=quality)
+                os.replace(partial, path)
+
+
+def _render_args(name):
+    from .storage import evidence_storage
+
+    path = evidence_storage().path(name)
+    return path, os.path.splitext(path)[0], widths(), quality()
+
+
+def _mark(names):
+    """
+    Record the thumbnails of `names` and stamp new fragment versions on the
+    reports showing them; thumbnails of blobs deleted meanwhile are removed
+    """
+    from .models import EvidenceBlob, ReportEvidence, ScamReport, new_fragment_version
+    from .storage import evidence_storage
+
+    with transaction.atomic():
+        EvidenceBlob.objects.filter(name__in=names).update(thumbnails_at=timezone.now())
+        ScamReport.objects.filter(
+            id__in=ReportEvidence.objects.filter(file__in=names).values('report')
+        ).update(fragment_version=new_fragment_version())
+    stored = set(EvidenceBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    for name in set(names) - stored:
+        evidence_storage().delete_thumbnails(name)
+
+
+_background = BackgroundPool('EVIDENCE_THUMBNAIL_WORKERS', 2)
+
+
+def schedule(name):
+    """
+    Render the thumbnails of the blob `name` once the current transaction
+    commits
+    """
+    _background.run_after_commit(
+        render, _render_args(name), lambda _: _mark([name]), f'Rendering the thumbnails of {name}'
+    )
+
+
+def sources(name):
+    """
+    {ext: srcset} of the thumbnails of `name` and 'src', the smallest JPEG
+    """
+    from .storage import evidence_storage
+
+    storage = evidence_storage()
+    srcsets = {
+        ext: ', '.join(f'{storage.url(thumbnail_name(name, width, ext))} {width}w' for width in widths())
+        for ext in FORMATS
+    }
+    srcsets['src'] = storage.url(thumbnail_name(name, min(widths()), 'jpg'))
+    return srcsets
+
+
+def backfill(batch_size=200, workers=None, progress=None):
+    """
+    Render the thumbnails of every image blob that has none, batch_size at
+    a time on `workers` processes. Returns (rendered, failed [(name, error)]);
+    progress(rendered, failed) is called after each batch.
+    """
+    from .models import EvidenceBlob
+    from .perceptual import is_image
+
+    rendered = 0
+    failed = []
+    after = 0
+    with process_pool(workers or os.cpu_count() or 1) as executor:
+        while True:
+            batch = list(
+                EvidenceBlob.objects.filter(thumbnails_at__isnull=True, id__gt=after)
+                .order_by('id').values_list('id', 'name')[:batch_size]
+            )
+            if not batch:
+                break
+            after = batch[-1][0]
+            names = [name for _, name in batch if is_image(name)]
+            futures = {name: executor.submit(render, *_render_args(name)) for name in names}
+            done = []
+            for name, future in futures.items():
+                try:
+                    future.result()
+                    done.append(name)
+                except Exception as e:
+                    failed.append((name, str(e)))
+            if done:
+                _mark(done)
+                rendered += len(done)
+            if progress:
+                progress(rendered, failed)
+    return rendered, failed
@@ -0,0 +1,320 @@
+"""
+Chunked, resumable evidence uploads.
+
+start() opens an UploadSession once the declared size and file type are
+accepted. append() streams one chunk of a request body into the session's
+part file under EVIDENCE_UPLOAD_DIR at the session offset, hashing it as it
+is written; a client that lost its connection asks for the offset and
+carries on from there, and the bytes of a chunk cut short still count.
+finish() checks the SHA-256 and moves the part file into the evidence
+storage, so the file is never read back.
+
+A request claims the session before writing, with a conditional UPDATE
+like the analysis jobs, so the bytes on disk are always the ones hashed; a
+writer that dies leaves the claim to expire after
+EVIDENCE_UPLOAD_WRITE_TIMEOUT. Hash objects cannot be stored, so every
+process keeps the hashers of the sessions it served last; a process that
+missed chunks (another worker, a restart) first hashes only the bytes it
+has not seen from the part file.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ReportEvidence, ScamEvidence, UploadSession
+from .storage import DigestMismatch, HashedFile
+
+READ_SIZE = 64 * 1024
+
+# How long before its claim expires a writer stops, so it never overlaps a
+# request taking the session over
+WRITE_MARGIN = timedelta(seconds=5)
+
+# extension -> (offset, signature) pairs, any of which identifies the type
+SIGNATURES = {
+    'jpg': ((0, b'\xff\xd8\xff'),),
+    'jpeg': ((0, b'\xff\xd8\xff'),),
+    'png': ((0, b'\x89PNG\r\n\x1a\n'),),
+    'gif': ((0, b'GIF87a'), (0, b'GIF89a')),
+    'webp': ((8, b'WEBP'),),
+    'pdf': ((0, b'%PDF-'),),
+    'mp4': ((4, b'ftyp'),),
+    'mov': ((4, b'ftyp'), (4, b'moov'), (4, b'wide'), (4, b'mdat')),
+    'webm': ((0, b'\x1a\x45\xdf\xa3'),),
+}
+
+# Bytes of the first chunk needed to recognise any of the signatures
+SNIFF_SIZE = max(offset + len(signature) for signatures in SIGNATURES.values() for offset, signature in signatures)
+
+
+class UploadError(Exception):
+    """
+    A rejected upload request; offset is where the client should resume
+    """
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def max_size():
+    return getattr(settings, 'EVIDENCE_UPLOAD_MAX_SIZE', 512 * 1024 * 1024)
+
+
+def max_chunk_size():
+    return getattr(settings, 'EVIDENCE_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def allowed_types():
+    return getattr(settings, 'EVIDENCE_UPLOAD_TYPES', tuple(SIGNATURES))
+
+
+def write_timeout():
+    return timedelta(seconds=getattr(settings, 'EVIDENCE_UPLOAD_WRITE_TIMEOUT', 300))
+
+
+def upload_dir():
+    return getattr(settings, 'EVIDENCE_UPLOAD_DIR', os.path.join(settings.MEDIA_ROOT, 'uploads'))
+
+
+def part_path(upload):
+    return os.path.join(upload_dir(), f'{upload.id.hex}.part')
+
+
+def matches_type(file_type, head):
+    return any(head[offset:offset + len(signature)] == signature for offset, signature in SIGNATURES.get(file_type, ()))
+
+
+class HasherCache:
+    """
+    SHA-256 state of the sessions this process served last, by session id
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self._lock = threading.Lock()
+        self._hashers = OrderedDict()
+
+    def get(self, upload, offset):
+        """
+        A hasher of the first `offset` bytes of the part file, caught up from
+        disk when this process did not see all of them
+        """
+        with self._lock:
+            start, hasher = self._hashers.get(upload.id, (0, None))
+        if hasher is None or start > offset:
+            start, hasher = 0, hashlib.sha256()
+        # The cached one must not move before the chunk is accepted
+        hasher = hasher.copy()
+        if start < offset:
+            with open(part_path(upload), 'rb') as f:
+                f.seek(start)
+                remaining = offset - start
+                while remaining:
+                    data = f.read(min(READ_SIZE, remaining))
+                    if not data:
+                        raise UploadError('The received data is missing, restart the upload', 410)
+                    hasher.update(data)
+                    remaining -= len(data)
+        return hasher
+
+    def put(self, upload_id, offset, hasher):
+        with self._lock:
+            self._hashers[upload_id] = (offset, hasher)
+            self._hashers.move_to_end(upload_id)
+            while len(self._hashers) > self.size:
+                self._hashers.popitem(last=False)
+
+    def discard(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+
+
+hashers = HasherCache()
+
+
+def start(user, report, filename, size, target='evidence', title='', description=''):
+    filename = os.path.basename(str(filename or '')).strip()
+    file_type = os.path.splitext(filename)[1][1:].lower()
+    if file_type not in allowed_types():
+        raise UploadError(f'Accepted file types: {", ".join(allowed_types())}')
+    if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+        raise UploadError('The file size must be a positive number of bytes')
+    if size > max_size():
+        raise UploadError(f'Files are limited to {max_size()} bytes', 413)
+    if target not in dict(UploadSession.TARGET_CHOICES):
+        raise UploadError('Unknown upload target')
+    if target == 'scam_evidence' and report.reporter_id != user.id and not user.is_staff:
+        raise UploadError('Only the reporter can attach evidence to the report itself', 403)
+
+    upload = UploadSession.objects.create(
+        user=user, report=report, target=target, filename=filename, file_type=file_type,
+        title=(title or filename)[:200], description=description or '', size=size,
+    )
+    os.makedirs(upload_dir(), exist_ok=True)
+    open(part_path(upload), 'wb').close()
+    return upload
+
+
+def append(upload, offset, stream, length):
+    """
+    Write a chunk of `length` bytes read from `stream` at `offset`, returns
+    the new offset. Of two requests sending a chunk at once only the one
+    that claims the session writes it.
+    """
+    if upload.completed_at:
+        raise UploadError('The upload is already finished', 409)
+    if offset != upload.received:
+        raise UploadError('The chunk does not start at the upload offset', 409, upload.received)
+    if length <= 0:
+        raise UploadError('Empty chunk', offset=upload.received)
+    if length > max_chunk_size():
+        raise UploadError(f'Chunks are limited to {max_chunk_size()} bytes', 413, upload.received)
+    if offset + length > upload.size:
+        raise UploadError('The chunk goes past the declared file size', offset=upload.received)
+
+    now = timezone.now()
+    deadline = now + write_timeout()
+    claimed = UploadSession.objects.filter(
+        Q(writing_until__isnull=True) | Q(writing_until__lt=now),
+        pk=upload.pk, received=offset, completed_at__isnull=True,
+    ).update(writing_until=deadline)
+    if not claimed:
+        upload.refresh_from_db(fields=['received'])
+        raise UploadError('Another request is writing this upload', 409, upload.received)
+
+    written = 0
+    try:
+        hasher = hashers.get(upload, offset)
+        with open(part_path(upload), 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                try:
+                    data = stream.read(min(READ_SIZE, length - written))
+                except OSError:
+                    # The client went away, keep what arrived
+                    break
+                # Past the deadline another request may have claimed the session
+                if not data or timezone.now() >= deadline - WRITE_MARGIN:
+                    break
+                if offset + written < SNIFF_SIZE:
+                    _check_type(upload, f, offset + written, data)
+                f.write(data)
+                hasher.update(data)
+                written += len(data)
+    except BaseException:
+        UploadSession.objects.filter(pk=upload.pk, writing_until=deadline).update(writing_until=None)
+        raise
+
+    new_offset = offset + written
+    if not UploadSession.objects.filter(pk=upload.pk, received=offset, writing_until=deadline).update(
+        received=new_offset, writing_until=None, updated_at=timezone.now()
+    ):
+        upload.refresh_from_db(fields=['received'])
+        raise UploadError('Another request took the upload over', 409, upload.received)
+    if written:
+        hashers.put(upload.id, new_offset, hasher)
+        upload.received = new_offset
+    if written < length:
+        raise UploadError('The chunk ended early', 400, new_offset)
+    return new_offset
+
+
+def _check_type(upload, f, position, data):
+    # The head of the file so far, then the bytes about to be written
+    f.seek(0)
+    head = f.read(position)[:SNIFF_SIZE] + data[:SNIFF_SIZE - position]
+    f.seek(position)
+    if len(head) >= min(SNIFF_SIZE, upload.size) and not matches_type(upload.file_type, head):
+        raise UploadError(f'The file content is not {upload.file_type.upper()}', 415, upload.received)
+
+
+class ReceivedFile(HashedFile):
+    """
+    A finished part file, hashed as its chunks were written; the evidence
+    storage moves it into place through temporary_file_path() instead of
+    reading it
+    """
+
+    def __init__(self, path, name, hasher, sha256=None):
+        super().__init__(open(path, 'rb'), name, hasher, sha256)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def finish(upload, sha256=''):
+    """
+    Check the hash and attach the file to new evidence, which is returned
+    """
+    if upload.completed_at:
+        raise UploadError('The upload is already finished', 409)
+    if upload.received != upload.size:
+        raise UploadError('The upload is incomplete', 409, upload.received)
+    hasher = hashers.get(upload, upload.size)
+    digest = hasher.hexdigest()
+
+    with transaction.atomic():
+        if not UploadSession.objects.filter(pk=upload.pk, completed_at__isnull=True).update(
+            completed_at=timezone.now(), sha256=digest
+        ):
+            raise UploadError('The upload is already finished', 409)
+        try:
+            with ReceivedFile(part_path(upload), upload.filename, hasher, sha256 or None) as content:
+                evidence = _attach(upload, content)
+        except DigestMismatch:
+            raise UploadError('The SHA-256 of the received file does not match', 422, upload.received)
+    hashers.discard(upload.id)
+    # Left over when the content was already stored
+    _remove_part(upload)
+    upload.refresh_from_db()
+    return evidence
+
+
+def _attach(upload, content):
+    if upload.target == 'scam_evidence':
+        evidence = ScamEvidence(report=upload.report, description=upload.description, file_type=upload.file_type)
+    else:
+        evidence = ReportEvidence(
+            report=upload.report, user=upload.user, title=upload.title, description=upload.description
+        )
+    evidence.file.save(upload.filename, content)
+    return evidence
+
+
+def abort(upload):
+    hashers.discard(upload.id)
+    if not upload.completed_at:
+        _remove_part(upload)
+    upload.delete()
+
+
+def _remove_part(upload):
+    try:
+        os.remove(part_path(upload))
+    except FileNotFoundError:
+        pass
+
+
+def purge_stale(max_age=None):
+    """
+    Delete unfinished uploads untouched for max_age (EVIDENCE_UPLOAD_EXPIRY
+    by default) and their part files, returns how many
+    """
+    if max_age is None:
+        max_age = timedelta(seconds=getattr(settings, 'EVIDENCE_UPLOAD_EXPIRY', 24 * 60 * 60))
+    stale = UploadSession.objects.filter(completed_at__isnull=True, updated_at__lt=timezone.now() - max_age)
+    count = 0
+    for upload in stale.iterator():
+        abort(upload)
+        count += 1
+    return count
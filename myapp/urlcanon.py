@@ -0,0 +1,213 @@
+"""
+URL canonicalization and registrable-domain extraction.
+
+canonicalize_host() reduces a URL or host name to a lower-case IDNA host
+without scheme, userinfo, port, trailing dot or leading www. labels.
+registrable_domain() then finds the domain a registrant controls (the
+public suffix plus one label, 'shop.example.co.uk' -> 'example.co.uk')
+using the Public Suffix List shipped in myapp/data, compiled once per
+process into a trie of labels so no network access is needed.
+"""
+import ipaddress
+import logging
+import re
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SUFFIX_LIST = Path(__file__).resolve().parent / 'data' / 'public_suffix_list.dat'
+
+# scheme://userinfo@host:port followed by the path; anything unusual (IPv6
+# literals, several @, backslashes) goes through urlsplit instead. Much
+# faster than urlsplit for the bulk URL checks.
+_SIMPLE_URL_RE = re.compile(r'(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//(?:[^/?#@\\\[\]]*@)?([^/?#:@\\\[\]]*)(?::\d*)?(?:[/?#]|$)')
+
+# Marks a node that ends a rule; labels are never empty so it can't clash
+_RULE = ''
+_EXCEPTION = '!'
+
+
+def _to_ascii(label):
+    if label.isascii():
+        return label
+    try:
+        return label.encode('idna').decode('ascii')
+    except UnicodeError:
+        return label
+
+
+class PublicSuffixTrie:
+    """
+    Public suffix rules stored as nested dicts keyed by label, TLD first
+    """
+
+    def __init__(self, rules=()):
+        self.root = {}
+        for rule in rules:
+            self.add(rule)
+
+    @classmethod
+    def from_file(cls, path, include_private=True):
+        rules = []
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('// ===BEGIN PRIVATE DOMAINS===') and not include_private:
+                    break
+                if not line or line.startswith('//'):
+                    continue
+                rules.append(line.split()[0])
+        return cls(rules)
+
+    def add(self, rule):
+        exception = rule.startswith('!')
+        node = self.root
+        for label in reversed(rule.lstrip('!').lower().split('.')):
+            node = node.setdefault(label if label == '*' else _to_ascii(label), {})
+        node[_RULE] = _EXCEPTION if exception else True
+
+    def suffix_length(self, labels):
+        """
+        Number of trailing labels of a host (given TLD first) that form its
+        public suffix. Unlisted TLDs count as a one-label suffix.
+        """
+        length = 1
+        node = self.root
+        for depth, label in enumerate(labels, 1):
+            child = node.get(label)
+            wildcard = node.get('*')
+            if child is not None and child.get(_RULE) == _EXCEPTION:
+                # '!city.kawasaki.jp' makes kawasaki.jp the suffix
+                return depth - 1
+            if child is not None and child.get(_RULE) or wildcard is not None and wildcard.get(_RULE):
+                length = depth
+            node = child if child is not None else wildcard
+            if node is None:
+                break
+        return length
+
+
+_trie = None
+_trie_lock = threading.Lock()
+
+
+def get_trie():
+    global _trie
+    if _trie is None:
+        with _trie_lock:
+            if _trie is None:
+                path = getattr(settings, 'PUBLIC_SUFFIX_LIST', None) or DEFAULT_SUFFIX_LIST
+                try:
+                    _trie = PublicSuffixTrie.from_file(
+                        path, include_private=getattr(settings, 'PUBLIC_SUFFIX_INCLUDE_PRIVATE', True)
+                    )
+                except OSError as e:
+                    logger.warning('Could not load the public suffix list %s: %s', path, e)
+                    _trie = PublicSuffixTrie()
+    return _trie
+
+
+def _ip(host):
+    # Cheap pre-check, parsing fails slowly: IPv4 ends in a digit, IPv6 has colons
+    if ':' not in host and not host[-1:].isdigit():
+        return None
+    try:
+        return ipaddress.ip_address(host)
+    except ValueError:
+        return None
+
+
+def canonicalize_host(value, strip_www=True):
+    """
+    Return the canonical host of a URL or host name, '' if there is none;
+    with strip_www=False the www. labels are kept, giving the name to resolve
+    """
+    if not value:
+        return ''
+    value = value.strip()
+    if '://' not in value:
+        value = '//' + value
+    match = _SIMPLE_URL_RE.match(value)
+    if match:
+        host = match.group(1).lower()
+    else:
+        try:
+            host = urlsplit(value).hostname or ''
+        except ValueError:
+            return ''
+    host = host.rstrip('.')
+    address = _ip(host)
+    if address is not None:
+        return address.compressed
+    if not host.isascii() or '..' in host:
+        host = '.'.join(_to_ascii(label) for label in host.split('.') if label)
+    # Drop www. labels, but never down to a bare public suffix
+    while strip_www and host.startswith('www.') and not is_public_suffix(host[4:]):
+        host = host[4:]
+    return host
+
+
+def is_public_suffix(host):
+    """
+    True for hosts such as 'com.tr' or 'github.io' that nobody registers
+    """
+    labels = host.split('.')
+    return get_trie().suffix_length(labels[::-1]) >= len(labels)
+
+
+def registrable_domain(host):
+    """
+    Return the registrable domain of a canonical host. IP addresses and hosts
+    that are themselves public suffixes are returned unchanged.
+    """
+    if not host or _ip(host) is not None:
+        return host or ''
+    labels = host.split('.')
+    length = get_trie().suffix_length(labels[::-1])
+    if length >= len(labels):
+        return host
+    return '.'.join(labels[-(length + 1):])
+
+
+def split_url(url):
+    """
+    Return (host, registrable domain) for a URL
+    """
+    host = canonicalize_host(url)
+    return host, registrable_domain(host)
+
+
+def domain_key(host):
+    """
+    Index key for a host with its labels reversed, 'pay.example.com' ->
+    'com.example.pay', so a host and all its subdomains sort together and
+    subdomain lookups become a range seek
+    """
+    if not host or _ip(host) is not None:
+        return host or ''
+    return '.'.join(reversed(host.split('.')))
+
+
+def subdomain_range(host):
+    """
+    (lower, upper) bounds, both exclusive, of the domain_key of every
+    subdomain of host; '/' is the character after '.'
+    """
+    key = domain_key(host)
+    return f'{key}.', f'{key}/'
+
+
+def parent_domains(host):
+    """
+    The host and each of its parents down to the registrable domain,
+    'a.b.example.com' -> ['a.b.example.com', 'b.example.com', 'example.com']
+    """
+    domain = registrable_domain(host)
+    if not host or host == domain:
+        return [host] if host else []
+    labels = host[:-len(domain) - 1].split('.')
+    return ['.'.join(labels[i:] + [domain]) for i in range(len(labels))] + [domain]
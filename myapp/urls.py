@@ -10,8 +10,18 @@ urlpatterns = [
     path('my-reports/', views.my_reports, name='my_reports'),
     path('public-reports/', views.public_reports, name='public_reports'),
     path('scam-websites/', views.scam_websites, name='scam_websites'),
+    path('api/reports/', views.reports_api, name='reports_api'),
+    path('api/lookup/', views.domain_lookup, name='domain_lookup'),
+    path('api/check-urls/', views.check_urls, name='check_urls'),
+    path('api/already-reported/', views.already_reported, name='already_reported'),
+    path('api/reports/<int:report_id>/uploads/', views.start_upload, name='start_upload'),
+    path('api/uploads/<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('api/uploads/<uuid:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
+    path('api/uploads/<uuid:upload_id>/finish/', views.finish_upload, name='finish_upload'),
+    path('metrics/', views.prometheus_metrics, name='metrics'),
     path('profile/', views.profile, name='profile'),
     path('add-comment/<int:report_id>/', views.add_comment, name='add_comment'),
+    path('vote-report/<int:report_id>/', views.vote_report, name='vote_report'),
     path('add-evidence/<int:report_id>/', views.add_evidence, name='add_evidence'),
     path('verify-comment/<int:comment_id>/', views.verify_comment, name='verify_comment'),
     path('verify-evidence/<int:evidence_id>/', views.verify_evidence, name='verify_evidence'),
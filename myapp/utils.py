@@ -1,8 +1,5 @@
 import requests
 from bs4 import BeautifulSoup
-from PIL import Image
-from PIL.ExifTags import TAGS
-import os
 from datetime import datetime
 import json
 import dns.resolver
@@ -10,11 +7,103 @@ import dns.name
 import dns.message
 import dns.query
 import dns.rdatatype
-from urllib.parse import urlparse
+import dns.exception
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, TimeoutError as FutureTimeoutError
 import whois
+from django.conf import settings
+from django.db import connections
+from . import domain_cache, metadata, urlcanon
 
-def get_domain_info(domain):
+def _as_list(value):
+    if value is None or isinstance(value, str):
+        return value
+    return [str(item) for item in value]
+
+def _make_resolver():
+    """
+    Build a resolver honouring the DNS_NAMESERVERS / DNS_PORT / DNS_TIMEOUT settings
+    """
+    nameservers = getattr(settings, 'DNS_NAMESERVERS', None)
+    resolver = dns.resolver.Resolver(configure=not nameservers)
+    if nameservers:
+        resolver.nameservers = list(nameservers)
+    resolver.port = getattr(settings, 'DNS_PORT', 53)
+    resolver.timeout = getattr(settings, 'DNS_TIMEOUT', 5)
+    resolver.lifetime = getattr(settings, 'DNS_TIMEOUT', 5)
+    return resolver
+
+def _concurrent_dns():
+    return getattr(settings, 'DNS_CONCURRENT_RESOLUTION', True)
+
+_executors = {}
+_executor_lock = threading.Lock()
+
+def _pool(name, setting, default):
+    with _executor_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=getattr(settings, setting, default),
+                thread_name_prefix=f'{name}-lookup'
+            )
+        return _executors[name]
+
+def _get_executor():
+    return _pool('dns', 'DNS_MAX_WORKERS', 16)
+
+def _get_whois_executor():
+    """
+    WHOIS queries ignore the deadline and may hold a thread for their full
+    timeout, so they get a pool of their own and cannot starve DNS queries
+    """
+    return _pool('whois', 'WHOIS_MAX_WORKERS', 8)
+
+def _remaining(deadline):
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0)
+
+def _resolve_one(resolver, domain, record_type, deadline):
+    lifetime = _remaining(deadline)
+    if lifetime is not None and lifetime <= 0:
+        raise dns.exception.Timeout()
+    answers = resolver.resolve(domain, record_type, lifetime=lifetime)
+    return [str(rdata) for rdata in answers]
+
+def resolve_records(domain, record_types, deadline=None):
+    """
+    Resolve several record types for a domain at once.
+
+    Returns (answers, errors, pending): answers maps each completed record
+    type to its records, errors maps failed record types to the exception,
+    and pending lists the record types still unanswered at the deadline
+    (a time.monotonic() value).
+    """
+    resolver = _make_resolver()
+    executor = _get_executor()
+    futures = {
+        executor.submit(_resolve_one, resolver, domain, record_type, deadline): record_type
+        for record_type in record_types
+    }
+    done, not_done = wait(futures, timeout=_remaining(deadline))
+
+    answers = {}
+    errors = {}
+    for future in done:
+        record_type = futures[future]
+        try:
+            answers[record_type] = future.result()
+        except Exception as e:
+            errors[record_type] = e
+    pending = [record_type for record_type in record_types
+               if record_type not in answers and record_type not in errors]
+    for future in not_done:
+        future.cancel()
+    return answers, errors, pending
+
+def get_domain_info(domain, deadline=None):
     """
     Get domain information using multiple methods
     """
@@ -35,25 +124,33 @@ def get_domain_info(domain):
                 'registrar': w.registrar,
                 'creation_date': creation_date.strftime('%Y-%m-%d') if creation_date else None,
                 'expiration_date': expiration_date.strftime('%Y-%m-%d') if expiration_date else None,
-                'name_servers': w.name_servers if hasattr(w, 'name_servers') else None
+                'name_servers': _as_list(w.name_servers) if hasattr(w, 'name_servers') else None,
+                'country': w.get('country')
             }
     except Exception as e:
         info['error'] = f'WHOIS lookup failed: {str(e)}'
         
         # Try DNS lookup as fallback
         try:
-            # Create a new resolver
-            resolver = dns.resolver.Resolver()
-            resolver.timeout = 5
-            resolver.lifetime = 5
-            
-            # Get NS records
-            ns_records = resolver.resolve(domain, 'NS')
-            nameservers = [str(ns) for ns in ns_records]
-            
-            # Get SOA record
-            soa_records = resolver.resolve(domain, 'SOA')
-            soa = str(soa_records[0]).split()
+            if _concurrent_dns():
+                answers, errors, pending = resolve_records(domain, ['NS', 'SOA'], deadline)
+                if pending:
+                    raise dns.exception.Timeout()
+                for record_type in ('NS', 'SOA'):
+                    if record_type in errors:
+                        raise errors[record_type]
+                nameservers = answers['NS']
+                soa = answers['SOA'][0].split()
+            else:
+                resolver = _make_resolver()
+
+                # Get NS records
+                ns_records = resolver.resolve(domain, 'NS')
+                nameservers = [str(ns) for ns in ns_records]
+
+                # Get SOA record
+                soa_records = resolver.resolve(domain, 'SOA')
+                soa = str(soa_records[0]).split()
             
             info['dns_info'] = {
                 'nameservers': nameservers,
@@ -75,10 +172,150 @@ def get_domain_info(domain):
     
     return info
 
-def analyze_url(url):
+DNS_RECORD_TYPES = ['A', 'MX', 'NS', 'TXT']
+
+def lookup_dns_records(domain, deadline=None):
+    """
+    Resolve the record types in DNS_RECORD_TYPES for a domain
+
+    In concurrent mode all queries are issued at once; record types still
+    unanswered at the deadline come back empty and the result is marked
+    partial.
+    """
+    result = {
+        'records': {},
+        'warnings': [],
+        'partial': False
+    }
+
+    if _concurrent_dns():
+        answers, errors, pending = resolve_records(domain, DNS_RECORD_TYPES, deadline)
+        for record_type in DNS_RECORD_TYPES:
+            result['records'][record_type] = answers.get(record_type, [])
+        if any(isinstance(e, dns.resolver.NXDOMAIN) for e in errors.values()):
+            result['warnings'].append('Domain does not exist')
+        if pending:
+            result['partial'] = True
+            result['warnings'].append(
+                f'DNS lookup timed out for {", ".join(pending)}, results are partial'
+            )
+        return result
+
+    try:
+        resolver = _make_resolver()
+
+        for record_type in DNS_RECORD_TYPES:
+            try:
+                answers = resolver.resolve(domain, record_type)
+                result['records'][record_type] = [str(rdata) for rdata in answers]
+            except dns.resolver.NXDOMAIN:
+                result['records'][record_type] = []
+                result['warnings'].append('Domain does not exist')
+            except Exception:
+                result['records'][record_type] = []
+    except Exception as e:
+        result['warnings'].append(f'DNS lookup failed: {str(e)}')
+
+    return result
+
+def lookup_ip_address(domain):
+    try:
+        socket.setdefaulttimeout(5)
+        return {'ip_address': socket.gethostbyname(domain), 'error': None}
+    except Exception as e:
+        return {'ip_address': None, 'error': f'Could not resolve IP address: {str(e)}'}
+
+def ip_from_dns_records(dns_result):
+    """
+    Take the IP address from an A answer instead of resolving the name again
+    """
+    a_records = dns_result['records'].get('A')
+    if a_records:
+        return {'ip_address': a_records[0], 'error': None}
+    if dns_result.get('partial'):
+        return {'ip_address': None, 'error': 'Could not resolve IP address: lookup timed out'}
+    return {'ip_address': None, 'error': 'Could not resolve IP address: no A records'}
+
+def _is_negative_whois(info):
+    return not info['whois_info']
+
+def _is_negative_dns(result):
+    return not result['records'].get('A') or result.get('partial', False)
+
+def _is_negative_ip(result):
+    return not result['ip_address']
+
+def _lookup(domain, kind, fetch, is_negative, use_cache):
+    if not use_cache:
+        return fetch(domain)
+    return domain_cache.get_or_fetch(domain, kind, fetch, is_negative)
+
+def _fetch_whois_in_background(domain, deadline, use_cache):
+    """
+    Run in the WHOIS pool; a WHOIS answer arriving after the request's
+    deadline still lands in the cache for the next request.
+    """
+    try:
+        info = get_domain_info(domain, deadline)
+        if use_cache:
+            domain_cache.store(domain, 'whois', info, negative=_is_negative_whois(info))
+        return info
+    finally:
+        if use_cache:
+            connections.close_all()
+
+def _gather_concurrently(domain, registrable, use_cache, deadline):
+    cached = {}
+    if use_cache:
+        cached['whois'] = domain_cache.get_cached(registrable, 'whois')
+        for kind in ('dns', 'ip'):
+            cached[kind] = domain_cache.get_cached(domain, kind)
+
+    whois_future = None
+    domain_info = cached.get('whois')
+    if domain_info is None:
+        whois_future = _get_whois_executor().submit(_fetch_whois_in_background, registrable, deadline, use_cache)
+
+    dns_result = cached.get('dns')
+    if dns_result is None:
+        dns_result = lookup_dns_records(domain, deadline)
+        if use_cache and not dns_result.get('partial'):
+            domain_cache.store(domain, 'dns', dns_result, negative=_is_negative_dns(dns_result))
+
+    ip_result = cached.get('ip')
+    if ip_result is None:
+        ip_result = ip_from_dns_records(dns_result)
+        if use_cache and not dns_result.get('partial'):
+            domain_cache.store(domain, 'ip', ip_result, negative=_is_negative_ip(ip_result))
+
+    if whois_future is not None:
+        try:
+            domain_info = whois_future.result(timeout=_remaining(deadline))
+        except FutureTimeoutError:
+            domain_info = {
+                'whois_info': None,
+                'dns_info': None,
+                'error': 'WHOIS lookup timed out, results are partial',
+                'partial': True
+            }
+    return domain_info, dns_result, ip_result
+
+def _gather_sequentially(domain, registrable, use_cache):
+    domain_info = _lookup(registrable, 'whois', get_domain_info, _is_negative_whois, use_cache)
+    dns_result = _lookup(domain, 'dns', lookup_dns_records, _is_negative_dns, use_cache)
+    ip_result = _lookup(domain, 'ip', lookup_ip_address, _is_negative_ip, use_cache)
+    return domain_info, dns_result, ip_result
+
+def analyze_url(url, use_cache=True):
     """
     Analyze a URL for potential scam indicators
     Returns a dictionary with analysis results
+
+    WHOIS, DNS and IP lookups are served from the shared domain cache
+    unless use_cache is False. With DNS_CONCURRENT_RESOLUTION enabled all
+    lookups run at once and the analysis returns partial results once
+    ANALYZE_URL_DEADLINE seconds have passed. 'partial' is set when a
+    lookup timed out or the analysis failed midway, so it is worth retrying.
     """
     results = {
         'domain_age': None,
@@ -87,21 +324,28 @@ def analyze_url(url):
         'ip_address': None,
         'is_valid': False,
         'risk_level': 'unknown',
-        'warnings': []
+        'warnings': [],
+        'partial': False
     }
     
     try:
-        # Parse URL
-        parsed_url = urlparse(url)
-        domain = parsed_url.netloc
+        # WHOIS is queried for the registrable domain, DNS for the host as
+        # written; the canonical host without www. is only used for indexing
+        domain = urlcanon.canonicalize_host(url, strip_www=False)
+        registrable = urlcanon.registrable_domain(domain)
         
         if not domain:
             results['warnings'].append('Invalid URL format')
             return results
+
+        if _concurrent_dns():
+            deadline = time.monotonic() + getattr(settings, 'ANALYZE_URL_DEADLINE', 10)
+            domain_info, dns_result, ip_result = _gather_concurrently(domain, registrable, use_cache, deadline)
+        else:
+            domain_info, dns_result, ip_result = _gather_sequentially(domain, registrable, use_cache)
+        results['partial'] = bool(dns_result.get('partial') or domain_info.get('partial'))
             
-        # Get domain information
-        domain_info = get_domain_info(domain)
-        
+        # Domain information
         if domain_info['whois_info']:
             results['whois_info'] = domain_info['whois_info']
             
@@ -117,46 +361,22 @@ def analyze_url(url):
                 elif domain_age < 90:
                     results['warnings'].append('Domain is less than 90 days old')
         
-        elif domain_info['dns_info']:
-            results['dns_records'] = domain_info['dns_info']
-        
         if domain_info['error']:
             results['warnings'].append(domain_info['error'])
             
         # DNS records
-        try:
-            dns_records = {}
-            resolver = dns.resolver.Resolver()
-            resolver.timeout = 5
-            resolver.lifetime = 5
-            
-            for record_type in ['A', 'MX', 'NS', 'TXT']:
-                try:
-                    answers = resolver.resolve(domain, record_type)
-                    dns_records[record_type] = [str(rdata) for rdata in answers]
-                except dns.resolver.NXDOMAIN:
-                    dns_records[record_type] = []
-                    results['warnings'].append(f'Domain does not exist')
-                except Exception:
-                    dns_records[record_type] = []
-                    
-            results['dns_records'] = dns_records
-            
-            if not dns_records.get('A'):
-                results['warnings'].append('No A records found')
-            if not dns_records.get('MX'):
-                results['warnings'].append('No MX records found')
-                
-        except Exception as e:
-            results['warnings'].append(f'DNS lookup failed: {str(e)}')
+        results['dns_records'] = dns_result['records']
+        results['warnings'].extend(dns_result['warnings'])
+
+        if not dns_result['records'].get('A'):
+            results['warnings'].append('No A records found')
+        if not dns_result['records'].get('MX'):
+            results['warnings'].append('No MX records found')
             
         # IP address
-        try:
-            socket.setdefaulttimeout(5)
-            ip = socket.gethostbyname(domain)
-            results['ip_address'] = ip
-        except Exception as e:
-            results['warnings'].append(f'Could not resolve IP address: {str(e)}')
+        results['ip_address'] = ip_result['ip_address']
+        if ip_result['error']:
+            results['warnings'].append(ip_result['error'])
             
         # Risk level assessment
         risk_score = 0
@@ -182,91 +402,64 @@ def analyze_url(url):
         
     except Exception as e:
         results['warnings'].append(f'Analysis failed: {str(e)}')
+        results['partial'] = True
         
     return results
 
+BLACKLIST_SERVICES = [
+    'https://www.virustotal.com/vtapi/v2/url/report',
+    'https://www.google.com/safebrowsing/diagnostic?site='
+]
+
 def check_blacklist(url):
-    blacklist_services = [
-        'https://www.virustotal.com/vtapi/v2/url/report',
-        'https://www.google.com/safebrowsing/diagnostic?site='
-    ]
-    
+    """
+    Look the URL up in BLACKLIST_SERVICES; 'errors' lists the services
+    that could not be queried
+    """
     is_blacklisted = False
     details = []
+    errors = []
     
-    for service in blacklist_services:
+    for service in BLACKLIST_SERVICES:
         try:
-            response = requests.get(f"{service}{url}")
+            response = requests.get(f"{service}{url}", timeout=10)
             if response.status_code == 200:
                 if "malicious" in response.text.lower() or "phishing" in response.text.lower():
                     is_blacklisted = True
                     details.append(f"Found in {service}")
-        except:
-            continue
+        except Exception as e:
+            errors.append(f"{service}: {str(e)}")
     
     return {
         'is_blacklisted': is_blacklisted,
-        'details': details
+        'details': details,
+        'errors': errors
     }
 
 def extract_metadata(file_path):
-    metadata = {}
-    
-    file_type = os.path.splitext(file_path)[1][1:].lower()
-    
-    if file_type in ['jpg', 'jpeg', 'png', 'tiff']:
-
-        try:
-            image = Image.open(file_path)
-            exif_data = image._getexif()
-            if exif_data:
-                for tag_id in exif_data:
-                    tag = TAGS.get(tag_id, tag_id)
-                    data = exif_data.get(tag_id)
-                    if isinstance(data, bytes):
-                        data = data.decode()
-                    metadata[tag] = data
-        except Exception as e:
-            metadata['error'] = str(e)
-    
-    elif file_type == 'pdf':
-        try:
-            metadata['file_type'] = 'pdf'
-            metadata['size'] = os.path.getsize(file_path)
-        except Exception as e:
-            metadata['error'] = str(e)
-    
-    return metadata
+    """
+    Metadata read from the file headers only, see myapp.metadata
+    """
+    return metadata.extract(file_path)
 
 def analyze_image_metadata(image_path):
     try:
-        image = Image.open(image_path)
-        exif_data = image._getexif()
-        
-        if exif_data:
-            metadata = {}
-            for tag_id in exif_data:
-                tag = TAGS.get(tag_id, tag_id)
-                data = exif_data.get(tag_id)
-                if isinstance(data, bytes):
-                    data = data.decode()
-                metadata[tag] = data
-            
-            return {
-                'success': True,
-                'metadata': metadata,
-                'message': 'Meta veriler başarıyla analiz edildi'
-            }
-        else:
-            return {
-                'success': False,
-                'message': 'Resimde EXIF verisi bulunamadı'
-            }
-    except Exception as e:
+        exif = metadata.image_metadata(image_path).get('exif')
+    except (OSError, ValueError, SyntaxError) as e:
         return {
             'success': False,
             'message': f'Meta veri analizi başarısız: {str(e)}'
         }
+    if exif:
+        return {
+            'success': True,
+            'metadata': exif,
+            'message': 'Meta veriler başarıyla analiz edildi'
+        }
+    return {
+        'success': False,
+        'message': 'Resimde EXIF verisi bulunamadı'
+    }
 
 def check_scam_database(url):
     try:
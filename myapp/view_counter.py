@@ -0,0 +1,159 @@
+"""
+Buffered report view counting.
+
+view_report records a view in memory; the buffer is flushed every
+VIEW_COUNT_FLUSH_INTERVAL seconds (or once VIEW_COUNT_FLUSH_THRESHOLD views
+are pending) as one F() increment per report. The increments are applied
+atomically by the database, so any number of worker processes can flush
+their own buffers without losing counts, and QuerySet.update() leaves
+last_updated alone.
+
+Server processes start() the counter, see myapp.warmup, which also flushes
+on a timer while no views come in and once more when the process exits.
+Views are only ever written to the database they were recorded against, so
+a counter left over from a test or benchmark run never touches the real one.
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+
+from .models import ScamReport
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCounter:
+
+    def __init__(self, flush_interval=None, flush_threshold=None):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self._pending = Counter()
+        self._pending_total = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._retry_after = 0
+        self._database = None
+        self._timer = None
+        self._stopping = threading.Event()
+
+    def _interval(self):
+        if self.flush_interval is not None:
+            return self.flush_interval
+        return getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 10)
+
+    def _threshold(self):
+        if self.flush_threshold is not None:
+            return self.flush_threshold
+        return getattr(settings, 'VIEW_COUNT_FLUSH_THRESHOLD', 100)
+
+    def record(self, report_id, count=1):
+        with self._lock:
+            if not self._pending_total:
+                self._database = connection.settings_dict['NAME']
+            self._pending[report_id] += count
+            self._pending_total += count
+            now = time.monotonic()
+            due = now >= self._retry_after and (
+                self._pending_total >= self._threshold() or
+                now - self._last_flush >= self._interval()
+            )
+        if due:
+            self.flush(blocking=False)
+
+    def pending(self, report_id):
+        with self._lock:
+            return self._pending.get(report_id, 0)
+
+    def flush(self, blocking=True):
+        """
+        Write buffered views to the database, returns the number of reports updated.
+
+        With blocking=False the call returns immediately if another thread
+        is already flushing.
+        """
+        if not self._flush_lock.acquire(blocking=blocking):
+            return 0
+        try:
+            with self._lock:
+                batch = self._pending
+                self._pending = Counter()
+                self._pending_total = 0
+                self._last_flush = time.monotonic()
+            if not batch:
+                return 0
+            if connection.settings_dict['NAME'] != self._database:
+                logger.warning('Dropping %d buffered report views of another database', sum(batch.values()))
+                return 0
+
+            try:
+                with transaction.atomic():
+                    for report_id, count in batch.items():
+                        ScamReport.objects.filter(id=report_id).update(
+                            views=F('views') + count,
+                            view_count=F('view_count') + count
+                        )
+            except DatabaseError as e:
+                logger.warning('Flushing %d buffered report views failed: %s', sum(batch.values()), e)
+                with self._lock:
+                    self._pending.update(batch)
+                    self._pending_total += sum(batch.values())
+                    # Keep buffering for a moment instead of retrying on every view
+                    self._retry_after = time.monotonic() + min(self._interval(), 1)
+                return 0
+            return len(batch)
+        finally:
+            self._flush_lock.release()
+
+    def reset(self):
+        """
+        Drop the buffered views
+        """
+        with self._lock:
+            self._pending = Counter()
+            self._pending_total = 0
+
+    def start(self):
+        """
+        Flush every VIEW_COUNT_FLUSH_INTERVAL seconds from a background
+        thread and on exit, until stop() is called
+        """
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._stopping.clear()
+            self._timer = threading.Thread(target=self._flush_periodically, name='view-counter', daemon=True)
+            self._timer.start()
+        atexit.register(self.stop)
+
+    def stop(self, flush=True):
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is None:
+            return
+        atexit.unregister(self.stop)
+        self._stopping.set()
+        timer.join()
+        if flush:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing buffered report views failed')
+
+    def _flush_periodically(self):
+        while not self._stopping.wait(self._interval()):
+            try:
+                self.flush(blocking=False)
+            except Exception:
+                logger.exception('Flushing buffered report views failed')
+            finally:
+                connection.close()
+
+
+view_counter = ViewCounter()
@@ -1,17 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import login, logout, authenticate
 from django.db.models import Q
-from .models import ScamReport, ScamEvidence, ReportComment, UserProfile, ReportEvidence, Donation
+from .models import ScamReport, ScamEvidence, ReportComment, ReportEvidence, Donation, ReportVote, UploadSession
 from .forms import (
     ScamReportForm, ScamEvidenceForm, CommentForm, EvidenceForm, DonationForm,
     CustomLoginForm, CustomSignUpForm, CustomPasswordResetForm
 )
-from .utils import analyze_url, extract_metadata
+from .utils import extract_metadata
+from .jobs import enqueue_report_analysis
+from .view_counter import view_counter
+from .fragments import render_fragments
+from .context_processors import get_profile
+from .search import search_reports
+from .pagination import paginate, page_url
+from . import metrics, uploads, urlcanon
+from .domain_filter import domain_filter
+from .domain_index import domain_index
 import os
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 import time
 from django.utils import timezone
 from django.contrib.auth.tokens import default_token_generator
@@ -20,6 +31,7 @@ from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
 from django.utils.encoding import force_bytes, force_str
 from django.contrib.auth.models import User
+import json
 
 def home(request):
     return render(request, 'home.html')
@@ -38,8 +50,12 @@ def submit_report(request):
             report.is_blacklisted = False
             report.is_public = True
             report.status = 'pending'
+            already_reported = domain_filter.is_reported(report.scam_url)
             report.save()
+            enqueue_report_analysis(report)
             messages.success(request, 'Report submitted successfully!')
+            if already_reported:
+                messages.info(request, f'{already_reported} had already been reported, your report adds to the evidence.')
             return redirect('my_reports')
     else:
         form = ScamReportForm()
@@ -66,15 +82,103 @@ def upload_evidence(request, report_id):
         'report': report
     })
 
-def view_report(request, report_id):
+def _upload_error(error):
+    return JsonResponse({'success': False, 'error': str(error), 'offset': error.offset}, status=error.status)
+
+def _upload_state(upload):
+    return {
+        'success': True,
+        'upload_id': str(upload.id),
+        'offset': upload.received,
+        'size': upload.size,
+        'complete': upload.completed_at is not None,
+        'chunk_size': uploads.max_chunk_size(),
+    }
+
+@login_required
+def start_upload(request, report_id):
+    """
+    Open a chunked upload: POST {"filename", "size", "title", "description",
+    "target": "evidence" or "scam_evidence"}
+    """
     report = get_object_or_404(ScamReport, id=report_id)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        data = json.loads(request.body)
+        upload = uploads.start(
+            request.user, report, data.get('filename'), data.get('size'), target=data.get('target', 'evidence'),
+            title=data.get('title', ''), description=data.get('description', ''),
+        )
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Expected a JSON object'}, status=400)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(_upload_state(upload), status=201)
+
+@login_required
+def upload_status(request, upload_id):
+    """
+    GET the offset to resume from, DELETE to abandon the upload
+    """
+    upload = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    if request.method == 'DELETE':
+        uploads.abort(upload)
+        return JsonResponse({'success': True})
+    return JsonResponse(_upload_state(upload))
+
+@login_required
+def upload_chunk(request, upload_id):
+    """
+    POST the raw bytes of the next chunk, starting at the Upload-Offset header
+    """
+    upload = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse(
+            {'success': False, 'error': 'Upload-Offset and Content-Length are required', 'offset': upload.received},
+            status=400
+        )
+    try:
+        # The body is streamed to disk, never loaded as a whole
+        uploads.append(upload, offset, request, length)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse(_upload_state(upload))
+
+@login_required
+def finish_upload(request, upload_id):
+    """
+    POST {"sha256": optional hex digest to check} once every byte is sent
+    """
+    upload = get_object_or_404(UploadSession.objects.select_related('report', 'user'), id=upload_id, user=request.user)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        sha256 = json.loads(request.body or '{}').get('sha256') or ''
+        uploads.finish(upload, str(sha256))
+    except (ValueError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Expected a JSON object'}, status=400)
+    except uploads.UploadError as e:
+        return _upload_error(e)
+    return JsonResponse({
+        **_upload_state(upload),
+        'sha256': upload.sha256,
+        'redirect': reverse('view_report', args=[upload.report_id]),
+    })
+
+def view_report(request, report_id):
+    # Comments, evidence and donations are only loaded to render fragments
+    # missing from the fragment cache
+    report = get_object_or_404(ScamReport.objects.select_related('reporter'), id=report_id)
     
-    # Increment view count
-    report.views += 1
-    report.save()
-    
-    # Analyze URL
-    url_analysis = analyze_url(report.scam_url)
+    # Count the view; buffered views are written in batches
+    view_counter.record(report.id)
+    report.views += view_counter.pending(report.id)
     
     # Handle evidence submission
     if request.method == 'POST' and request.user.is_authenticated:
@@ -88,35 +192,53 @@ def view_report(request, report_id):
             return redirect('view_report', report_id=report.id)
     else:
         evidence_form = EvidenceForm()
-    
+    return _report_page(request, report, evidence_form=evidence_form)
+
+def _report_page(request, report, **forms):
+    """
+    view_report.html with the cached fragments of the report; the evidence
+    form is a blank one unless given
+    """
     context = {
         'report': report,
-        'evidence_form': evidence_form,
-        'url_analysis': url_analysis,
+        'evidence_form': EvidenceForm(),
+        **forms,
+        'fragments': render_fragments(report, request, moderate=request.user.is_staff),
     }
     return render(request, 'view_report.html', context)
 
+DOMAIN_LOOKUP_LIMIT = 50
+
+def _listing_page(request, reports, query=''):
+    """
+    One keyset page of a report listing, ranked by relevance when searching
+    """
+    reports = reports.for_list()
+    if query:
+        return paginate(request, search_reports(reports, query), keys=('-search_rank', '-id'))
+    return paginate(request, reports)
+
+
+def _page_context(request, page):
+    return {
+        'reports': page,
+        'next_url': page_url(request, page.next_cursor) if page.has_next else None,
+        'first_url': page_url(request, None) if request.GET.get('cursor') else None,
+    }
+
+
 @login_required
 def my_reports(request):
-    reports = ScamReport.objects.filter(reporter=request.user).order_by('-submission_date')
-    return render(request, 'my_reports.html', {'reports': reports})
+    page = _listing_page(request, ScamReport.objects.filter(reporter=request.user))
+    return render(request, 'my_reports.html', _page_context(request, page))
 
 def public_reports(request):
-    reports = ScamReport.objects.filter(is_public=True).order_by('-submission_date')
-    
-    # Search functionality
+    # Search functionality, results are ranked by relevance
     search_query = request.GET.get('q')
-    if search_query:
-        reports = reports.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(report_type__icontains=search_query)
-        )
+    page = _listing_page(request, ScamReport.objects.filter(is_public=True), search_query)
     
-    context = {
-        'reports': reports,
-        'search_query': search_query
-    }
+    context = _page_context(request, page)
+    context['search_query'] = search_query
     return render(request, 'public_reports.html', context)
 
 def scam_websites(request):
@@ -125,40 +247,135 @@ def scam_websites(request):
     
     reports = ScamReport.objects.filter(is_public=True)
     
-    if query:
-        reports = reports.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(scam_url__icontains=query)
-        )
-    
     if report_type:
         reports = reports.filter(report_type=report_type)
     
-    reports = reports.order_by('-submission_date')
-    
-    context = {
-        'reports': reports,
+    context = _page_context(request, _listing_page(request, reports, query))
+    context.update({
         'query': query,
         'selected_type': report_type
-    }
+    })
     return render(request, 'scam_websites.html', context)
 
+def reports_api(request):
+    """
+    JSON listing of public reports, paginated with ?cursor= like the HTML views
+    """
+    reports = ScamReport.objects.filter(is_public=True)
+    report_type = request.GET.get('type')
+    if report_type:
+        reports = reports.filter(report_type=report_type)
+    page = _listing_page(request, reports, request.GET.get('q', ''))
+    return JsonResponse({
+        'results': [
+            {
+                'id': report.id,
+                'title': report.title,
+                'excerpt': report.excerpt,
+                'report_type': report.report_type,
+                'status': report.status,
+                'scam_url': report.scam_url,
+                'submission_date': report.submission_date.isoformat(),
+                'url': reverse('view_report', args=[report.id]),
+            }
+            for report in page
+        ],
+        'next_cursor': page.next_cursor,
+    })
+
+def domain_lookup(request):
+    """
+    Answer "has this site been reported?" for ?url= with exact, subdomain and
+    parent-domain matches, each found with a seek on the domain_key index
+    """
+    host, registrable = urlcanon.split_url(request.GET.get('url', ''))
+    if not host:
+        return JsonResponse({'success': False, 'error': 'Invalid URL'}, status=400)
+
+    parents = urlcanon.parent_domains(host)
+    lower, upper = urlcanon.subdomain_range(host)
+    reports = ScamReport.objects.filter(is_public=True).filter(
+        Q(domain_key__in=[urlcanon.domain_key(parent) for parent in parents]) |
+        Q(domain_key__gt=lower, domain_key__lt=upper)
+    ).only('id', 'title', 'domain', 'status', 'submission_date').order_by('-submission_date', '-id')
+
+    matches = []
+    for report in reports[:DOMAIN_LOOKUP_LIMIT]:
+        if report.domain == host:
+            match = 'exact'
+        elif report.domain in parents:
+            match = 'parent'
+        else:
+            match = 'subdomain'
+        matches.append({
+            'id': report.id,
+            'title': report.title,
+            'domain': report.domain,
+            'status': report.status,
+            'match': match,
+            'url': reverse('view_report', args=[report.id]),
+        })
+    return JsonResponse({
+        'success': True,
+        'host': host,
+        'registrable_domain': registrable,
+        'reported': bool(matches),
+        'matches': matches,
+    })
+
+def already_reported(request):
+    """
+    Hint for the submit form, answered from the in-process domain filter
+    """
+    domain = domain_filter.is_reported(request.GET.get('url', ''))
+    return JsonResponse({'reported': domain is not None, 'domain': domain})
+
+
+def prometheus_metrics(request):
+    """
+    Request histograms of this worker in the Prometheus text format, for
+    staff, the METRICS_TOKEN bearer and allowed addresses only
+    """
+    if not metrics.can_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+def check_urls(request):
+    """
+    Bulk verdicts for partner integrations: POST {"urls": [...]} with up to
+    URL_CHECK_MAX_URLS URLs, answered from the in-memory domain index
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+    try:
+        urls = json.loads(request.body).get('urls')
+    except (ValueError, AttributeError):
+        urls = None
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return JsonResponse({'success': False, 'error': 'Expected {"urls": [...]}'}, status=400)
+    max_urls = getattr(settings, 'URL_CHECK_MAX_URLS', 10000)
+    if len(urls) > max_urls:
+        return JsonResponse({'success': False, 'error': f'At most {max_urls} URLs per request'}, status=400)
+
+    # results[i] is the verdict for urls[i]
+    return JsonResponse(
+        {'success': True, 'results': domain_index.check_urls(urls)},
+        json_dumps_params={'separators': (',', ':')}
+    )
+
 @login_required
 def profile(request):
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-    except UserProfile.DoesNotExist:
-        profile = None
-    
     context = {
-        'profile': profile
+        # Loaded with the session user, see ProfileModelBackend
+        'profile': get_profile(request.user)
     }
     return render(request, 'profile.html', context)
 
 @login_required
 def add_comment(request, report_id):
-    report = get_object_or_404(ScamReport, id=report_id)
+    report = get_object_or_404(ScamReport.objects.select_related('reporter'), id=report_id)
     if request.method == 'POST':
         form = CommentForm(request.POST)
         if form.is_valid():
@@ -170,11 +387,11 @@ def add_comment(request, report_id):
             return redirect('view_report', report_id=report.id)
     else:
         form = CommentForm()
-    return render(request, 'view_report.html', {'report': report, 'comment_form': form})
+    return _report_page(request, report, comment_form=form)
 
 @login_required
 def add_evidence(request, report_id):
-    report = get_object_or_404(ScamReport, id=report_id)
+    report = get_object_or_404(ScamReport.objects.select_related('reporter'), id=report_id)
     if request.method == 'POST':
         form = EvidenceForm(request.POST, request.FILES)
         if form.is_valid():
@@ -186,7 +403,39 @@ def add_evidence(request, report_id):
             return redirect('view_report', report_id=report.id)
     else:
         form = EvidenceForm()
-    return render(request, 'view_report.html', {'report': report, 'evidence_form': form})
+    return _report_page(request, report, evidence_form=form)
+
+@login_required
+def vote_report(request, report_id):
+    report = get_object_or_404(ScamReport, id=report_id)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required'}, status=405)
+
+    try:
+        vote_type = json.loads(request.body or '{}').get('vote_type')
+    except (ValueError, AttributeError):
+        vote_type = request.POST.get('vote_type')
+    if vote_type not in dict(ReportVote.VOTE_CHOICES):
+        return JsonResponse({'success': False, 'error': 'Invalid vote type'}, status=400)
+
+    # Voting the same way twice withdraws the vote
+    vote = ReportVote.objects.filter(report=report, user=request.user).first()
+    if vote is None:
+        ReportVote.objects.create(report=report, user=request.user, vote_type=vote_type)
+    elif vote.vote_type == vote_type:
+        vote.delete()
+        vote_type = None
+    else:
+        vote.vote_type = vote_type
+        vote.save(update_fields=['vote_type'])
+
+    report.refresh_from_db(fields=['upvotes', 'downvotes'])
+    return JsonResponse({
+        'success': True,
+        'upvotes': report.upvotes,
+        'downvotes': report.downvotes,
+        'user_vote': vote_type
+    })
 
 @login_required
 def verify_comment(request, comment_id):
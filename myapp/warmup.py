@@ -0,0 +1,30 @@
+"""
+Work done once per worker process before it serves requests, called from
+the WSGI modules so management commands don't pay for it.
+"""
+import gc
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    from .view_counter import view_counter
+
+    view_counter.start()
+    if not getattr(settings, 'DOMAIN_FILTER_WARM_UP', True):
+        return
+    from .domain_filter import domain_filter
+    from .domain_index import domain_index
+
+    try:
+        domain_filter.refresh(full=True)
+        domain_index.refresh(full=True)
+    except Exception:
+        logger.exception('Loading the domain filter at startup failed, it will load on first use')
+    # Objects alive now live as long as the worker; freezing them keeps full
+    # garbage collections from rescanning the app and the loaded indexes
+    gc.collect()
+    gc.freeze()
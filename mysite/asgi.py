@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# Start the view counter and load the in-memory domain filter before the first request
+from myapp.warmup import warm_up  # noqa: E402
+
+warm_up()
@@ -3,4 +3,9 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'scam_project.settings')
 
-application = get_wsgi_application() 
\ No newline at end of file
+application = get_wsgi_application()
+
+# Start the view counter and load the in-memory domain filter before the first request
+from myapp.warmup import warm_up  # noqa: E402
+
+warm_up()